@@ -0,0 +1,37 @@
+import os
+
+from llama_index.llms.openai import OpenAI
+from llama_index.core import Settings
+from llama_index.core.callbacks import CallbackManager
+
+from ..utils.conversation import Conversation
+from ..utils.llm_client import http_client
+from ..utils.stage_timer import stage_timer
+from ..utils.token_counter import DEFAULT_MODEL
+
+def setup_llm(token_counter):
+    """Initialize and configure LLM"""
+    Settings.callback_manager = CallbackManager([token_counter, stage_timer])
+    # The chat handler's completion cache only serves temperature 0, where
+    # completions are deterministic; a higher WHISK_LLM_TEMPERATURE turns it off
+    llm = OpenAI(
+        model=DEFAULT_MODEL,
+        temperature=float(os.getenv("WHISK_LLM_TEMPERATURE", "0")),
+        # Pooled, rate-limit aware client; retries are scheduled like first attempts
+        async_http_client=http_client(),
+        timeout=float(os.getenv("WHISK_LLM_TIMEOUT", "60")),
+        max_retries=int(os.getenv("WHISK_LLM_MAX_RETRIES", "2"))
+    )
+    Settings.llm = llm
+    return llm
+
+async def complete_chat(llm, conversation: Conversation, token_counter=None) -> str:
+    """Send ``conversation`` to ``llm`` and return the reply text.
+
+    With ``token_counter`` the call runs on a copy of the shared ``llm`` that
+    reports to it, so concurrent requests count only their own tokens.
+    """
+    if token_counter is not None:
+        llm = llm.model_copy(update={"callback_manager": CallbackManager([token_counter, stage_timer])})
+    response = await llm.achat(conversation.chat_messages())
+    return response.message.content
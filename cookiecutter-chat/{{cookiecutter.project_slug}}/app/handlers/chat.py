@@ -3,12 +3,11 @@ from whisk.kitchenai_sdk.schema import (
     WhiskQueryBaseResponseSchema,
     TokenCountSchema
 )
-from llama_index.core.callbacks import TokenCountingHandler
-import tiktoken
 
-token_counter = TokenCountingHandler(
-    tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-)
+from ..dependencies.llm import complete_chat
+from ..utils.completion_cache import completion_cache
+from ..utils.conversation import Conversation
+from ..utils.token_counter import create_token_counter
 
 async def chat_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) -> WhiskQueryBaseResponseSchema:
     """Chat handler for personality-based responses.
@@ -28,29 +27,35 @@ async def chat_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
         WhiskQueryBaseResponseSchema: Response containing:
             - input (str): Original message
             - output (str): Generated response
-            - metadata (dict): Response metadata
+            - metadata (dict): Response metadata, including whether the
+              completion cache was a hit, miss or bypassed
             - token_counts (TokenCountSchema): Token usage stats
             - messages (list): Updated chat history
     """
     try:
-        # Prepare chat history
-        messages = data.messages or []
-        
-        # Add system prompt if provided
-        if system_prompt and not messages:
-            messages.append({"role": "system", "content": system_prompt})
-            
+        # Each request counts its own tokens; counts are reported to
+        # callers, so they are always exact
+        token_counter = create_token_counter(exact=True)
+
+        # Build on the chat history without copying or modifying it; the
+        # static system prompt leads unless the history already has one
+        messages = Conversation(data.messages, system_prompt=system_prompt)
+
         # Add user message
-        messages.append({"role": "user", "content": data.query})
+        messages.append("user", data.query)
         
-        # Get response from LLM
-        response = await llm.acomplete(
-            messages=messages,
-            callbacks=[token_counter]
-        )
+        # Reuse the completion of an identical conversation when sampling
+        # is deterministic, otherwise get response from LLM
+        cache_key = completion_cache.key(llm, messages)
+        reply = completion_cache.get(cache_key) if cache_key else None
+        cache_status = "hit" if reply is not None else ("miss" if cache_key else "bypass")
+        if reply is None:
+            reply = await complete_chat(llm, messages, token_counter)
+            if cache_key:
+                completion_cache.put(cache_key, reply)
         
         # Add assistant response to history
-        messages.append({"role": "assistant", "content": response.response})
+        messages.append("assistant", reply)
         
         # Get token counts
         token_counts = TokenCountSchema(
@@ -58,22 +63,24 @@ async def chat_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
             llm_completion_tokens=token_counter.completion_llm_token_count,
             total_llm_tokens=token_counter.total_llm_token_count
         )
-        token_counter.reset_counts()
+        prefix_counts = token_counter.prefix_counts()
         
-        # Prepare metadata
+        # Prepare metadata, including how much of the prompt was the
+        # cacheable static prefix
         metadata = {
-            "token_counts": token_counts.dict(),
-            "personality": "{{ cookiecutter.personality }}"
+            "token_counts": {**token_counts.dict(), **prefix_counts},
+            "personality": "{{ cookiecutter.personality }}",
+            "completion_cache": cache_status
         }
         if data.metadata:
             metadata.update(data.metadata)
             
         return WhiskQueryBaseResponseSchema(
             input=data.query,
-            output=response.response,
+            output=reply,
             metadata=metadata,
             token_counts=token_counts,
-            messages=messages
+            messages=messages.to_list()
         )
             
     except Exception as e:
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# LLM attributes that change the completion for the same messages
+KEY_PARAMS = ("model", "temperature", "top_p", "max_tokens", "seed", "additional_kwargs")
+
+def normalize_messages(messages) -> list:
+    """Lowercased roles and content stripped of surrounding whitespace, so
+    trivially different requests share an entry. Inner whitespace is kept:
+    it can change the completion (code, tables, poetry)"""
+    return [
+        [str(message["role"]).lower(), str(message["content"]).strip()]
+        for message in messages
+    ]
+
+def sampling_params(llm) -> dict:
+    return {name: getattr(llm, name) for name in KEY_PARAMS if getattr(llm, name, None) is not None}
+
+def is_deterministic(params: dict) -> bool:
+    """Only greedy decoding returns the same completion for the same prompt"""
+    return params.get("temperature") == 0
+
+class CompletionCache:
+    """Exact-match cache of chat completions.
+
+    Entries live in an in-memory LRU and, when ``path`` is set, in a SQLite
+    file that every worker on the host reads and writes, so a completion
+    paid for by one worker is reused by the others. Only deterministic
+    sampling settings (temperature 0) are cached. Writes prune the file at
+    most every ``prune_interval`` seconds: expired rows are deleted and the
+    oldest rows beyond ``max_disk_entries`` are evicted.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        path: str | None = None,
+        ttl: float = 86400.0,
+        max_disk_entries: int = 100000,
+        prune_interval: float = 60.0
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.pruned = 0
+        self._pruned_at = 0.0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self.configure(path)
+
+    def configure(self, path: str):
+        """Add the on-disk tier at ``path``"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        # WAL lets workers read while another one writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, completion TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS completions_created_at ON completions (created_at)")
+        db.commit()
+        with self._lock:
+            self._db = db
+
+    def key(self, llm, messages) -> str | None:
+        """Cache key for ``messages`` on ``llm``, None when not cacheable"""
+        params = sampling_params(llm)
+        if not is_deterministic(params):
+            return None
+        payload = json.dumps(
+            {"params": params, "messages": normalize_messages(messages)},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            if key in self._entries:
+                completion, created_at = self._entries[key]
+                if time.time() - created_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return completion
+                del self._entries[key]
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT completion, created_at FROM completions WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Completion cache read failed: {str(e)}")
+                    row = None
+                if row and time.time() - row[1] < self.ttl:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, completion: str):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, completion, created_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO completions VALUES (?, ?, ?)",
+                        (key, completion, created_at)
+                    )
+                    if created_at - self._pruned_at >= self.prune_interval:
+                        self._prune(created_at)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Completion cache write failed: {str(e)}")
+
+    def _prune(self, now: float):
+        """Delete expired rows, then the oldest rows over ``max_disk_entries``"""
+        self._pruned_at = now
+        expired = self._db.execute(
+            "DELETE FROM completions WHERE created_at < ?", (now - self.ttl,)
+        ).rowcount
+        evicted = self._db.execute(
+            "DELETE FROM completions WHERE key NOT IN ("
+            "SELECT key FROM completions ORDER BY created_at DESC LIMIT ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        self.pruned += expired + evicted
+
+    def _remember(self, key: str, completion: str, created_at: float):
+        self._entries[key] = (completion, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "pruned": self.pruned,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+completion_cache = CompletionCache(
+    max_entries=int(os.getenv("WHISK_COMPLETION_CACHE_SIZE", "1024")),
+    path=os.getenv("WHISK_COMPLETION_CACHE_PATH") or None,
+    ttl=float(os.getenv("WHISK_COMPLETION_CACHE_TTL", "86400")),
+    max_disk_entries=int(os.getenv("WHISK_COMPLETION_CACHE_DISK_SIZE", "100000"))
+)
+metrics.register_gauges("whisk_completion_cache", completion_cache.stats)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+from llama_index.core.llms import ChatMessage
+
+from .prompts import StaticPrompt, find_prompt
+
+class ConversationView(Sequence):
+    """Read-only window onto a conversation, without copying its messages"""
+
+    __slots__ = ("_conversation", "_range")
+
+    def __init__(self, conversation, indices: range):
+        self._conversation = conversation
+        self._range = indices
+
+    def __len__(self) -> int:
+        return len(self._range)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ConversationView(self._conversation, self._range[index])
+        return self._conversation[self._range[index]]
+
+class Conversation(Sequence):
+    """Append-only chat history of ``{"role", "content"}`` messages.
+
+    The caller's ``history`` is referenced, never modified or copied;
+    messages added while handling a request go to a separate tail. The
+    optional system prompt is kept as a fixed first message, unless the
+    history already starts with one, so the same static text leads every
+    request and the provider's prompt cache can serve it.
+
+    ``chat_messages()`` converts each message to a llama-index
+    ``ChatMessage`` only once, so repeated LLM calls on a growing
+    conversation (e.g. the steps of the ReAct loop, or turns on a long-lived
+    memory) convert only what was appended since the last call.
+    """
+
+    __slots__ = ("_prompt", "_head", "_history", "_tail", "_chat")
+
+    def __init__(self, history: Sequence | None = None, system_prompt: str | None = None):
+        self._prompt = None
+        self._head = ()
+        self._history = history or ()
+        self._tail = []
+        self._chat = []
+        if not (self._history and self._history[0].get("role") == "system"):
+            self.system_prompt = system_prompt
+
+    @property
+    def system_prompt(self) -> str | None:
+        return self._prompt
+
+    @system_prompt.setter
+    def system_prompt(self, value: str | None):
+        if value == self._prompt and type(value) is type(self._prompt):
+            return
+        self._prompt = value or None
+        if isinstance(value, StaticPrompt):
+            # Share the prompt's prebuilt message instead of building one
+            self._head = (value.message,)
+        else:
+            self._head = ({"role": "system", "content": value},) if value else ()
+        # Positions shift, so convert everything again on the next call
+        self._chat = []
+
+    def append(self, role: str, content: str) -> dict:
+        message = {"role": role, "content": content}
+        self._tail.append(message)
+        return message
+
+    def clear(self):
+        """Drop the history and appended messages, keeping the system prompt"""
+        self._history = ()
+        self._tail = []
+        self._chat = self._chat[:len(self._head)]
+
+    def __len__(self) -> int:
+        return len(self._head) + len(self._history) + len(self._tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ConversationView(self, range(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation index out of range")
+        if index < len(self._head):
+            return self._head[index]
+        index -= len(self._head)
+        if index < len(self._history):
+            return self._history[index]
+        return self._tail[index - len(self._history)]
+
+    def __iter__(self):
+        yield from self._head
+        yield from self._history
+        yield from self._tail
+
+    @property
+    def turns(self) -> ConversationView:
+        """Every message after the system prompt"""
+        return self[len(self._head):]
+
+    @property
+    def appended(self) -> ConversationView:
+        """Messages added since the conversation was created"""
+        return self[len(self) - len(self._tail):]
+
+    def chat_messages(self) -> list:
+        """The conversation as llama-index messages; treat the list as read-only"""
+        for index in range(len(self._chat), len(self)):
+            message = self[index]
+            prompt = find_prompt(message["content"]) if index == 0 and message["role"] == "system" else None
+            if prompt is not None:
+                self._chat.append(prompt.chat_message)
+            else:
+                self._chat.append(ChatMessage(role=message["role"], content=message["content"]))
+        return self._chat
+
+    def to_list(self) -> list:
+        """Plain list for the response; the message dicts themselves are shared"""
+        return [*self._head, *self._history, *self._tail]
@@ -0,0 +1,60 @@
+import time
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType
+
+from .metrics import record_stage
+
+# llama-index events reported as handler stages
+EVENT_STAGES = {
+    CBEventType.CHUNKING: "split",
+    CBEventType.NODE_PARSING: "split",
+    CBEventType.EMBEDDING: "embed",
+    CBEventType.RETRIEVE: "retrieve",
+    CBEventType.SYNTHESIZE: "synthesize",
+    CBEventType.LLM: "llm",
+    CBEventType.FUNCTION_CALL: "tools",
+}
+
+class StageTimingHandler(BaseCallbackHandler):
+    """Times llama-index events as stages of the current request"""
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._started = {}
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        if event_type in EVENT_STAGES:
+            self._started[event_id] = time.perf_counter()
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        started = self._started.pop(event_id, None)
+        if started is not None:
+            record_stage(EVENT_STAGES[event_type], time.perf_counter() - started)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+stage_timer = StageTimingHandler()
@@ -0,0 +1,99 @@
+"""Offline load scenario for the chat handler.
+
+Runs the registered handler end to end, through the in-process transport,
+against a fake LLM with simulated latency:
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --turns 10
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+    python -m benchmarks.run --subscriber-workers 1
+
+With ``--baseline`` the exit code is 1 when the scenario regresses by more
+than ``--tolerance``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from whisk.kitchenai_sdk.schema import DependencyType
+
+from .fakes import fake_text, install_fakes
+from .harness import compare, load_baseline, run_load, save_baseline
+from .transport import LocalTransport
+
+SCENARIOS = ("chat",)
+
+def create_kitchen(args):
+    llm = install_fakes(llm_latency=args.llm_latency)
+
+    from app import main as app_main
+
+    app_main.kitchen.register_dependency(DependencyType.LLM, llm)
+    return app_main.kitchen
+
+def history(index: int, turns: int) -> list:
+    """Earlier turns of a conversation sent along with the query"""
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": fake_text(f"user-{index}-{turn}", 12)})
+        messages.append({"role": "assistant", "content": fake_text(f"assistant-{index}-{turn}", 48)})
+    return messages
+
+async def chat_scenario(transport, args) -> dict:
+    async def call(index):
+        return await transport.query(
+            "chat", fake_text(f"question-{index}", 8), messages=history(index, args.turns)
+        )
+    return await run_load("chat", call, range(args.requests), args.concurrency)
+
+async def run(args) -> list:
+    transport = LocalTransport(create_kitchen(args), max_workers=args.subscriber_workers)
+    return [await chat_scenario(transport, args)]
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Repeatable; defaults to all")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--subscriber-workers", type=int,
+                        help="Messages handled at once per subject, 1 for the stock WhiskClient; defaults to the worker's")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--turns", type=int, default=5, help="Earlier turns sent with each query")
+    parser.add_argument("--baseline", help="Compare against this JSON baseline")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+    args.scenario = args.scenario or list(SCENARIOS)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(
+                f"{result['scenario']:<10} {result['requests']:>6} req  {result['errors']:>4} err  "
+                f"{result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.1f} ms  "
+                f"p95 {result['p95_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  "
+                f"rss {result['peak_rss_mb']:>7.1f} MB"
+            )
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        regressions = [line for result in results for line in compare(result, baseline, args.tolerance)]
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+from app.utils.completion_cache import CompletionCache
+
+class GreedyLLM:
+    model = "gpt-3.5-turbo"
+    temperature = 0.0
+
+class SampledLLM(GreedyLLM):
+    temperature = 0.7
+
+MESSAGES = [
+    {"role": "system", "content": "You are Shakespeare."},
+    {"role": "user", "content": "Hello  there!"}
+]
+
+def test_completion_cache_hits_normalized_messages():
+    """Test that surrounding whitespace is ignored but inner whitespace is not"""
+    cache = CompletionCache(max_entries=2)
+    key = cache.key(GreedyLLM(), MESSAGES)
+    cache.put(key, "Good morrow!")
+
+    same = [dict(message) for message in MESSAGES]
+    same[1]["content"] = " Hello  there!\n"
+    spaced = [dict(message) for message in MESSAGES]
+    spaced[1]["content"] = "Hello there!"
+
+    assert cache.get(cache.key(GreedyLLM(), same)) == "Good morrow!"
+    assert cache.key(GreedyLLM(), spaced) != key
+    assert cache.stats()["hits"] == 1
+
+def test_completion_cache_skips_sampled_settings():
+    """Test that non-deterministic sampling is never cached"""
+    cache = CompletionCache()
+    assert cache.key(SampledLLM(), MESSAGES) is None
+
+def test_completion_cache_shares_disk_tier(tmp_path):
+    """Test that a second worker's cache reads completions from disk"""
+    path = str(tmp_path / "completions.sqlite3")
+    first, second = CompletionCache(path=path), CompletionCache(path=path)
+    key = first.key(GreedyLLM(), MESSAGES)
+    first.put(key, "Good morrow!")
+
+    assert second.get(key) == "Good morrow!"
+    assert second.stats()["disk_hits"] == 1
+
+def test_completion_cache_prunes_disk_tier(tmp_path):
+    """Test that writes delete expired rows and cap the row count"""
+    path = str(tmp_path / "completions.sqlite3")
+    cache = CompletionCache(path=path, ttl=60.0, max_disk_entries=2, prune_interval=0.0)
+    cache._db.execute("INSERT INTO completions VALUES ('stale', 'Adieu', 0)")
+    for index in range(3):
+        cache.put(f"key-{index}", f"completion {index}")
+
+    rows = cache._db.execute("SELECT key FROM completions ORDER BY created_at").fetchall()
+    assert [row[0] for row in rows] == ["key-1", "key-2"]
+    assert cache.stats()["pruned"] == 2
@@ -0,0 +1,31 @@
+from app.utils.conversation import Conversation
+
+HISTORY = [
+    {"role": "user", "content": "Who are you?"},
+    {"role": "assistant", "content": "I am a Shakespearean assistant."}
+]
+
+def test_conversation_leaves_history_untouched():
+    """Test that appending never modifies the caller's list"""
+    history = list(HISTORY)
+    conversation = Conversation(history, system_prompt="You are Shakespeare.")
+    conversation.append("user", "Hello!")
+
+    assert history == HISTORY
+    assert len(conversation) == 4
+    assert conversation[0]["role"] == "system"
+    assert list(conversation.turns) == [*HISTORY, {"role": "user", "content": "Hello!"}]
+    assert list(conversation.appended) == [{"role": "user", "content": "Hello!"}]
+    assert conversation.to_list()[1] is history[0]
+
+def test_conversation_converts_messages_once():
+    """Test that chat_messages only converts what was appended since the last call"""
+    conversation = Conversation(HISTORY)
+    first = conversation.chat_messages()
+    converted = list(first)
+    conversation.append("user", "Hello!")
+    second = conversation.chat_messages()
+
+    assert len(second) == 3
+    assert all(a is b for a, b in zip(converted, second))
+    assert second[-1].content == "Hello!"
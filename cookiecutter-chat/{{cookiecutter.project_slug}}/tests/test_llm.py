@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from llama_index.core.callbacks import TokenCountingHandler
+from llama_index.core.llms import MockLLM
+
+from app.dependencies.llm import complete_chat
+from app.utils.conversation import Conversation
+
+@pytest.mark.asyncio
+async def test_concurrent_chats_count_their_own_tokens():
+    """Test that requests sharing one LLM each count only their own tokens"""
+    llm = MockLLM(max_tokens=4)
+    handlers = list(llm.callback_manager.handlers)
+
+    async def chat(text: str) -> TokenCountingHandler:
+        counter = TokenCountingHandler(tokenizer=str.split)
+        conversation = Conversation([], system_prompt="You are terse.")
+        conversation.append("user", text)
+        await complete_chat(llm, conversation, counter)
+        return counter
+
+    short, long = await asyncio.gather(chat("hi"), chat("tell me a much longer story please"))
+    alone = await chat("hi")
+
+    assert short.total_llm_token_count == alone.total_llm_token_count
+    assert long.prompt_llm_token_count > short.prompt_llm_token_count
+    assert llm.callback_manager.handlers == handlers
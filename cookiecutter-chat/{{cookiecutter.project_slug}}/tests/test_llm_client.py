@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.utils.llm_client import RateLimitScheduler, ScheduledTransport, create_http_client, llm_lane
+from benchmarks.mock_openai import MockOpenAI
+
+def client_for(scheduler, **kwargs) -> httpx.AsyncClient:
+    """Pooled client over a scheduled transport"""
+    return create_http_client(ScheduledTransport(scheduler, httpx.AsyncHTTPTransport(), **kwargs))
+
+def chat_body(content: str) -> dict:
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": content}], "max_tokens": 16}
+
+@pytest.mark.asyncio
+async def test_interactive_requests_go_first():
+    """Test that queued interactive requests are admitted before batch requests"""
+    scheduler = RateLimitScheduler(rpm=600, tpm=1_000_000, burst_seconds=0.1)
+    order = []
+
+    async def request(name, lane):
+        await scheduler.acquire(10, lane)
+        order.append(name)
+
+    # The single burst slot goes to the first request, the rest queue
+    tasks = [asyncio.create_task(request(f"batch-{i}", "batch")) for i in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(request("interactive", "interactive")))
+    await asyncio.gather(*tasks)
+
+    assert order[0] == "batch-0"
+    assert order[1] == "interactive"
+    assert scheduler.stats()["admitted_batch"] == 3
+
+@pytest.mark.asyncio
+async def test_rate_limit_response_pauses_requests():
+    """Test that a 429 holds back requests until its Retry-After has passed"""
+    scheduler = RateLimitScheduler(rpm=6000, tpm=1_000_000)
+    with MockOpenAI(latency=0.0, throttle_first=1, retry_after=0.2) as mock:
+        async with client_for(scheduler, hedging=False) as client:
+            throttled = await client.post(f"{mock.url}/chat/completions", json=chat_body("hello"))
+            started = time.monotonic()
+            served = await client.post(f"{mock.url}/chat/completions", json=chat_body("hello"))
+
+    assert throttled.status_code == 429
+    assert served.status_code == 200
+    assert time.monotonic() - started >= 0.15
+    assert scheduler.stats()["throttled"] == mock.throttled == 1
+
+@pytest.mark.asyncio
+async def test_slow_interactive_request_is_hedged():
+    """Test that a second attempt answers when the first one is slow"""
+    scheduler = RateLimitScheduler(rpm=6000, tpm=1_000_000)
+    transport = ScheduledTransport(scheduler, httpx.AsyncHTTPTransport(), hedge_after=0.05)
+    with MockOpenAI(latency=lambda index: 2.0 if index == 0 else 0.01) as mock:
+        async with create_http_client(transport) as client:
+            started = time.monotonic()
+            response = await client.post(f"{mock.url}/chat/completions", json=chat_body("hello"))
+            elapsed = time.monotonic() - started
+
+            # Batch requests are never hedged
+            with llm_lane("batch"):
+                await client.post(f"{mock.url}/embeddings", json={"model": "m", "input": ["text"]})
+
+    assert response.status_code == 200
+    assert elapsed < 1.0
+    assert transport.stats()["hedged"] == 1
+    assert transport.stats()["hedge_wins"] == 1
+    assert len(mock.requests) == 3
+
+@pytest.mark.asyncio
+async def test_llama_index_openai_uses_the_client():
+    """Test that the llama-index OpenAI LLM talks through the scheduled client"""
+    from llama_index.core.llms import ChatMessage
+    from llama_index.llms.openai import OpenAI
+
+    scheduler = RateLimitScheduler(rpm=6000, tpm=1_000_000)
+    with MockOpenAI(latency=0.0) as mock:
+        async with client_for(scheduler) as client:
+            llm = OpenAI(model="gpt-4o-mini", api_key="sk-test", api_base=mock.url,
+                         async_http_client=client, max_retries=0)
+            response = await llm.achat([ChatMessage(role="user", content="What is whisk?")])
+
+    assert "What is whisk?" in response.message.content
+    assert scheduler.stats()["admitted_interactive"] == 1
@@ -0,0 +1,36 @@
+from app.utils import token_counter
+from app.utils.conversation import Conversation
+from app.utils.prompts import static_prompt, static_token_count
+
+class WordEncoding:
+    calls = 0
+
+    def encode(self, text: str) -> list:
+        self.calls += 1
+        return text.split()
+
+def test_static_prompt_is_tokenized_once(monkeypatch):
+    """Test that a registered prompt is shared and counted from its cached tokens"""
+    encoding = WordEncoding()
+    registry = token_counter.TokenizerRegistry()
+    registry.register(token_counter.DEFAULT_MODEL, encoding)
+    monkeypatch.setattr(token_counter, "tokenizers", registry)
+
+    prompt = static_prompt("You are Shakespeare, speak in verse.")
+
+    assert static_prompt("You are Shakespeare, speak in verse.") is prompt
+    assert static_token_count("You are Shakespeare, speak in verse.") == 6
+    assert prompt.token_count == 6
+    assert encoding.calls == 1
+    assert static_token_count("Not registered") is None
+
+def test_conversation_leads_with_static_prompt():
+    """Test that the static prompt leads and its prebuilt message is reused"""
+    prompt = static_prompt("You are a verse-only assistant.")
+    fresh = Conversation([{"role": "user", "content": "Hi"}], system_prompt=prompt)
+    returned = Conversation(fresh.to_list(), system_prompt=prompt)
+
+    assert fresh[0] is prompt.message
+    assert fresh.chat_messages()[0] is prompt.chat_message
+    assert len(returned) == len(fresh)
+    assert returned.chat_messages()[0] is prompt.chat_message
@@ -9,19 +9,21 @@ from langchain.memory import (
     ConversationSummaryMemory
 )
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from llama_index.core.callbacks import TokenCountingHandler
-import tiktoken
 from typing import List, Dict, Any, Optional
+import json
+import os
 
-token_counter = TokenCountingHandler(
-    tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-)
+from ..dependencies.llm import complete_chat
+from ..utils.conversation import Conversation
+from ..utils.token_counter import create_token_counter
 
 class MemoryManager:
     def __init__(self, memory_type: str = "{{ cookiecutter.memory_type }}", k: int = {{ cookiecutter.memory_k }}):
         self.memory_type = memory_type
         self.k = k
         self.memory = self._create_memory()
+        # Append-only copy of the chat memory that prompts are built from
+        self.conversation = Conversation()
         
     def _create_memory(self):
         if self.memory_type == "buffer":
@@ -38,19 +40,37 @@ class MemoryManager:
             self.memory.chat_memory.add_message(HumanMessage(content=message))
         else:
             self.memory.chat_memory.add_message(AIMessage(content=message))
+        self.conversation.append("user" if is_human else "assistant", message)
             
     def get_history(self) -> List[Dict[str, str]]:
-        return [
-            {"role": "user" if isinstance(msg, HumanMessage) else "assistant",
-             "content": msg.content}
-            for msg in self.memory.chat_memory.messages
-        ]
+        return list(self.conversation.turns)
         
     def clear(self):
         self.memory.clear()
+        self.conversation.clear()
+
+    def save(self, path: str):
+        """Write the conversation history to ``path`` as JSON"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.get_history(), f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """Restore conversation history saved by ``save``"""
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for message in json.load(f):
+                self.add_message(message["content"], is_human=message["role"] == "user")
+
+# Optional file the memory is persisted to across restarts
+MEMORY_PATH = os.getenv("WHISK_MEMORY_PATH")
 
 # Initialize memory manager
 memory_manager = MemoryManager()
+if MEMORY_PATH:
+    memory_manager.load(MEMORY_PATH)
 
 async def memory_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) -> WhiskQueryBaseResponseSchema:
     """Memory-based chat handler using Langchain memory types.
@@ -75,29 +95,23 @@ async def memory_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) -
             - messages (list): Updated chat history
     """
     try:
-        # Prepare messages
-        messages = []
-        
-        # Add system prompt if provided
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-            
-        # Add chat history from memory
-        messages.extend(memory_manager.get_history())
+        # Each request counts its own tokens; counts are reported to
+        # callers, so they are always exact
+        token_counter = create_token_counter(exact=True)
+
+        # Prompts are built from the memory's own conversation, so earlier
+        # turns are not copied again on every request
+        messages = memory_manager.conversation
+        messages.system_prompt = system_prompt
         
         # Add current message
-        messages.append({"role": "user", "content": data.query})
         memory_manager.add_message(data.query, is_human=True)
         
         # Get response from LLM
-        response = await llm.acomplete(
-            messages=messages,
-            callbacks=[token_counter]
-        )
+        reply = await complete_chat(llm, messages, token_counter)
         
         # Add response to memory
-        memory_manager.add_message(response.response, is_human=False)
-        messages.append({"role": "assistant", "content": response.response})
+        memory_manager.add_message(reply, is_human=False)
         
         # Get token counts
         token_counts = TokenCountSchema(
@@ -105,23 +119,24 @@ async def memory_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) -
             llm_completion_tokens=token_counter.completion_llm_token_count,
             total_llm_tokens=token_counter.total_llm_token_count
         )
-        token_counter.reset_counts()
+        prefix_counts = token_counter.prefix_counts()
         
-        # Prepare metadata
+        # Prepare metadata, including how much of the prompt was the
+        # cacheable static prefix
         metadata = {
-            "token_counts": token_counts.dict(),
+            "token_counts": {**token_counts.dict(), **prefix_counts},
             "memory_type": memory_manager.memory_type,
-            "memory_size": len(memory_manager.get_history())
+            "memory_size": len(messages.turns)
         }
         if data.metadata:
             metadata.update(data.metadata)
             
         return WhiskQueryBaseResponseSchema(
             input=data.query,
-            output=response.response,
+            output=reply,
             metadata=metadata,
             token_counts=token_counts,
-            messages=messages
+            messages=messages.to_list()
         )
             
     except Exception as e:
@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Scheduling lanes in priority order: requests a user is waiting on go
+# ahead of background work such as ingestion extractors
+LANES = ("interactive", "batch")
+
+# Completion tokens reserved for a chat request that sets no max_tokens
+COMPLETION_RESERVE = 256
+
+_lane = contextvars.ContextVar("whisk_llm_lane", default="interactive")
+
+@contextmanager
+def llm_lane(name: str):
+    """Send the LLM and embedding calls made in this block through lane ``name``"""
+    if name not in LANES:
+        raise ValueError(f"Unknown LLM lane {name!r}, expected one of {LANES}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane() -> str:
+    return _lane.get()
+
+def request_tokens(body: dict) -> int:
+    """Tokens an OpenAI request counts against the tokens-per-minute limit:
+    the estimated prompt plus the completion tokens it may generate"""
+    from .token_estimate import estimate_tokens
+
+    parts = []
+    for message in body.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts += [part.get("text", "") for part in content if isinstance(part, dict)]
+    texts = body.get("input", body.get("prompt"))
+    if isinstance(texts, str):
+        parts.append(texts)
+    elif isinstance(texts, list):
+        parts += [text for text in texts if isinstance(text, str)]
+
+    completion = body.get("max_tokens") or body.get("max_completion_tokens")
+    if completion is None:
+        completion = COMPLETION_RESERVE if "messages" in body else 0
+    return estimate_tokens("\n".join(parts)) + completion
+
+class TokenBucket:
+    """Refills ``per_minute`` units a minute, holding at most ``burst_seconds`` worth"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.burst_seconds = burst_seconds
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def set_rate(self, per_minute: float):
+        """Change the rate, keeping what is available now within the new capacity"""
+        self._refill(time.monotonic())
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * self.burst_seconds)
+        self.level = min(self.level, self.capacity)
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def limit_to(self, remaining: float):
+        """Follow the provider when it reports less headroom than we track"""
+        self.level = min(self.level, remaining)
+
+class RateLimitScheduler:
+    """Admits requests within the provider's requests- and tokens-per-minute
+    limits, serving the interactive lane before the batch lane.
+
+    Waiting here instead of at the provider keeps bursts from turning into
+    429s, and a 429 that still happens pauses every request until the
+    provider's Retry-After has passed, so retries do not pile up.
+    """
+
+    def __init__(self, rpm: float, tpm: float, burst_seconds: float = 10.0):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.paused_until = 0.0
+        self.admitted = {lane: 0 for lane in LANES}
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self._waiters = {lane: collections.deque() for lane in LANES}
+        self._task = None
+
+    def delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(self.paused_until - now, self.requests.delay(1, now), self.tokens.delay(tokens, now))
+
+    def _take(self, tokens: int, lane: str):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted[lane] += 1
+
+    async def acquire(self, tokens: int, lane: str = "interactive"):
+        """Wait until a request of ``tokens`` tokens may be sent"""
+        if not any(self._waiters.values()) and self.delay(tokens) == 0:
+            self._take(tokens, lane)
+            return
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append((tokens, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+        try:
+            await future
+        finally:
+            self.wait_seconds += time.monotonic() - started
+
+    def try_acquire(self, tokens: int, lane: str = "interactive") -> bool:
+        """Admit a request only if it needs no wait, e.g. a hedge"""
+        if any(self._waiters.values()) or self.delay(tokens) > 0:
+            return False
+        self._take(tokens, lane)
+        return True
+
+    async def _dispatch(self):
+        while True:
+            lane = next((lane for lane in LANES if self._waiters[lane]), None)
+            if lane is None:
+                return
+            tokens, future = self._waiters[lane][0]
+            if future.done():
+                # Cancelled while waiting
+                self._waiters[lane].popleft()
+                continue
+            delay = self.delay(tokens)
+            if delay > 0:
+                # Wake up often enough to let a newly queued interactive request go first
+                await asyncio.sleep(min(delay, 0.05))
+                continue
+            self._waiters[lane].popleft()
+            self._take(tokens, lane)
+            future.set_result(None)
+
+    def configure(self, rpm: float | None = None, tpm: float | None = None):
+        """Change the limits; queued requests are admitted at the new rates"""
+        if rpm:
+            self.requests.set_rate(rpm)
+        if tpm:
+            self.tokens.set_rate(tpm)
+
+    def observe(self, response: httpx.Response):
+        """Follow the provider's rate limit headers and back off on a 429"""
+        headers = response.headers
+        for header, bucket in (("x-ratelimit-remaining-requests", self.requests),
+                               ("x-ratelimit-remaining-tokens", self.tokens)):
+            try:
+                bucket.limit_to(float(headers[header]))
+            except (KeyError, ValueError):
+                pass
+        if response.status_code == 429:
+            self.throttled += 1
+            try:
+                retry_after = float(headers.get("retry-after-ms", "")) / 1000
+            except ValueError:
+                try:
+                    retry_after = float(headers.get("retry-after", "1"))
+                except ValueError:
+                    retry_after = 1.0
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            logger.warning(f"Provider rate limit hit, pausing LLM requests for {retry_after:.2f}s")
+
+    def stats(self) -> dict:
+        return {
+            **{f"queued_{lane}": len(waiters) for lane, waiters in self._waiters.items()},
+            **{f"admitted_{lane}": count for lane, count in self.admitted.items()},
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level)
+        }
+
+class ScheduledTransport(httpx.AsyncBaseTransport):
+    """HTTP transport that admits every request through the scheduler and
+    hedges slow interactive ones.
+
+    A non-streaming interactive request still running after ``hedge_after``
+    seconds is sent a second time if the rate limits allow it right away;
+    the first response wins and the other request is cancelled. With
+    ``hedge_after`` set to None the delay is the 95th percentile of recent
+    latencies once enough requests have been seen.
+    """
+
+    def __init__(self, scheduler: RateLimitScheduler, transport: httpx.AsyncBaseTransport,
+                 hedge_after: float | None = None, hedging: bool = True, max_connections: int | None = None):
+        self.scheduler = scheduler
+        self.transport = transport
+        self.max_connections = max_connections
+        self.hedge_after = hedge_after
+        self.hedging = hedging
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = collections.deque(maxlen=200)
+
+    def _hedge_delay(self) -> float | None:
+        if not self.hedging:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self._latencies) < 20:
+            return None
+        return sorted(self._latencies)[int(len(self._latencies) * 0.95)]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            body = json.loads(request.content or b"{}")
+        except (httpx.RequestNotRead, ValueError):
+            body = {}
+        tokens = request_tokens(body) if isinstance(body, dict) else 0
+        lane = current_lane()
+        await self.scheduler.acquire(tokens, lane)
+
+        started = time.monotonic()
+        delay = self._hedge_delay()
+        if delay is not None and lane == "interactive" and not body.get("stream"):
+            response = await self._hedged(request, tokens, delay)
+        else:
+            response = await self.transport.handle_async_request(request)
+        if not body.get("stream"):
+            self._latencies.append(time.monotonic() - started)
+        self.scheduler.observe(response)
+        return response
+
+    async def _hedged(self, request: httpx.Request, tokens: int, delay: float) -> httpx.Response:
+        first = asyncio.ensure_future(self.transport.handle_async_request(request))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done or not self.scheduler.try_acquire(tokens):
+                return await first
+
+            self.hedged += 1
+            second = asyncio.ensure_future(self.transport.handle_async_request(httpx.Request(
+                request.method, request.url, headers=request.headers,
+                content=request.content, extensions=request.extensions
+            )))
+            tasks.append(second)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self.hedge_wins += task is second
+                    return task.result()
+            raise error
+        finally:
+            # Cancel the losing request, or both when the caller gave up
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(_close_response)
+
+    def resize(self, max_connections: int, drain_seconds: float = 60.0):
+        """Send new requests through a pool of ``max_connections``. The old
+        pool is closed once requests already using it have had
+        ``drain_seconds`` to finish."""
+        if max_connections == self.max_connections:
+            return
+        old, self.transport = self.transport, create_pool(max_connections)
+        self.max_connections = max_connections
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on the event loop, e.g. while warming up: leave it to the garbage collector
+            return
+        loop.call_later(drain_seconds, lambda: asyncio.ensure_future(old.aclose()))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def stats(self) -> dict:
+        delay = self._hedge_delay()
+        return {
+            **self.scheduler.stats(),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_after_ms": round(delay * 1000, 1) if delay is not None else 0.0
+        }
+
+def _close_response(task: asyncio.Future):
+    # A losing hedge that completed anyway still holds a pooled connection
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+def _hedge_setting() -> tuple[float | None, bool]:
+    value = os.getenv("WHISK_LLM_HEDGE_AFTER", "auto").lower()
+    if value == "off":
+        return None, False
+    return (None if value == "auto" else float(value)), True
+
+def process_share() -> float:
+    """This process's share of the provider's limits; ``app.worker`` sets
+    WHISK_WORKER_COUNT in every worker it runs against the same API key"""
+    return 1.0 / max(1, int(os.getenv("WHISK_WORKER_COUNT", "1")))
+
+def create_transport(scheduler: RateLimitScheduler | None = None, **kwargs) -> ScheduledTransport:
+    """Scheduled transport over a connection pool, configured from the environment"""
+    scheduler = scheduler or RateLimitScheduler(
+        rpm=float(os.getenv("WHISK_LLM_RPM", "500")) * process_share(),
+        tpm=float(os.getenv("WHISK_LLM_TPM", "200000")) * process_share()
+    )
+    connections = int(os.getenv("WHISK_LLM_MAX_CONNECTIONS", "64"))
+    hedge_after, hedging = _hedge_setting()
+    return ScheduledTransport(
+        scheduler,
+        create_pool(connections),
+        **{"hedge_after": hedge_after, "hedging": hedging, "max_connections": connections, **kwargs}
+    )
+
+def create_pool(connections: int) -> httpx.AsyncHTTPTransport:
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections, keepalive_expiry=30.0)
+    return httpx.AsyncHTTPTransport(limits=limits)
+
+def create_http_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    timeout = float(os.getenv("WHISK_LLM_TIMEOUT", "60"))
+    return httpx.AsyncClient(transport=transport or create_transport(), timeout=httpx.Timeout(timeout, connect=5.0))
+
+_client = None
+_transport = None
+
+def http_client() -> httpx.AsyncClient:
+    """The process-wide pooled client shared by the LLM and embedding models"""
+    global _client, _transport
+    if _client is None:
+        _transport = create_transport()
+        _client = create_http_client(_transport)
+        metrics.register_gauges("whisk_llm_client", _transport.stats)
+    return _client
+
+def configure_http_client(rpm: float | None = None, tpm: float | None = None, max_connections: int | None = None):
+    """Change the rate limits and pool size of the shared client, if it was
+    created; ``rpm`` and ``tpm`` are the provider's limits for all workers"""
+    if _transport is None:
+        return
+    share = process_share()
+    _transport.scheduler.configure(rpm and rpm * share, tpm and tpm * share)
+    if max_connections:
+        _transport.resize(max_connections)
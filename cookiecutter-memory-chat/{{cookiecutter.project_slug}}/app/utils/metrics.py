@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Handler label, per-stage timings and stages being timed by ``stage`` for
+# the request running in this context
+_current = contextvars.ContextVar("whisk_request_timings", default=None)
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_gauges(self, prefix: str, collect):
+        """Export the numeric values of ``collect()`` as ``<prefix>_<key>`` gauges"""
+        self._gauges.append((prefix, collect))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self._counters}):
+                lines += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} counter"]
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+            for name in sorted({key[0] for key in self._histograms}):
+                lines += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} histogram"]
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for prefix, collect in self._gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Could not collect {prefix} metrics: {str(e)}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines += [f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {float(value)}"]
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+metrics = MetricsRegistry()
+
+def record_stage(name: str, seconds: float):
+    """Add ``seconds`` to stage ``name`` of the current request.
+
+    Ignored while an enclosing ``stage`` block already times ``name``.
+    """
+    current = _current.get()
+    if current is None or name in current[2]:
+        return
+    handler, timings, _ = current
+    timings[name] = timings.get(name, 0.0) + seconds
+    metrics.observe(
+        "whisk_stage_seconds", seconds, help="Time spent per handler stage",
+        handler=handler, stage=name
+    )
+
+@contextmanager
+def stage(name: str):
+    """Time a block of handler code as stage ``name``"""
+    current = _current.get()
+    if current is None or name in current[2]:
+        yield
+        return
+    current[2].add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current[2].discard(name)
+        record_stage(name, time.perf_counter() - started)
+
+def _failed(response) -> bool:
+    if str(getattr(response, "status", "")) == "error":
+        return True
+    return str(getattr(response, "output", "") or "").startswith("Error")
+
+def instrument(label: str, handler):
+    """Record request counts, latency and stage timings for ``handler``.
+
+    The per-stage breakdown of each request is returned in milliseconds
+    under ``metadata["timings"]`` of the response.
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        timings = {}
+        token = _current.set((label, timings, set()))
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await handler(*args, **kwargs)
+            status = "error" if _failed(response) else "ok"
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            metrics.observe(
+                "whisk_handler_seconds", elapsed, help="End-to-end handler latency", handler=label
+            )
+            metrics.inc("whisk_requests_total", help="Handled requests", handler=label, status=status)
+
+        if hasattr(response, "metadata"):
+            breakdown = {f"{name}_ms": round(seconds * 1000, 2) for name, seconds in timings.items()}
+            breakdown["total_ms"] = round(elapsed * 1000, 2)
+            response.metadata = {**(response.metadata or {}), "timings": breakdown}
+        return response
+    return wrapper
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int | None = None, host: str = "127.0.0.1"):
+    """Serve ``/metrics`` from a daemon thread.
+
+    Defaults to ``WHISK_METRICS_PORT`` plus the worker index, so each worker
+    of a supervisor gets its own port. Returns None when disabled.
+    """
+    if port is None:
+        base = os.getenv("WHISK_METRICS_PORT")
+        if not base:
+            return None
+        port = int(base) + int(os.getenv("WHISK_WORKER_INDEX", "0"))
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="whisk-metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
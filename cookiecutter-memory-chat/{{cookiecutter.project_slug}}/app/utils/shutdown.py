@@ -0,0 +1,51 @@
+import inspect
+import logging
+import os
+
+from .concurrency import limiter
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for in-flight handlers before flushing and exiting anyway
+DRAIN_TIMEOUT = float(os.getenv("WHISK_DRAIN_TIMEOUT", "30"))
+
+_drain_hooks = []
+
+def on_drain(func):
+    """Register ``func`` to flush state once in-flight requests have finished"""
+    _drain_hooks.append(func)
+    return func
+
+async def _stop_consuming(client):
+    # Unsubscribe from NATS so the queue group routes new messages to other
+    # workers, while the connection stays open to publish pending replies
+    broker = getattr(client, "broker", None)
+    subscribers = getattr(broker, "subscribers", None) or getattr(broker, "_subscribers", {})
+    if isinstance(subscribers, dict):
+        subscribers = subscribers.values()
+    for subscriber in subscribers:
+        try:
+            await subscriber.close()
+        except Exception as e:
+            logger.warning(f"Could not close subscriber: {str(e)}")
+
+async def drain(client=None, timeout: float = DRAIN_TIMEOUT):
+    """Stop taking work, wait for in-flight handlers, then run the drain hooks"""
+    logger.info(f"Draining: {limiter.active} running, {limiter.waiting} queued")
+    limiter.close()
+    if client is not None:
+        await _stop_consuming(client)
+
+    if not await limiter.wait_idle(timeout):
+        logger.warning(
+            f"Drain deadline of {timeout:.0f}s reached with {limiter.active} requests in flight"
+        )
+
+    for hook in _drain_hooks:
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Error in drain hook {getattr(hook, '__name__', hook)}: {str(e)}")
+    logger.info("Drain complete")
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import math
+import os
+
+import numpy as np
+
+# Byte classes the estimate is built from
+SPACE, LETTER, DIGIT, PUNCTUATION, NON_ASCII = range(5)
+FEATURES = ("words", "letters", "digits", "punctuation", "non_ascii")
+
+# Tokens per feature for cl100k_base; refit with
+# `python -m benchmarks.tokens --calibrate` and set WHISK_TOKEN_ESTIMATE_COEFFS
+DEFAULT_COEFFICIENTS = (0.75, 0.045, 0.3, 0.8, 0.45)
+
+def _coefficients() -> np.ndarray:
+    configured = os.getenv("WHISK_TOKEN_ESTIMATE_COEFFS")
+    values = [float(value) for value in configured.split(",")] if configured else DEFAULT_COEFFICIENTS
+    if len(values) != len(FEATURES):
+        raise ValueError(f"WHISK_TOKEN_ESTIMATE_COEFFS needs {len(FEATURES)} values: {', '.join(FEATURES)}")
+    return np.array(values)
+
+COEFFICIENTS = _coefficients()
+
+_BYTE_CLASS = np.full(256, PUNCTUATION, dtype=np.uint8)
+_BYTE_CLASS[[ord(c) for c in " \t\n\r\f\v"]] = SPACE
+_BYTE_CLASS[ord("a"):ord("z") + 1] = LETTER
+_BYTE_CLASS[ord("A"):ord("Z") + 1] = LETTER
+_BYTE_CLASS[ord("0"):ord("9") + 1] = DIGIT
+_BYTE_CLASS[0x80:] = NON_ASCII
+
+def token_features(text: str) -> np.ndarray:
+    """Word starts and letter, digit, punctuation and non-ASCII byte counts"""
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    if not data.size:
+        return np.zeros(len(FEATURES))
+    classes = _BYTE_CLASS[data]
+    counts = np.bincount(classes, minlength=len(FEATURES))
+    in_word = classes != SPACE
+    words = np.count_nonzero(in_word[1:] & ~in_word[:-1]) + int(in_word[0])
+    return np.array([words, counts[LETTER], counts[DIGIT], counts[PUNCTUATION], counts[NON_ASCII]])
+
+def estimate_tokens(text: str, coefficients: np.ndarray | None = None) -> int:
+    """Approximate token count of ``text`` from its byte classes, without tokenizing.
+
+    Rounded up, so the counts of the pieces of a text never add up to less
+    than the count of the whole, which chunk sizing relies on.
+    """
+    if not text:
+        return 0
+    weights = COEFFICIENTS if coefficients is None else coefficients
+    return max(1, math.ceil(float(token_features(text) @ weights)))
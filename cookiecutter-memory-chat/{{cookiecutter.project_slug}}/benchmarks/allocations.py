@@ -0,0 +1,68 @@
+"""Allocation per conversation turn as the history grows.
+
+Drives the handler turn by turn, sending each response's messages back as
+the next request's history, and records the peak memory traced while the
+handler runs. Building the request and growing the history happen outside
+the measurement. The handler itself neither copies nor mutates the
+history; what still grows with it is the one ``ChatMessage`` per message
+handed to the LLM client, so ``bytes/msg`` should stay flat:
+
+    python -m benchmarks.allocations --turns 400 --every 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import tracemalloc
+
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema
+
+from .fakes import fake_text
+from .run import SCENARIOS, create_kitchen
+
+async def measure(kitchen, label: str, turns: int, every: int) -> list:
+    task = kitchen.query.get_task(label)
+    history = None
+    rows = []
+    tracemalloc.start()
+    for turn in range(1, turns + 1):
+        request = WhiskQuerySchema(query=fake_text(f"turn-{turn}", 12), label=label, messages=history)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        response = await task(request)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        history = response.messages
+        if turn == 1 or turn % every == 0:
+            size = len(history or [])
+            rows.append({
+                "turn": turn,
+                "history": size,
+                "peak_kb": round(peak / 1024, 1),
+                "bytes_per_message": round(peak / max(size, 1))
+            })
+    tracemalloc.stop()
+    return rows
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--label", default=SCENARIOS[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--every", type=int, default=25)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    kitchen = create_kitchen(argparse.Namespace(llm_latency=0.0))
+    rows = asyncio.run(measure(kitchen, args.label, args.turns, args.every))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'turn':>6} {'history':>8} {'peak KB':>9} {'bytes/msg':>10}")
+        for row in rows:
+            print(f"{row['turn']:>6} {row['history']:>8} {row['peak_kb']:>9.1f} {row['bytes_per_message']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Deterministic stand-ins for the LLM, embedding model, parser and tokenizer.
+
+Each fake sleeps for a configurable latency to stand in for the network
+call it replaces, and derives its output from a hash of the input so runs
+are repeatable.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+from llama_index.core.schema import Document
+
+logger = logging.getLogger(__name__)
+
+WORDS = (
+    "the of and to in is for on with as by at from that this it be are was or an "
+    "data model query index vector store document token latency request worker "
+    "retrieval answer context memory tool search result stage batch cache"
+).split()
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+def fake_text(seed_text: str, words: int) -> str:
+    """Deterministic filler text of ``words`` words"""
+    seed = _seed(seed_text)
+    return " ".join(WORDS[(seed >> (i % 48) ^ i) % len(WORDS)] for i in range(words))
+
+class FakeLLM(CustomLLM):
+    """LLM that answers after ``latency`` seconds with deterministic text"""
+
+    latency: float = 0.05
+    completion_tokens: int = 64
+    reply: Optional[Callable[[str], str]] = None
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=16384, num_output=self.completion_tokens, model_name="fake")
+
+    def _reply(self, prompt: str) -> str:
+        if self.reply is not None:
+            return self.reply(prompt)
+        return fake_text(prompt, self.completion_tokens)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        return CompletionResponse(text=self._reply(prompt))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return CompletionResponse(text=self._reply(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        time.sleep(self.latency)
+        text = self._reply(prompt)
+        yield CompletionResponse(text=text, delta=text)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await asyncio.sleep(self.latency)
+        # Seed from the last message only, so the fake's own cost does not grow with history
+        prompt = f"{messages[-1].role.value}: {messages[-1].content}" if messages else ""
+        return ChatResponse(message=ChatMessage(role="assistant", content=self._reply(prompt)))
+
+class FakeEmbedding(BaseEmbedding):
+    """Embedding model returning unit vectors seeded by the text hash.
+
+    ``latency`` is paid once per call, so batched calls are cheaper per text
+    as they are against a real embedding API.
+    """
+
+    embed_dim: int = 256
+    latency: float = 0.01
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.embed_dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+class FakeParser:
+    """Replaces LlamaParse: reads every file in the directory as plain text"""
+
+    latency = 0.0
+
+    def __init__(self, api_key: str | None = None, **kwargs):
+        pass
+
+    def load(self, path: str, metadata: dict | None = None) -> dict:
+        time.sleep(self.latency)
+        documents = [
+            Document(text=file.read_text(errors="ignore"), metadata=dict(metadata or {}))
+            for file in sorted(Path(path).iterdir()) if file.is_file()
+        ]
+        return {"documents": documents}
+
+class FakeEncoding:
+    """Whitespace tokenizer used when the tiktoken encoding cannot be downloaded"""
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return [_seed(word) % 100000 for word in text.split()]
+
+def install_fakes(llm_latency: float = 0.05, embed_latency: float = 0.01, parse_latency: float = 0.0,
+                  reply: Optional[Callable[[str], str]] = None) -> FakeLLM:
+    """Point llama-index and the app at the fakes, returns the fake LLM"""
+    from llama_index.core import Settings
+    from llama_index.core.callbacks import CallbackManager
+    from app.utils import token_counter
+    from app.utils.stage_timer import stage_timer
+
+    try:
+        token_counter.get_encoding()
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable ({str(e)}), counting whitespace tokens")
+        token_counter.tokenizers.register(token_counter.DEFAULT_MODEL, FakeEncoding())
+
+    llm = FakeLLM(latency=llm_latency, reply=reply)
+    Settings.callback_manager = CallbackManager([token_counter.create_token_counter(), stage_timer])
+    llm.callback_manager = Settings.callback_manager
+    Settings.llm = llm
+    Settings.embed_model = FakeEmbedding(latency=embed_latency)
+    FakeParser.latency = parse_latency
+    return llm
@@ -0,0 +1,178 @@
+"""Local stand-in for the OpenAI API, to exercise the LLM client offline.
+
+Serves chat completions and embeddings with a configurable latency,
+occasional slow responses and a requests-per-minute limit answered with
+429s, the way the real API behaves under load:
+
+    python -m benchmarks.mock_openai --port 8089 --latency 0.3 --rpm 60
+    OPENAI_API_BASE=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-test python -m app.main
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+class MockOpenAI:
+    """Threaded mock server; use as a context manager or start and stop it.
+
+    ``latency`` is seconds per response or a function of the request index,
+    ``throttle_first`` answers that many requests with 429 before serving,
+    and ``rpm`` answers requests over the per-minute limit with 429.
+    """
+
+    def __init__(self, latency: float | Callable[[int], float] = 0.05, rpm: int = 0,
+                 throttle_first: int = 0, retry_after: float = 0.2, embed_dim: int = 8, port: int = 0):
+        self.latency = latency
+        self.rpm = rpm
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.embed_dim = embed_dim
+        self.requests = []
+        self.throttled = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self) -> "MockOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self, path: str, body: dict) -> tuple[int, bool]:
+        """Record the request, returns its index and whether it is throttled"""
+        now = time.monotonic()
+        with self._lock:
+            index = len(self.requests)
+            self.requests.append({"path": path, "body": body, "at": now})
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            throttled = index < self.throttle_first or (self.rpm and len(self._recent) >= self.rpm)
+            if throttled:
+                self.throttled += 1
+            else:
+                self._recent.append(now)
+        return index, bool(throttled)
+
+    def _latency(self, index: int) -> float:
+        return self.latency(index) if callable(self.latency) else self.latency
+
+    def chat(self, body: dict) -> dict:
+        messages = body.get("messages") or [{"content": ""}]
+        last = str(messages[-1].get("content") or "")
+        reply = f"Mock reply {_seed(last) % 10000} to: {last[:60]}"
+        prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in messages)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply.split()),
+                      "total_tokens": prompt_tokens + len(reply.split())}
+        }
+
+    def embeddings(self, body: dict) -> dict:
+        texts = body.get("input") or []
+        texts = [texts] if isinstance(texts, str) else texts
+        data = []
+        for index, text in enumerate(texts):
+            seed = _seed(str(text))
+            vector = [((seed >> (i * 7)) % 1000) / 1000 - 0.5 for i in range(self.embed_dim)]
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(str(text).split()) for text in texts)
+        return {"object": "list", "data": data, "model": body.get("model", "mock"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                index, throttled = mock._admit(self.path, body)
+                if throttled:
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               {"retry-after-ms": str(int(mock.retry_after * 1000)),
+                                "x-ratelimit-remaining-requests": "0"})
+                    return
+                time.sleep(mock._latency(index))
+                if self.path.endswith("/chat/completions"):
+                    self._send(200, mock.chat(body))
+                elif self.path.endswith("/embeddings"):
+                    self._send(200, mock.embeddings(body))
+                else:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def _send(self, status: int, payload: dict, headers: dict | None = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled, e.g. the losing request of a hedge
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per response")
+    parser.add_argument("--slow-every", type=int, default=0, help="Make every Nth response slow")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="Seconds per slow response")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    def latency(index: int) -> float:
+        if args.slow_every and index % args.slow_every == args.slow_every - 1:
+            return args.slow_latency
+        return args.latency
+
+    server = MockOpenAI(latency=latency, rpm=args.rpm, port=args.port).start()
+    print(f"Mock OpenAI API on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
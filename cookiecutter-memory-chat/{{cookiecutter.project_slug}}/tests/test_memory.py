@@ -1,5 +1,5 @@
 import pytest
-from app.handlers.memory import memory_handler, clear_memory_handler, memory_manager
+from app.handlers.memory import memory_handler, clear_memory_handler, memory_manager, MemoryManager
 from whisk.kitchenai_sdk.schema import WhiskQuerySchema, DependencyType
 
 @pytest.mark.asyncio
@@ -94,4 +94,18 @@ async def test_memory_token_counting(kitchen):
     assert response.token_counts is not None
     assert response.token_counts.llm_prompt_tokens > 0
     assert response.token_counts.llm_completion_tokens > 0
-    assert response.token_counts.total_llm_tokens > 0 
\ No newline at end of file
+    assert response.token_counts.total_llm_tokens > 0 
+
+
+def test_memory_save_and_load(tmp_path):
+    """Test that memory survives a restart through save/load"""
+    path = str(tmp_path / "memory.json")
+    manager = MemoryManager(memory_type="buffer")
+    manager.add_message("Hello!", is_human=True)
+    manager.add_message("Hi there.", is_human=False)
+    manager.save(path)
+
+    restored = MemoryManager(memory_type="buffer")
+    restored.load(path)
+
+    assert restored.get_history() == manager.get_history()
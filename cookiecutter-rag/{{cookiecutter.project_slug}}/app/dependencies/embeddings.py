@@ -0,0 +1,30 @@
+import os
+from pathlib import Path
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+
+from ..utils.embedding_cache import CachedEmbedding, embedding_cache
+from ..utils.llm_client import http_client
+
+def setup_embed_model(
+    cache_dir: str | None = None,
+    model: BaseEmbedding | None = None,
+    timeout: float | None = None,
+    max_retries: int | None = None,
+):
+    """Initialize the embedding model, served through the persistent embedding cache when ``cache_dir`` is set"""
+    if model is None:
+        # Embedding calls share the pooled, rate-limit aware LLM client
+        model = OpenAIEmbedding(
+            async_http_client=http_client(),
+            timeout=timeout or float(os.getenv("WHISK_LLM_TIMEOUT", "60")),
+            max_retries=int(os.getenv("WHISK_LLM_MAX_RETRIES", "2")) if max_retries is None else max_retries
+        )
+    if cache_dir and not isinstance(model, CachedEmbedding):
+        if embedding_cache.root != Path(cache_dir):
+            embedding_cache.configure(cache_dir)
+        model = CachedEmbedding(model)
+    Settings.embed_model = model
+    return model
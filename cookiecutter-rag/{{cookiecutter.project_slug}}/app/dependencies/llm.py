@@ -1,10 +1,22 @@
+import os
+
 from llama_index.llms.openai import OpenAI
 from llama_index.core import Settings
 from llama_index.core.callbacks import CallbackManager
 
-def setup_llm(token_counter):
+from ..utils.llm_client import http_client
+from ..utils.stage_timer import stage_timer
+from ..utils.token_counter import DEFAULT_MODEL
+
+def setup_llm(token_counter, timeout: float | None = None, max_retries: int | None = None):
     """Initialize and configure LLM"""
-    Settings.callback_manager = CallbackManager([token_counter])
-    llm = OpenAI(model="gpt-3.5-turbo")
+    Settings.callback_manager = CallbackManager([token_counter, stage_timer])
+    llm = OpenAI(
+        model=DEFAULT_MODEL,
+        # Pooled, rate-limit aware client; retries are scheduled like first attempts
+        async_http_client=http_client(),
+        timeout=timeout or float(os.getenv("WHISK_LLM_TIMEOUT", "60")),
+        max_retries=int(os.getenv("WHISK_LLM_MAX_RETRIES", "2")) if max_retries is None else max_retries
+    )
     Settings.llm = llm
     return llm 
\ No newline at end of file
@@ -1,16 +1,109 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
 import chromadb
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from pathlib import Path
 
-def setup_vector_store(chroma_path: str | Path):
-    """Initialize and configure vector store"""
+DEFAULT_COLLECTION = "default"
+
+def setup_vector_store(
+    chroma_path: str | Path,
+    shard_key: str | None = None,
+    idle_ttl: float = 600.0,
+    max_open: int = 64,
+):
+    """Initialize and configure vector store
+
+    When ``shard_key`` is set (e.g. ``"tenant"``), a ``ShardedVectorStore`` is
+    returned that keeps one Chroma collection per value of that metadata key.
+    """
     # Convert Path to string if needed
     chroma_path_str = str(chroma_path) if isinstance(chroma_path, Path) else chroma_path
-    
+
     # Create directory if it doesn't exist
     Path(chroma_path_str).mkdir(parents=True, exist_ok=True)
-    
+
     # Initialize ChromaDB with string path
     chroma_client = chromadb.PersistentClient(path=chroma_path_str)
-    chroma_collection = chroma_client.get_or_create_collection("default")
-    return ChromaVectorStore(chroma_collection=chroma_collection) 
\ No newline at end of file
+    if shard_key:
+        return ShardedVectorStore(chroma_client, shard_key, idle_ttl=idle_ttl, max_open=max_open)
+    chroma_collection = chroma_client.get_or_create_collection(DEFAULT_COLLECTION)
+    return ChromaVectorStore(chroma_collection=chroma_collection)
+
+def shard_collection_name(value: str) -> str:
+    """Map a shard value to a valid, distinct Chroma collection name.
+
+    The readable prefix is lossy (e.g. "acme.co" and "acme_co" share it), so
+    a digest of the raw value always follows it to keep tenants apart.
+    """
+    digest = hashlib.sha1(str(value).encode()).hexdigest()[:12]
+    name = re.sub(r"[^a-zA-Z0-9_-]", "_", str(value)).strip("_-")[:32].rstrip("_-")
+    # Chroma limits names to 63 characters starting and ending alphanumeric
+    return f"shard_{name}_{digest}" if name else f"shard_{digest}"
+
+class ShardedVectorStore:
+    """Routes each request to a per-shard Chroma collection.
+
+    Collection handles are opened lazily on first use, kept in an LRU and
+    dropped once they have been idle for ``idle_ttl`` seconds. Requests
+    without a value for ``shard_key`` go to the default collection.
+    """
+
+    def __init__(self, chroma_client, shard_key: str, idle_ttl: float = 600.0, max_open: int = 64):
+        self.chroma_client = chroma_client
+        self.shard_key = shard_key
+        self.idle_ttl = idle_ttl
+        self.max_open = max_open
+        self._stores: OrderedDict[str, tuple[ChromaVectorStore, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def collection_name(self, metadata: dict | None) -> str:
+        value = (metadata or {}).get(self.shard_key)
+        if value is None or value == "":
+            return DEFAULT_COLLECTION
+        return shard_collection_name(value)
+
+    def route(self, metadata: dict | None) -> ChromaVectorStore:
+        """Return the vector store for the shard addressed by ``metadata``"""
+        name = self.collection_name(metadata)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._stores.pop(name, None)
+            if entry is None:
+                collection = self.chroma_client.get_or_create_collection(name)
+                store = ChromaVectorStore(chroma_collection=collection)
+            else:
+                store = entry[0]
+            self._stores[name] = (store, now)
+            return store
+
+    def _evict(self, now: float):
+        # Entries are kept in least-recently-used order
+        while self._stores:
+            name, (_, last_used) = next(iter(self._stores.items()))
+            if now - last_used < self.idle_ttl and len(self._stores) < self.max_open:
+                break
+            del self._stores[name]
+
+    def open_shards(self) -> list[str]:
+        """Names of the collections that currently hold an open handle"""
+        with self._lock:
+            return list(self._stores)
+
+def route_vector_store(vector_store, metadata: dict | None):
+    """Resolve the vector store to use for a request.
+
+    Returns ``(store, metadata)`` where ``metadata`` has the shard key removed
+    so it is not applied again as a filter inside the shard.
+    """
+    if isinstance(vector_store, ShardedVectorStore):
+        store = vector_store.route(metadata)
+        if metadata and vector_store.shard_key in metadata:
+            metadata = {k: v for k, v in metadata.items() if k != vector_store.shard_key}
+        return store, metadata or None
+    return vector_store, metadata
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+import numpy as np
+from whisk.kitchenai_sdk.schema import (
+    WhiskQuerySchema,
+    WhiskQueryBaseResponseSchema,
+    TokenCountSchema
+)
+from llama_index.core import Settings, get_response_synthesizer
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.schema import QueryBundle
+
+from ..dependencies.vector_store import route_vector_store
+from ..utils.adaptive_retrieval import SIMILARITY_TOP_K, AdaptiveCutoff, adaptive_cutoff
+from ..utils.concurrency import limiter
+from ..utils.embedding_cache import aembed_queries
+from ..utils.filter_planner import batch_search, plan_filters
+from ..utils.tombstones import delete_pipeline
+from ..utils.token_counter import count_tokens, create_token_counter
+from ..utils.metrics import stage
+from ..utils.prompts import qa_templates
+from ..utils.stage_timer import stage_timer
+from ..utils.wire import query_response
+
+# Most answers generated at the same time for one batch; all but one of
+# them also need a free slot of the worker's concurrency limiter
+BATCH_CONCURRENCY = int(os.getenv("WHISK_BATCH_QUERY_CONCURRENCY", "8"))
+
+# Largest number of queries accepted in one batch request
+MAX_BATCH_SIZE = int(os.getenv("WHISK_BATCH_QUERY_MAX_SIZE", "1000"))
+
+TOKEN_FIELDS = ("embedding_tokens", "llm_prompt_tokens", "llm_completion_tokens", "total_llm_tokens")
+
+async def batch_query_handler(data: WhiskQuerySchema, llm=None, vector_store=None, system_prompt=None) -> WhiskQueryBaseResponseSchema:
+    """Answer many questions in one request, for evaluation and batch jobs.
+
+    Args:
+        data (WhiskQuerySchema): Batch request with fields:
+            - messages (list): The queries, each a string or a dict with
+              "query" and optional "metadata". Items inherit the request
+              metadata (e.g. the tenant shard key) and may add filters.
+            - label (str): Handler label (e.g. "batch_query")
+            - metadata (dict, optional): Metadata applied to every query
+        llm: Language model for generating responses
+        vector_store: Vector store for document retrieval
+        system_prompt (str, optional): System prompt for the LLM
+
+    Returns:
+        WhiskQueryBaseResponseSchema: Response containing:
+            - output (str): Summary of answered and failed queries
+            - metadata (dict): Under "responses", one response per query, in
+              order, each shaped like a ``query_handler`` response in the
+              requested response format (the
+              client returns the request's messages in ``messages``); under
+              "batch" the batch size and error count; per-stage timings
+            - token_counts (TokenCountSchema): Token usage of the whole batch
+
+    Example:
+        >>> request = WhiskQuerySchema(
+        ...     query="nightly-eval",
+        ...     label="batch_query",
+        ...     messages=["What is RAG?", {"query": "What is Chroma?", "metadata": {"source": "docs"}}]
+        ... )
+        >>> response = await batch_query_handler(request, llm, vector_store)
+    """
+    try:
+        items = batch_items(data)
+        responses = await answer_batch(items, llm, vector_store, system_prompt, flow=limiter.flow_key(data))
+    except Exception as e:
+        return WhiskQueryBaseResponseSchema(
+            input=data.query,
+            output="Error: " + str(e),
+            metadata=data.metadata,
+            token_counts=TokenCountSchema()
+        )
+
+    errors = sum((response.output or "").startswith("Error: ") for response in responses)
+    token_counts = TokenCountSchema(**{
+        field: sum(getattr(response.token_counts, field) or 0 for response in responses)
+        for field in TOKEN_FIELDS
+    })
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output=f"Answered {len(responses) - errors} of {len(responses)} queries",
+        metadata={
+            **(data.metadata or {}),
+            "batch": {"queries": len(responses), "errors": errors},
+            "responses": [response.model_dump(exclude={"stream_gen"}) for response in responses]
+        },
+        token_counts=token_counts
+    )
+
+def batch_items(data: WhiskQuerySchema) -> list[WhiskQuerySchema]:
+    """The queries of a batch request"""
+    items = []
+    for message in data.messages or []:
+        message = {"query": message} if isinstance(message, str) else dict(message)
+        metadata = {**(data.metadata or {}), **(message.get("metadata") or {})}
+        items.append(WhiskQuerySchema(query=message["query"], label=data.label, metadata=metadata or None))
+    if not items:
+        raise ValueError("A batch query needs its queries in messages")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch query takes at most {MAX_BATCH_SIZE} queries, got {len(items)}")
+    return items
+
+async def answer_batch(
+    items: list[WhiskQuerySchema], llm=None, vector_store=None, system_prompt=None, flow: tuple[str, str] = ("", "")
+) -> list[WhiskQueryBaseResponseSchema]:
+    """Answer ``items`` with one batched embedding call and one vectorized
+    search per shard and filter set; only generation runs per query. A
+    failed query gets an error response and does not fail the others.
+
+    One answer at a time runs on the slot the batch request was admitted
+    with. Each further one, up to BATCH_CONCURRENCY in all, takes a free
+    limiter slot of the request's ``(tenant, label)`` flow for its duration,
+    so a batch only fans out while the worker, label and tenant budgets have
+    room and never ahead of queued requests."""
+    with stage("embed"):
+        embeddings = np.asarray(
+            await aembed_queries(Settings.embed_model, [item.query for item in items]), dtype=np.float32
+        )
+
+    # Queries on the same shard with the same filters are searched together
+    groups = {}
+    for index, item in enumerate(items):
+        store, filter_metadata = route_vector_store(vector_store, item.metadata)
+        key = (store.client.name, json.dumps(filter_metadata or {}, sort_keys=True))
+        groups.setdefault(key, (store, filter_metadata, []))[2].append(index)
+
+    retrieved = [None] * len(items)
+    postprocessors = [None] * len(items)
+    plans = [None] * len(items)
+    for store, filter_metadata, indices in groups.values():
+        # Documents deleted but not yet compacted are excluded by the search
+        hidden = delete_pipeline.hidden(store)
+        plan = None
+        if filter_metadata:
+            with stage("plan"):
+                plan = await asyncio.to_thread(plan_filters, store, filter_metadata, hidden=hidden)
+
+        # In adaptive mode fetch more candidates and let their scores decide how many to keep
+        cutoff = adaptive_cutoff()
+        similarity_top_k = cutoff.max_k if cutoff else SIMILARITY_TOP_K
+        with stage("retrieve"):
+            results = await asyncio.to_thread(
+                batch_search, store, embeddings[indices], similarity_top_k, filter_metadata, plan, hidden
+            )
+
+        for index, nodes in zip(indices, results):
+            retrieved[index] = nodes
+            plans[index] = plan
+            postprocessors[index] = []
+            if cutoff:
+                postprocessors[index].append(adaptive_cutoff())
+
+    async def answer(index: int) -> WhiskQueryBaseResponseSchema:
+        item = items[index]
+        try:
+            return await synthesize(
+                item, retrieved[index], postprocessors[index], plans[index], llm, system_prompt
+            )
+        except Exception as e:
+            return WhiskQueryBaseResponseSchema(
+                input=item.query,
+                output="Error: " + str(e),
+                metadata=item.metadata,
+                token_counts=TokenCountSchema()
+            )
+
+    return await generate(answer, len(items), flow)
+
+async def generate(answer, count: int, flow: tuple[str, str]) -> list:
+    """``answer(index)`` of every index, on the batch's own slot and on
+    limiter slots taken one answer at a time"""
+    responses = [None] * count
+    pending = deque(range(count))
+    running = {}
+    own_slot_free = True
+    try:
+        while pending or running:
+            while pending and len(running) < BATCH_CONCURRENCY:
+                if own_slot_free:
+                    own_slot_free, extra = False, False
+                elif limiter.try_acquire(*flow):
+                    extra = True
+                else:
+                    break
+                index = pending.popleft()
+                running[asyncio.ensure_future(answer(index))] = (index, extra)
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, extra = running.pop(task)
+                responses[index] = task.result()
+                if extra:
+                    limiter.release(*flow)
+                else:
+                    own_slot_free = True
+    finally:
+        for task, (_, extra) in running.items():
+            task.cancel()
+            if extra:
+                limiter.release(*flow)
+    return responses
+
+async def synthesize(item: WhiskQuerySchema, nodes, postprocessors, plan, llm, system_prompt=None) -> WhiskQueryBaseResponseSchema:
+    """Generate the answer of one query from its retrieved chunks"""
+    query_bundle = QueryBundle(item.query)
+    for postprocessor in postprocessors:
+        nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+
+    # Each query counts its own tokens; the batch runs them concurrently, so
+    # the synthesizer points a copy of the shared LLM at its callback manager
+    token_counter = create_token_counter(exact=True)
+    callback_manager = CallbackManager([token_counter, stage_timer])
+    if llm is not None:
+        llm = llm.model_copy(update={"callback_manager": callback_manager})
+    synthesizer = get_response_synthesizer(
+        llm=llm, callback_manager=callback_manager, **qa_templates(system_prompt)
+    )
+    response = await synthesizer.asynthesize(query_bundle, nodes)
+
+    token_counts = TokenCountSchema(
+        embedding_tokens=count_tokens(item.query, exact=True),
+        llm_prompt_tokens=token_counter.prompt_llm_token_count,
+        llm_completion_tokens=token_counter.completion_llm_token_count,
+        total_llm_tokens=token_counter.total_llm_token_count
+    )
+    metadata = {"token_counts": {**token_counts.dict(), **token_counter.prefix_counts()}}
+    if plan:
+        metadata["filter_plan"] = plan.to_dict()
+    cutoff = next((p for p in postprocessors if isinstance(p, AdaptiveCutoff)), None)
+    if cutoff:
+        metadata["retrieval"] = cutoff.to_dict()
+    if item.metadata:
+        metadata.update(item.metadata)
+
+    return query_response(item, response, metadata, token_counts)
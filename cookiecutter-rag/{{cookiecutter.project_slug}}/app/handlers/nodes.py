@@ -0,0 +1,80 @@
+import asyncio
+
+from whisk.kitchenai_sdk.schema import (
+    WhiskQuerySchema,
+    WhiskQueryBaseResponseSchema,
+    SourceNodeSchema,
+    TokenCountSchema
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from ..dependencies.vector_store import route_vector_store
+from ..utils.tombstones import delete_pipeline, is_hidden
+
+async def nodes_handler(data: WhiskQuerySchema, vector_store=None) -> WhiskQueryBaseResponseSchema:
+    """Resolve chunks returned by reference in compact query responses.
+
+    Args:
+        data (WhiskQuerySchema): Request with fields:
+            - messages (list): Node ids, as in ``retrieval_refs["ids"]``
+            - metadata (dict, optional): The metadata of the query request,
+              so a sharded store reads the same tenant shard. A "scores"
+              entry with the comma separated ``retrieval_refs["scores"]``
+              sets the score of each node.
+        vector_store: Vector store the chunks were retrieved from
+
+    Returns:
+        WhiskQueryBaseResponseSchema: Response containing:
+            - output (str): Number of nodes found
+            - retrieval_context (list): The chunks that still exist and whose
+              document is not deleted, in the requested order, with their
+              text and metadata
+
+    Example:
+        >>> refs = response.metadata["retrieval_refs"]
+        >>> request = WhiskQuerySchema(
+        ...     query="resolve",
+        ...     label="nodes",
+        ...     messages=refs["ids"],
+        ...     metadata={"scores": ",".join(map(str, refs["scores"]))}
+        ... )
+        >>> response = await nodes_handler(request, vector_store)
+    """
+    try:
+        metadata = dict(data.metadata or {})
+        scores = metadata.pop("scores", None)
+        node_ids = [str(node_id) for node_id in data.messages or []]
+        scores = [float(score) for score in scores.split(",")] if scores else [1.0] * len(node_ids)
+        if len(scores) != len(node_ids):
+            raise ValueError(f"Got {len(scores)} scores for {len(node_ids)} nodes")
+
+        store, _ = route_vector_store(vector_store, metadata)
+        result = await asyncio.to_thread(
+            store.client.get, ids=node_ids, include=["documents", "metadatas"]
+        ) if node_ids else {"ids": [], "documents": [], "metadatas": []}
+        hidden = delete_pipeline.hidden(store)
+    except Exception as e:
+        return WhiskQueryBaseResponseSchema(
+            input=data.query,
+            output="Error: " + str(e),
+            metadata=data.metadata,
+            token_counts=TokenCountSchema()
+        )
+
+    # Chroma returns the ids it found in its own order
+    found = {
+        node_id: metadata_dict_to_node(node_metadata, text=text)
+        for node_id, text, node_metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        if not is_hidden(node_metadata or {}, hidden)
+    }
+    retrieval_context = [
+        SourceNodeSchema(text=found[node_id].text, metadata=found[node_id].metadata, score=score)
+        for node_id, score in zip(node_ids, scores)
+        if node_id in found
+    ]
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output=f"Found {len(retrieval_context)} of {len(node_ids)} nodes",
+        retrieval_context=retrieval_context,
+        metadata=data.metadata
+    )
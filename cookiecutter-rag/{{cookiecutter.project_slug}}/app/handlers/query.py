@@ -1,3 +1,5 @@
+import asyncio
+
 from whisk.kitchenai_sdk.schema import (
     WhiskQuerySchema,
     WhiskQueryBaseResponseSchema,
@@ -6,12 +8,20 @@ from whisk.kitchenai_sdk.schema import (
 )
 from llama_index.core import VectorStoreIndex
 from llama_index.core.vector_stores.types import MetadataFilter, MetadataFilters
-from llama_index.core.callbacks import TokenCountingHandler
-import tiktoken
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
 
-token_counter = TokenCountingHandler(
-    tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-)
+from ..dependencies.vector_store import route_vector_store
+from ..utils.adaptive_retrieval import SIMILARITY_TOP_K, adaptive_cutoff
+from ..utils.filter_planner import plan_filters, ExactScanRetriever
+from ..utils.single_flight import SINGLE_FLIGHT, flight_key, query_flights
+from ..utils.tombstones import delete_pipeline, hidden_filters
+from ..utils.token_counter import count_tokens, create_token_counter
+from ..utils.metrics import stage
+from ..utils.prompts import qa_templates
+from ..utils.stage_timer import stage_timer
+from ..utils.wire import is_compact, query_response
 
 async def query_handler(data: WhiskQuerySchema, llm=None, vector_store=None, system_prompt=None) -> WhiskQueryBaseResponseSchema:
     """Query handler for RAG-based question answering.
@@ -20,20 +30,30 @@ async def query_handler(data: WhiskQuerySchema, llm=None, vector_store=None, sys
         data (WhiskQuerySchema): Query request with fields:
             - query (str): The question to answer
             - label (str): Handler label (e.g. "query")
-            - metadata (dict, optional): Filter metadata (e.g. {"source": "docs"})
+            - metadata (dict, optional): Filter metadata (e.g. {"source": "docs"}).
+              Selective filters are answered by an exact scan over the matching
+              chunks, broad ones by ANN search with the filter pushed down.
             - stream (bool, optional): Enable streaming response
             - stream_id (str, optional): ID for streaming session
         llm: Language model for generating responses
-        vector_store: Vector store for document retrieval
+        vector_store: Vector store for document retrieval. A sharded store is
+            routed to the collection addressed by the request metadata.
         system_prompt (str, optional): System prompt for the LLM
         
     Returns:
         WhiskQueryBaseResponseSchema: Response containing:
             - input (str): Original query
             - output (str): Generated answer
-            - retrieval_context (list): Retrieved document chunks
-            - metadata (dict): Response metadata
-            - token_counts (TokenCountSchema): Token usage stats
+            - retrieval_context (list): Retrieved document chunks. With
+              metadata {"response_format": "compact"} they are sent as
+              metadata "retrieval_refs" (node ids and scores) instead.
+            - metadata (dict): Response metadata, including the per-stage
+              timings (embed, retrieve, synthesize, llm) in milliseconds and,
+              in adaptive retrieval mode, the candidate and selected chunk counts
+            - token_counts (TokenCountSchema): Token usage stats. Identical
+              queries in flight at the same time share one execution; only the
+              request that ran it is billed its tokens, and metadata
+              "single_flight" tells the requests apart.
             
     Example:
         >>> request = WhiskQuerySchema(
@@ -44,52 +64,16 @@ async def query_handler(data: WhiskQuerySchema, llm=None, vector_store=None, sys
         >>> response = await query_handler(request, llm, vector_store)
     """
     try:
-        # Create filters from metadata if provided
-        filters = None
-        if data.metadata:
-            filter_list = [
-                MetadataFilter(key=key, value=value)
-                for key, value in data.metadata.items()
-            ]
-            filters = MetadataFilters(filters=filter_list)
-
-        # Create index and query engine with token counter
-        index = VectorStoreIndex.from_vector_store(
-            vector_store,
-            callbacks=[token_counter]
-        )
-        
-        query_engine = index.as_query_engine(
-            chat_mode="best",
-            filters=filters,
-            llm=llm,
-            system_prompt=system_prompt,
-            verbose=True
-        )
-
-        # Execute query
-        response = await query_engine.aquery(data.query)
-
-        # Get token counts
-        token_counts = TokenCountSchema(
-            embedding_tokens=token_counter.total_embedding_token_count,
-            llm_prompt_tokens=token_counter.prompt_llm_token_count,
-            llm_completion_tokens=token_counter.completion_llm_token_count,
-            total_llm_tokens=token_counter.total_llm_token_count
-        )
-        token_counter.reset_counts()
-
-        # Prepare metadata
-        metadata = {"token_counts": token_counts.dict()}
-        if data.metadata:
-            metadata.update(data.metadata)
-
-        return WhiskQueryBaseResponseSchema.from_llama_response(
-            data,
-            response,
-            metadata=metadata,
-            token_counts=token_counts
+        if data.stream or not SINGLE_FLIGHT:
+            response, _ = await answer_query(data, llm, vector_store, system_prompt)
+            return response
+        # Full and compact responses of one query are built separately
+        label = f"{data.label}:compact" if is_compact() else data.label
+        (response, token_counts), leader, shared_by = await query_flights.do(
+            flight_key(label, data.query, data.metadata),
+            lambda: answer_query(data, llm, vector_store, system_prompt)
         )
+        return attribute_tokens(response, token_counts, leader, shared_by)
             
     except Exception as e:
         # Return error response
@@ -98,4 +82,103 @@ async def query_handler(data: WhiskQuerySchema, llm=None, vector_store=None, sys
             output="Error: " + str(e),
             metadata=data.metadata,
             token_counts=TokenCountSchema()
-        ) 
\ No newline at end of file
+        )
+
+def attribute_tokens(response: WhiskQueryBaseResponseSchema, token_counts: dict, leader: bool, shared_by: int) -> WhiskQueryBaseResponseSchema:
+    """The shared response as returned to one of the requests that shared it.
+
+    Tokens are spent once, so the request that ran the query reports them
+    and the others report none; the others see the leader's ``token_counts``
+    under ``single_flight``.
+    """
+    metadata = dict(response.metadata or {})
+    single_flight = {"leader": leader, "shared_by": shared_by}
+    if leader:
+        metadata["single_flight"] = single_flight
+        return response.model_copy(update={"metadata": metadata})
+    none_spent = TokenCountSchema(
+        embedding_tokens=0, llm_prompt_tokens=0, llm_completion_tokens=0, total_llm_tokens=0
+    )
+    single_flight["token_counts"] = token_counts
+    metadata["single_flight"] = single_flight
+    metadata["token_counts"] = none_spent.dict()
+    return response.model_copy(update={"metadata": metadata, "token_counts": none_spent})
+
+async def answer_query(data: WhiskQuerySchema, llm, vector_store, system_prompt) -> tuple[WhiskQueryBaseResponseSchema, dict]:
+    """Retrieve, synthesize and count the tokens of one query; returns the
+    response and its token counts, including the prompt prefix counts"""
+    # Route to the tenant shard; the shard key no longer needs filtering
+    vector_store, filter_metadata = route_vector_store(vector_store, data.metadata)
+
+    # Documents deleted but not yet compacted are excluded by the search
+    # itself, so they never take one of the top k slots
+    hidden = delete_pipeline.hidden(vector_store)
+
+    # Create filters from metadata if provided
+    filters = None
+    plan = None
+    filter_list = [
+        MetadataFilter(key=key, value=value)
+        for key, value in (filter_metadata or {}).items()
+    ] + hidden_filters(hidden)
+    if filter_list:
+        filters = MetadataFilters(filters=filter_list)
+    if filter_metadata:
+        with stage("plan"):
+            plan = await asyncio.to_thread(plan_filters, vector_store, filter_metadata, hidden=hidden)
+
+    node_postprocessors = []
+
+    # In adaptive mode fetch more candidates and let their scores decide how many to keep
+    cutoff = adaptive_cutoff()
+    similarity_top_k = SIMILARITY_TOP_K
+    if cutoff:
+        node_postprocessors.append(cutoff)
+        similarity_top_k = cutoff.max_k
+
+    # Each query counts its own tokens; queries run concurrently. The
+    # synthesizer points its LLM at the callback manager, so it gets a copy
+    # of the shared LLM rather than redirecting other queries' events
+    token_counter = create_token_counter(exact=True)
+    callback_manager = CallbackManager([token_counter, stage_timer])
+    if llm is not None:
+        llm = llm.model_copy(update={"callback_manager": callback_manager})
+
+    if plan and plan.strategy == "exact":
+        # Few matching chunks: score all of them instead of searching the ANN graph
+        retriever = ExactScanRetriever(vector_store, plan.node_ids, similarity_top_k=similarity_top_k)
+    else:
+        index = VectorStoreIndex.from_vector_store(vector_store, callback_manager=callback_manager)
+        retriever = index.as_retriever(filters=filters, similarity_top_k=similarity_top_k)
+    # from_args would build the synthesizer on the global callback manager
+    synthesizer = get_response_synthesizer(
+        llm=llm, callback_manager=callback_manager, **qa_templates(system_prompt)
+    )
+    query_engine = RetrieverQueryEngine(
+        retriever=retriever,
+        response_synthesizer=synthesizer,
+        node_postprocessors=node_postprocessors,
+        callback_manager=callback_manager
+    )
+
+    # Execute query
+    response = await query_engine.aquery(data.query)
+
+    token_counts = TokenCountSchema(
+        embedding_tokens=count_tokens(data.query, exact=True),
+        llm_prompt_tokens=token_counter.prompt_llm_token_count,
+        llm_completion_tokens=token_counter.completion_llm_token_count,
+        total_llm_tokens=token_counter.total_llm_token_count
+    )
+    counts = {**token_counts.dict(), **token_counter.prefix_counts()}
+
+    # Prepare metadata
+    metadata = {"token_counts": counts}
+    if plan:
+        metadata["filter_plan"] = plan.to_dict()
+    if cutoff:
+        metadata["retrieval"] = cutoff.to_dict()
+    if data.metadata:
+        metadata.update(data.metadata)
+
+    return query_response(data, response, metadata, token_counts), counts
@@ -1,5 +1,10 @@
+import asyncio
+import codecs
+import hashlib
+import itertools
 import tempfile
 from pathlib import Path
+from typing import Iterator
 import os
 import logging
 from whisk.kitchenai_sdk.schema import (
@@ -8,13 +13,27 @@ from whisk.kitchenai_sdk.schema import (
     WhiskStorageStatus,
     TokenCountSchema
 )
-from llama_index.core import StorageContext, VectorStoreIndex
-from llama_index.core.node_parser import TokenTextSplitter
+from llama_index.core import Settings
+from llama_index.core.schema import Document, MetadataMode
 from llama_index.core.extractors import TitleExtractor, QuestionsAnsweredExtractor
 from kitchenai_llama.storage.llama_parser import Parser
 
+from ..dependencies.vector_store import route_vector_store
+from ..utils.chunking import create_splitter
+from ..utils.ingest_jobs import STAGES, IngestJob, ingest_jobs
+from ..utils.llm_client import llm_lane
+from ..utils.metrics import stage
+from ..utils.tombstones import delete_pipeline, FILE_ID_KEY
+from ..utils.uploads import UPLOAD_ID_KEY, document_metadata, is_chunked, upload_spool
+
 logger = logging.getLogger(__name__)
 
+# Plain text formats read in segments instead of being parsed whole
+SEGMENTED_EXTENSIONS = {".txt", ".md", ".csv", ".log", ".json", ".jsonl"}
+SEGMENT_BYTES = int(os.getenv("WHISK_INGEST_SEGMENT_BYTES", str(1024 * 1024)))
+# Documents split, extracted, embedded and stored together
+BATCH_DOCUMENTS = int(os.getenv("WHISK_INGEST_BATCH_DOCUMENTS", "8"))
+
 async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_counter=None) -> WhiskStorageResponseSchema:
     """Storage handler for document ingestion and vectorization.
     
@@ -23,8 +42,10 @@ async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_cou
             - id (int): Unique document ID
             - name (str): Document filename
             - label (str): Handler label (e.g. "storage")
-            - data (bytes): Document binary data
-            - metadata (dict, optional): Document metadata
+            - data (bytes): Document binary data, or one chunk of it
+            - metadata (dict, optional): Document metadata; large files can
+              be sent in chunks by adding upload_id, chunk_index,
+              chunk_count and chunk_offset (see ``UploadSpool``)
             - extension (str, optional): File extension
         vector_store: Vector store for document storage
         token_counter: Counter for tracking token usage
@@ -32,9 +53,13 @@ async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_cou
     Returns:
         WhiskStorageResponseSchema: Response containing:
             - id (int): Document ID
-            - status (WhiskStorageStatus): Processing status
+            - status (WhiskStorageStatus): Processing status, ACK for the
+              chunks of an upload that is not complete yet
             - error (str, optional): Error message if failed
-            - metadata (dict): Document metadata
+            - metadata (dict): Document metadata, including the per-stage
+              timings (parse, split, extract, embed, upsert) in milliseconds
+              and, for uploads sent in chunks, upload_status and
+              chunks_received, as the client reports every status as COMPLETE
             - token_counts (TokenCountSchema): Token usage stats
             
     Example:
@@ -49,6 +74,10 @@ async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_cou
         >>> response = await storage_handler(request, vector_store)
     """
     try:
+        metadata = document_metadata(data.metadata)
+        if is_chunked(data.metadata):
+            return await store_chunk(data, metadata, vector_store, token_counter)
+
         # Create a temporary directory
         with tempfile.TemporaryDirectory() as temp_dir:
             # Use the original filename for the temporary file
@@ -57,51 +86,8 @@ async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_cou
             # Write bytes data to temporary file
             with open(temp_file_path, 'wb') as f:
                 f.write(data.data)
-            
-            # Initialize parser and load the file
-            parser = Parser(api_key=os.environ.get("LLAMA_CLOUD_API_KEY", None))
-            response = parser.load(str(temp_dir), metadata=data.metadata)
-            
-            # Setup storage context and process documents
-            storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            
-            # Create index with transformations
-            VectorStoreIndex.from_documents(
-                response["documents"],
-                storage_context=storage_context,
-                transformations=[
-                    TokenTextSplitter(),
-                    TitleExtractor(),
-                    QuestionsAnsweredExtractor()
-                ],
-                show_progress=True
-            )
 
-            # Get token counts if counter is available
-            token_counts = None
-            if token_counter:
-                token_counts = TokenCountSchema(
-                    embedding_tokens=token_counter.total_embedding_token_count,
-                    llm_prompt_tokens=token_counter.prompt_llm_token_count,
-                    llm_completion_tokens=token_counter.completion_llm_token_count,
-                    total_llm_tokens=token_counter.total_llm_token_count
-                )
-                token_counter.reset_counts()
-
-            # Prepare metadata
-            metadata = {
-                "document_count": len(response["documents"]),
-                "file_name": data.name,
-            }
-            if data.metadata:
-                metadata.update(data.metadata)
-
-            return WhiskStorageResponseSchema(
-                id=data.id,
-                status=WhiskStorageStatus.COMPLETE,
-                metadata=metadata,
-                token_counts=token_counts
-            )
+            return await store_file(data, temp_file_path, metadata, vector_store, token_counter)
             
     except Exception as e:
         logger.error(f"Error in storage handler: {str(e)}")
@@ -111,13 +97,215 @@ async def storage_handler(data: WhiskStorageSchema, vector_store=None, token_cou
             error=str(e)
         )
 
+async def store_chunk(data: WhiskStorageSchema, metadata, vector_store, token_counter) -> WhiskStorageResponseSchema:
+    """Spill one chunk of an upload to disk and ingest the file once all chunks are in"""
+    upload_id = data.metadata[UPLOAD_ID_KEY]
+    chunk_count = int(data.metadata["chunk_count"])
+    received = await asyncio.to_thread(
+        upload_spool.write_chunk,
+        upload_id,
+        data.name,
+        int(data.metadata["chunk_index"]),
+        chunk_count,
+        int(data.metadata["chunk_offset"]),
+        data.data
+    )
+    # WhiskClient publishes every storage response as COMPLETE and only
+    # forwards the metadata, so progress is reported there as well
+    progress = {"upload_id": upload_id, "chunks_received": received, "chunk_count": chunk_count}
+    if received < chunk_count or not upload_spool.claim(upload_id):
+        return WhiskStorageResponseSchema(
+            id=data.id,
+            status=WhiskStorageStatus.ACK,
+            metadata={**progress, "upload_status": WhiskStorageStatus.ACK.value}
+        )
+
+    try:
+        response = await store_file(
+            data, upload_spool.path(upload_id, data.name), metadata, vector_store, token_counter
+        )
+    except Exception:
+        upload_spool.release(upload_id)
+        raise
+    if response.status == WhiskStorageStatus.ERROR:
+        # Keep the file so resending any chunk retries from the checkpoints
+        upload_spool.release(upload_id)
+    else:
+        upload_spool.discard(upload_id)
+    response.metadata.update(progress, upload_status=(response.status or WhiskStorageStatus.COMPLETE).value)
+    return response
+
+async def store_file(data: WhiskStorageSchema, path: Path, metadata, vector_store, token_counter) -> WhiskStorageResponseSchema:
+    """Ingest the file at ``path`` and build the storage response"""
+    # Setup storage context and process documents
+    vector_store, _ = route_vector_store(vector_store, data.metadata)
+
+    # Finish a pending delete of this file before writing it again; that
+    # also removes what an earlier attempt stored, so it cannot be resumed
+    restart = str(data.id) in delete_pipeline.hidden(vector_store)
+    await delete_pipeline.flush(vector_store, str(data.id))
+
+    fingerprint = await asyncio.to_thread(file_fingerprint, path)
+    job = ingest_jobs.begin(vector_store.client.name, str(data.id), fingerprint, restart=restart)
+    # Documents already checkpointed by an earlier attempt are not parsed again
+    documents = itertools.islice(iter_documents(path, metadata), job.documents, None)
+    try:
+        # Extractor and embedding calls yield to interactive queries at the LLM client
+        with llm_lane("batch"):
+            await ingest(documents, vector_store, job, parsed_whole=not is_segmented(path))
+    except Exception as e:
+        ingest_jobs.fail(job, str(e))
+        logger.error(f"Ingestion of {data.name} stopped, a retry resumes it: {job.progress()}")
+        return WhiskStorageResponseSchema(
+            id=data.id,
+            status=WhiskStorageStatus.ERROR,
+            error=str(e),
+            metadata={"file_name": data.name, **job.progress()}
+        )
+    ingest_jobs.complete(job)
+
+    # Get token counts if counter is available
+    token_counts = None
+    if token_counter:
+        token_counts = TokenCountSchema(
+            embedding_tokens=token_counter.total_embedding_token_count,
+            llm_prompt_tokens=token_counter.prompt_llm_token_count,
+            llm_completion_tokens=token_counter.completion_llm_token_count,
+            total_llm_tokens=token_counter.total_llm_token_count
+        )
+        token_counter.reset_counts()
+
+    # Prepare metadata
+    response_metadata = {
+        "document_count": job.documents,
+        "file_name": data.name,
+        **job.progress()
+    }
+    if metadata:
+        response_metadata.update(metadata)
+
+    return WhiskStorageResponseSchema(
+        id=data.id,
+        status=WhiskStorageStatus.COMPLETE,
+        metadata=response_metadata,
+        token_counts=token_counts
+    )
+
+def read_segments(path: Path, metadata) -> Iterator[Document]:
+    """Documents of about ``SEGMENT_BYTES`` each, cut at line ends"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    with open(path, "rb") as f:
+        while block := f.read(SEGMENT_BYTES):
+            text = pending + decoder.decode(block)
+            cut = text.rfind("\n") + 1 or len(text)
+            segment, pending = text[:cut], text[cut:]
+            if segment:
+                yield Document(text=segment, metadata=dict(metadata or {}))
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield Document(text=pending, metadata=dict(metadata or {}))
+
+def is_segmented(path: Path) -> bool:
+    """Whether the file is read in segments rather than parsed whole"""
+    return path.suffix.lower() in SEGMENTED_EXTENSIONS and path.stat().st_size > SEGMENT_BYTES
+
+def iter_documents(path: Path, metadata) -> Iterator[Document]:
+    """Parsed documents of the file at ``path``, one at a time where the
+    format allows it"""
+    if is_segmented(path):
+        yield from read_segments(path, metadata)
+        return
+
+    # Other formats are parsed whole; the parser reads the file's directory
+    parser = Parser(api_key=os.environ.get("LLAMA_CLOUD_API_KEY", None))
+    yield from parser.load(str(path.parent), metadata=metadata)["documents"]
+
+def file_fingerprint(path: Path) -> str:
+    """Content hash that tells a retry of a file from a new version of it"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+async def ingest(documents: Iterator[Document], vector_store, job: IngestJob, parsed_whole: bool = False):
+    """Split, extract, embed and store ``documents`` a batch at a time.
+
+    Only one batch of documents and their nodes is held in memory, however
+    large the file. Every batch is checkpointed after each stage, so a job
+    resumed after a failure starts at the first stage it has not finished.
+    With ``parsed_whole`` the parser has already produced every document, so
+    all of them are checkpointed at once and a resumed job never parses the
+    file again.
+    """
+    # Chunking strategy and sizes come from config.yml; sizes follow the
+    # configured counting strategy
+    splitter = create_splitter()
+    extractors = (TitleExtractor(), QuestionsAnsweredExtractor())
+
+    async def run_stage(name: str, nodes: list) -> list:
+        if name == "split":
+            return await splitter.acall(nodes)
+        if name == "extract":
+            for extractor in extractors:
+                nodes = await extractor.acall(nodes)
+            return nodes
+        if name == "embed":
+            embeddings = await Settings.embed_model.aget_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            return nodes
+        await asyncio.to_thread(vector_store.add, nodes)
+        return nodes
+
+    batch = job.batches_stored
+    while True:
+        checkpoint = await asyncio.to_thread(ingest_jobs.load, job, batch)
+        if checkpoint is not None:
+            done, nodes = checkpoint
+        else:
+            if job.parsed_all:
+                return
+            # Run the ingestion stages one by one so each can be timed
+            with stage("parse"):
+                nodes = list(documents if parsed_whole else itertools.islice(documents, BATCH_DOCUMENTS))
+            if not nodes:
+                ingest_jobs.parsed(job)
+                return
+
+            # Tag chunks with the file id so they can be deleted later
+            for document in nodes:
+                document.metadata[FILE_ID_KEY] = job.file_id
+                document.excluded_embed_metadata_keys.append(FILE_ID_KEY)
+                document.excluded_llm_metadata_keys.append(FILE_ID_KEY)
+            if parsed_whole:
+                for start in range(0, len(nodes), BATCH_DOCUMENTS):
+                    await asyncio.to_thread(
+                        ingest_jobs.save, job, batch + start // BATCH_DOCUMENTS, "parse",
+                        nodes[start:start + BATCH_DOCUMENTS]
+                    )
+                ingest_jobs.parsed(job)
+                continue
+            await asyncio.to_thread(ingest_jobs.save, job, batch, "parse", nodes)
+            done = "parse"
+
+        for name in STAGES[STAGES.index(done) + 1:]:
+            with stage(name):
+                nodes = await run_stage(name, nodes)
+            await asyncio.to_thread(ingest_jobs.save, job, batch, name, nodes)
+        batch += 1
+
 async def storage_delete_handler(data: WhiskStorageSchema, vector_store=None) -> None:
     """Handler for deleting documents from storage.
+
+    The document is tombstoned and hidden from queries immediately; its
+    vectors are removed in batches by a background compaction task.
     
     Args:
         data (WhiskStorageSchema): Storage request with fields:
             - id (int): Document ID to delete
             - label (str): Handler label (e.g. "storage")
+            - metadata (dict, optional): Shard metadata (e.g. {"tenant": "acme"})
         vector_store: Vector store to delete from
         
     Returns:
@@ -134,9 +322,12 @@ async def storage_delete_handler(data: WhiskStorageSchema, vector_store=None) ->
         >>> await storage_delete_handler(request, vector_store)
     """
     try:
+        vector_store, _ = route_vector_store(vector_store, data.metadata)
         if vector_store and hasattr(vector_store, "delete"):
-            # Delete by document ID (convert int to string for ChromaDB)
-            await vector_store.adelete(ref_doc_id=str(data.id))
+            # Tombstone by document ID (convert int to string for ChromaDB)
+            delete_pipeline.delete(vector_store, str(data.id))
+            delete_pipeline.start()
+            logger.info(f"Delete pipeline: {delete_pipeline.metrics()}")
     except Exception as e:
         logger.error(f"Error in storage delete handler: {str(e)}")
         raise 
\ No newline at end of file
@@ -1,27 +1,120 @@
+import asyncio
+import functools
+import logging
 import os
-from pathlib import Path
+import signal
 from dotenv import load_dotenv
 from whisk.kitchenai_sdk.kitchenai import KitchenAIApp
 from whisk.kitchenai_sdk.schema import DependencyType
-from llama_index.core.prompts.system import SHAKESPEARE_WRITING_ASSISTANT
 
-from .dependencies.llm import setup_llm
-from .dependencies.vector_store import setup_vector_store
-from .utils.token_counter import create_token_counter
-from .handlers import query, storage
+from .utils.lazy import LazyDependency, lazy_handler, warm_up, LAZY_START
+from .utils.concurrency import label_values, limiter, reject_delete, reject_query, reject_storage
+from .utils.config import config, setting, switch
+from .utils.metrics import instrument
+from .utils.profiling import profiled
+from .utils.shutdown import on_drain
+from .utils.wire import response_format
+from .utils.token_counter import get_encoding, tokenizers
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Initialize token counter
-token_counter = create_token_counter()
+# Settings come from config.yml; a WHISK_* environment variable overrides the
+# matching key. Heavy imports (llama_index, chromadb, tiktoken) happen inside
+# the dependency factories and handler modules, which load on first use.
+chroma_path = os.path.join(os.getcwd(), config.section("chroma").get("path") or "chroma_db")
+
+# NATS connection of the worker, read once at startup
+nats_settings = config.section("nats")
+client_settings = {
+    "nats_url": nats_settings.get("url"),
+    "user": nats_settings.get("user"),
+    "password": nats_settings.get("password"),
+    "client_id": config.section("client").get("id"),
+}
+
+def llm_settings(section: dict) -> dict:
+    return {
+        "timeout": setting(section, "timeout", "WHISK_LLM_TIMEOUT", 60.0, float),
+        "max_retries": setting(section, "max_retries", "WHISK_LLM_MAX_RETRIES", 2, int),
+    }
+
+def client_limits(section: dict) -> dict:
+    return {
+        "rpm": setting(section, "rpm", "WHISK_LLM_RPM", 500.0, float),
+        "tpm": setting(section, "tpm", "WHISK_LLM_TPM", 200000.0, float),
+        "max_connections": setting(section, "max_connections", "WHISK_LLM_MAX_CONNECTIONS", 64, int),
+    }
+
+def build_llm(section: dict | None = None):
+    from .dependencies.llm import setup_llm
+    from .utils.llm_client import configure_http_client
+    from .utils.token_counter import create_token_counter
+    section = config.section("llm") if section is None else section
+    llm = setup_llm(create_token_counter(), **llm_settings(section))
+    configure_http_client(**client_limits(section))
+    return llm
+
+def build_embed_model(section: dict | None = None, llm_section: dict | None = None):
+    from .dependencies.embeddings import setup_embed_model
+    from .utils.embedding_cache import embedding_cache
+    section = config.section("embeddings") if section is None else section
+    llm_section = config.section("llm") if llm_section is None else llm_section
+
+    # Vectors of repeated chunks and queries are reused across requests
+    embedding_cache.max_bytes = setting(section, "cache_mb", "WHISK_EMBEDDING_CACHE_MB", 1024, int) << 20
+    cache_enabled = setting(section, "cache", "WHISK_EMBEDDING_CACHE", True, switch)
+    return setup_embed_model(
+        os.path.join(chroma_path, "embeddings") if cache_enabled else None, **llm_settings(llm_section)
+    )
+
+def open_vector_store(section: dict | None = None):
+    from .dependencies.vector_store import setup_vector_store
+    section = config.section("chroma") if section is None else section
+
+    # Setup vector store with string path, sharded by tenant when configured
+    return setup_vector_store(
+        chroma_path,
+        shard_key=setting(section, "shard_key", "WHISK_SHARD_KEY", None),
+        idle_ttl=setting(section, "idle_ttl", "WHISK_SHARD_IDLE_TTL", 600.0, float),
+    )
+
+def build_vector_store():
+    from .utils.ingest_jobs import ingest_jobs
+    from .utils.tombstones import delete_pipeline
+    from .utils.uploads import upload_spool
+
+    vector_store = open_vector_store()
+
+    # Persist delete tombstones next to the vector data
+    delete_pipeline.configure(
+        chroma_path,
+        batch_size=int(os.getenv("WHISK_COMPACTION_BATCH_SIZE", "100")),
+    )
+
+    # Checkpoints of unfinished ingestion jobs, so retries resume
+    ingest_jobs.configure(chroma_path)
+
+    # Spill files of chunked uploads, on the same disk as the vector data
+    upload_spool.configure(os.getenv("WHISK_UPLOAD_DIR") or os.path.join(chroma_path, "uploads"))
+
+    build_embed_model()
+    return vector_store
+
+def build_system_prompt():
+    from llama_index.core.prompts.system import SHAKESPEARE_WRITING_ASSISTANT
+    from .utils.prompts import compile_prompt
+    return compile_prompt(SHAKESPEARE_WRITING_ASSISTANT)
 
 # Initialize dependencies
-llm = setup_llm(token_counter)
+llm = LazyDependency(build_llm)
+vector_store = LazyDependency(build_vector_store)
+system_prompt = LazyDependency(build_system_prompt)
 
-# Setup vector store with string path
-chroma_path = os.path.join(os.getcwd(), "chroma_db")
-vector_store = setup_vector_store(chroma_path)
+# Shared tiktoken encoding, loaded once for every handler
+encoding = LazyDependency(get_encoding)
 
 # Initialize KitchenAI App
 kitchen = KitchenAIApp(namespace="{{ cookiecutter.project_slug }}")
@@ -29,36 +122,116 @@ kitchen = KitchenAIApp(namespace="{{ cookiecutter.project_slug }}")
 # Register dependencies
 kitchen.register_dependency(DependencyType.LLM, llm)
 kitchen.register_dependency(DependencyType.VECTOR_STORE, vector_store)
-kitchen.register_dependency(DependencyType.SYSTEM_PROMPT, SHAKESPEARE_WRITING_ASSISTANT)
+kitchen.register_dependency(DependencyType.SYSTEM_PROMPT, system_prompt)
 
-# Register handlers
+# Register instrumented handlers, bounded by the per-worker concurrency limit
+# and profiled when sampled or requested through metadata. Query handlers
+# answer in the full or compact response format requested through metadata.
 kitchen.query.handler("query", DependencyType.LLM, DependencyType.VECTOR_STORE, DependencyType.SYSTEM_PROMPT)(
-    query.query_handler
+    instrument("query", limiter.limit(
+        profiled(response_format(lazy_handler(f"{__package__}.handlers.query", "query_handler"))), reject_query
+    ))
+)
+kitchen.query.handler("batch_query", DependencyType.LLM, DependencyType.VECTOR_STORE, DependencyType.SYSTEM_PROMPT)(
+    instrument("batch_query", limiter.limit(
+        profiled(response_format(lazy_handler(f"{__package__}.handlers.batch_query", "batch_query_handler"))), reject_query
+    ))
 )
-kitchen.storage.handler("storage")(storage.storage_handler)
-kitchen.storage.on_delete("storage")(storage.storage_delete_handler)
+kitchen.query.handler("nodes", DependencyType.VECTOR_STORE)(
+    instrument("nodes", limiter.limit(
+        lazy_handler(f"{__package__}.handlers.nodes", "nodes_handler"), reject_query
+    ))
+)
+kitchen.storage.handler("storage", DependencyType.VECTOR_STORE)(
+    instrument("storage", limiter.limit(
+        profiled(lazy_handler(f"{__package__}.handlers.storage", "storage_handler")), reject_storage
+    ))
+)
+kitchen.storage.on_delete("storage", DependencyType.VECTOR_STORE)(
+    instrument("storage_delete", limiter.limit(
+        lazy_handler(f"{__package__}.handlers.storage", "storage_delete_handler"), reject_delete, label="storage_delete"
+    ))
+)
+
+def apply_limits(section: dict):
+    limiter.resize(
+        setting(section, "max_concurrency", "WHISK_MAX_CONCURRENCY", 8, int),
+        setting(section, "max_pending", "WHISK_MAX_PENDING", 32, int),
+    )
+    limiter.configure(
+        weights=setting(section, "weights", "WHISK_LABEL_WEIGHTS", {}, label_values),
+        label_concurrency=setting(
+            section, "label_concurrency", "WHISK_LABEL_MAX_CONCURRENCY", {}, functools.partial(label_values, cast=int)
+        ),
+        tenant_concurrency=setting(section, "tenant_concurrency", "WHISK_TENANT_MAX_CONCURRENCY", 0, int),
+        tenant_pending=setting(section, "tenant_pending", "WHISK_TENANT_MAX_PENDING", 0, int),
+        tenant_key=setting(section, "tenant_key", "WHISK_TENANT_KEY", "tenant"),
+    )
+
+def apply_tokenizer(section: dict):
+    tokenizers.memo_size = setting(section, "memo_size", "WHISK_TOKEN_MEMO_SIZE", 4096, int)
+
+apply_limits(config.section("limits"))
+apply_tokenizer(config.section("tokenizer"))
+
+# Changes to config.yml are applied without a restart. Dependencies are
+# rebuilt only when a setting they were built from changes; requests already
+# running keep the objects they started with, and warm shards, caches and
+# tokenizers are kept. nats and client settings apply on restart.
+config.on_change("limits", lambda new, old: apply_limits(new))
+config.on_change("tokenizer", lambda new, old: apply_tokenizer(new))
+
+@config.on_change("llm")
+def reload_llm(new: dict, old: dict):
+    from .utils.llm_client import configure_http_client
+    configure_http_client(**client_limits(new))
+    if llm_settings(new) != llm_settings(old):
+        llm.reload(functools.partial(build_llm, new))
+        if vector_store.loaded:
+            build_embed_model(llm_section=new)
+
+@config.on_change("embeddings")
+def reload_embeddings(new: dict, old: dict):
+    if vector_store.loaded:
+        build_embed_model(new)
+
+@config.on_change("chroma")
+def reload_chroma(new: dict, old: dict):
+    if new.get("path") != old.get("path"):
+        logger.warning("chroma.path changes apply on restart")
+    if setting(new, "shard_key", "WHISK_SHARD_KEY", None) != setting(old, "shard_key", "WHISK_SHARD_KEY", None):
+        vector_store.reload(functools.partial(open_vector_store, new))
+    elif vector_store.loaded and hasattr(vector_store.get(), "idle_ttl"):
+        vector_store.get().idle_ttl = setting(new, "idle_ttl", "WHISK_SHARD_IDLE_TTL", 600.0, float)
+
+if not LAZY_START:
+    warm_up()
+
+async def startup():
+    """Background startup work run alongside the client"""
+    # Load models in the background so the first request finds them warm
+    await asyncio.to_thread(warm_up)
+
+    # Resume compaction of deletes left over from a previous run
+    from .utils.tombstones import delete_pipeline
+    delete_pipeline.start()
+
+    # Apply edits to config.yml on SIGHUP, and when polling notices them
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, config.reload)
+    interval = float(os.getenv("WHISK_CONFIG_RELOAD_INTERVAL", "5"))
+    if interval > 0:
+        config.start(interval)
+
+@on_drain
+async def stop_compaction():
+    """Finish the running compaction batch before the process exits"""
+    from .utils.tombstones import delete_pipeline
+    await delete_pipeline.stop()
 
 if __name__ == "__main__":
-    from whisk.client import WhiskClient
-    import asyncio
-    import logging
+    from .worker import run_worker
 
     # Setup logging
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    client = WhiskClient(
-        nats_url=os.getenv("WHISK_NATS_URL", "nats://nats.playground.kitchenai.dev"),
-        client_id=os.getenv("WHISK_CLIENT_ID", "whisk_client"),
-        user=os.getenv("WHISK_NATS_USER", "playground"),
-        password=os.getenv("WHISK_NATS_PASSWORD", "kitchenai_playground"),
-        kitchen=kitchen,
-    )
-    
-    async def start():
-        await client.run()
-
-    try:
-        asyncio.run(start())
-    except KeyboardInterrupt:
-        logger.info("\nShutting down gracefully...") 
\ No newline at end of file
+
+    run_worker(kitchen, startup, client_settings)
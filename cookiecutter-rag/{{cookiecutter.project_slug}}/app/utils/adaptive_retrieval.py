@@ -0,0 +1,78 @@
+import os
+from typing import List, Optional
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from .metrics import metrics
+
+# Chunks sent to the LLM in fixed mode, and before any cutoff in adaptive mode
+SIMILARITY_TOP_K = int(os.getenv("WHISK_SIMILARITY_TOP_K", str(DEFAULT_SIMILARITY_TOP_K)))
+
+# "fixed" sends the top SIMILARITY_TOP_K chunks to the LLM; "adaptive" fetches
+# up to WHISK_ADAPTIVE_MAX_K candidates and keeps as many as their scores justify
+RETRIEVAL_MODE = os.getenv("WHISK_RETRIEVAL_MODE", "fixed").lower()
+if RETRIEVAL_MODE not in ("fixed", "adaptive"):
+    raise ValueError(f"WHISK_RETRIEVAL_MODE must be 'fixed' or 'adaptive', not {RETRIEVAL_MODE!r}")
+
+class AdaptiveCutoff(BaseNodePostprocessor):
+    """Keeps a score-dependent number of retrieved chunks.
+
+    Candidates are taken in score order and adding stops at the first one
+    that scores ``drop`` (a fraction of the top score) below the top hit,
+    or ``cliff`` below the chunk before it. Beyond ``base_k`` chunks only
+    near-ties with the top hit, within ``tie`` of its score, are added, so
+    k grows only when the best results are ambiguous. Scores are the
+    positive ``exp(-distance)`` similarities of the Chroma retrievers.
+    """
+
+    base_k: int = SIMILARITY_TOP_K
+    max_k: int = 8
+    drop: float = 0.2
+    cliff: float = 0.1
+    tie: float = 0.03
+
+    _candidates: int = PrivateAttr(default=0)
+    _selected: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AdaptiveCutoff"
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        ranked = sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)[:self.max_k]
+        selected = ranked[:1]
+        if ranked:
+            top = ranked[0].score or 0.0
+            for previous, node in zip(ranked, ranked[1:]):
+                score = node.score or 0.0
+                if score < top * (1 - self.drop) or score < (previous.score or 0.0) * (1 - self.cliff):
+                    break
+                if len(selected) >= self.base_k and score < top * (1 - self.tie):
+                    break
+                selected.append(node)
+
+        self._candidates = len(nodes)
+        self._selected = len(selected)
+        metrics.inc("whisk_retrieval_candidates_total", len(nodes), help="Chunks retrieved as candidates")
+        metrics.inc("whisk_retrieval_selected_total", len(selected), help="Chunks kept for the LLM")
+        return selected
+
+    def to_dict(self) -> dict:
+        return {"mode": "adaptive", "candidates": self._candidates, "selected": self._selected}
+
+def adaptive_cutoff() -> AdaptiveCutoff | None:
+    """Cutoff for one query in adaptive mode, None in fixed mode"""
+    if RETRIEVAL_MODE != "adaptive":
+        return None
+    return AdaptiveCutoff(
+        base_k=SIMILARITY_TOP_K,
+        max_k=int(os.getenv("WHISK_ADAPTIVE_MAX_K", "8")),
+        drop=float(os.getenv("WHISK_ADAPTIVE_DROP", "0.2")),
+        cliff=float(os.getenv("WHISK_ADAPTIVE_CLIFF", "0.1")),
+        tie=float(os.getenv("WHISK_ADAPTIVE_TIE", "0.03"))
+    )
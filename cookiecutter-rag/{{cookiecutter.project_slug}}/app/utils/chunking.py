@@ -0,0 +1,290 @@
+import asyncio
+import threading
+from typing import Any, List, Sequence
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.node_parser import NodeParser
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from .config import config as settings
+from .token_counter import DEFAULT_MODEL, TOKEN_COUNTING, count_tokens, get_encoding
+from .token_estimate import token_positions
+
+STRATEGIES = ("token", "sentence", "semantic")
+
+# Characters that end a sentence when followed by whitespace
+SENTENCE_ENDS = np.array([ord(c) for c in ".!?。！？"], dtype=np.uint32)
+SPACES = np.array([ord(c) for c in " \t\n\r\f\v 　"], dtype=np.uint32)
+
+_byte_lengths = {}
+_byte_lengths_lock = threading.Lock()
+
+def token_byte_lengths(encoding) -> np.ndarray | None:
+    """Byte length of every token id of ``encoding``, built once per encoding,
+    or None when the encoding cannot decode single tokens"""
+    if not hasattr(encoding, "decode_single_token_bytes"):
+        return None
+    key = getattr(encoding, "name", id(encoding))
+    lengths = _byte_lengths.get(key)
+    if lengths is None:
+        with _byte_lengths_lock:
+            lengths = _byte_lengths.get(key)
+            if lengths is None:
+                lengths = np.zeros(encoding.n_vocab, dtype=np.int64)
+                for token in range(encoding.n_vocab):
+                    try:
+                        lengths[token] = len(encoding.decode_single_token_bytes(token))
+                    except KeyError:
+                        pass
+                _byte_lengths[key] = lengths
+    return lengths
+
+def token_offsets(text: str, model: str = DEFAULT_MODEL, exact: bool | None = None) -> np.ndarray:
+    """Character offset at which each token of ``text`` starts.
+
+    The text is tokenized once; in approximate mode the offsets come from
+    the byte class estimate and nothing is tokenized. Every chunk boundary
+    and chunk length is then read from these offsets.
+    """
+    if not text:
+        return np.zeros(0, dtype=np.int64)
+    if TOKEN_COUNTING == "exact" if exact is None else exact:
+        encoding = get_encoding(model)
+        tokens = np.asarray(encoding.encode(text, disallowed_special=()), dtype=np.int64)
+        lengths = token_byte_lengths(encoding)
+        if lengths is not None:
+            byte_offsets = np.concatenate(([0], np.cumsum(lengths[tokens])[:-1]))
+        else:
+            # Place the exact number of tokens where the estimate puts its tokens
+            estimate = token_positions(text)
+            picks = np.linspace(0, len(estimate) - 1, len(tokens)).astype(np.int64)
+            byte_offsets = estimate[picks] if len(estimate) else np.zeros(len(tokens), dtype=np.int64)
+    else:
+        byte_offsets = token_positions(text)
+
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    if len(data) == len(text):
+        return byte_offsets
+    # Map byte offsets to characters; a token starting inside a character starts at it
+    char_of_byte = np.cumsum((data & 0xC0) != 0x80) - 1
+    return char_of_byte[np.minimum(byte_offsets, len(data) - 1)]
+
+def _code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+def word_starts(text: str, offsets: np.ndarray) -> np.ndarray:
+    """Indices of the tokens that start at or right after whitespace"""
+    is_space = np.isin(_code_points(text), SPACES)
+    before = np.concatenate(([True], is_space))[offsets]
+    return np.flatnonzero(is_space[offsets] | before)
+
+def sentence_starts(text: str, offsets: np.ndarray) -> np.ndarray:
+    """Indices of the tokens holding the first character of a sentence.
+
+    A sentence starts after a sentence end and whitespace, or after a blank
+    line.
+    """
+    codes = _code_points(text)
+    if len(codes) < 2:
+        return np.zeros(0, dtype=np.int64)
+    is_space = np.isin(codes, SPACES)
+    positions = np.arange(len(codes))
+    # The last non-space character at or before each position
+    last_word = np.maximum.accumulate(np.where(is_space, -1, positions))
+    newlines = np.cumsum(codes == ord("\n"))
+
+    candidate = positions[1:][~is_space[1:] & is_space[:-1]]
+    previous = last_word[candidate - 1]
+    has_previous = previous >= 0
+    ends = np.zeros(len(candidate), dtype=bool)
+    ends[has_previous] = np.isin(codes[previous[has_previous]], SENTENCE_ENDS)
+    blank_line = newlines[candidate - 1] - newlines[np.maximum(previous, 0)] >= 2
+    starts = candidate[(ends | blank_line) & has_previous]
+    return np.unique(np.searchsorted(offsets, starts, side="right") - 1)
+
+def char_cuts(text: str, offsets: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Character positions of cuts before the tokens at ``indices``.
+
+    A cut that falls inside a word moves forward to the word's end when that
+    is within the token, which places cuts made from estimated offsets, and
+    before tokens that start mid-word, at whitespace.
+    """
+    is_space = np.isin(_code_points(text), SPACES)
+    ends = np.append(offsets, len(text))
+    # A cut before position p is clean when p or the character before it is whitespace
+    clean = np.concatenate(([True], is_space[1:] | is_space[:-1], [True]))
+    positions = np.arange(len(clean))
+    next_clean = np.minimum.accumulate(np.where(clean, positions, len(clean))[::-1])[::-1]
+    cuts = ends[indices]
+    following = ends[np.minimum(indices + 1, len(offsets))]
+    snapped = next_clean[cuts]
+    return np.where(snapped <= following, snapped, cuts)
+
+def semantic_breaks(sentences: list[str], embeddings, percentile: float) -> np.ndarray:
+    """Indices of the sentences that start a new topic: those further from
+    the sentence before them than ``percentile`` of all adjacent distances"""
+    if len(sentences) < 2:
+        return np.zeros(0, dtype=np.int64)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    distances = 1.0 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+    return np.flatnonzero(distances > np.percentile(distances, percentile)) + 1
+
+def _last(boundaries: np.ndarray, low: int, high: int) -> int | None:
+    """Largest boundary in (low, high]"""
+    index = np.searchsorted(boundaries, high, side="right") - 1
+    if index >= 0 and boundaries[index] > low:
+        return int(boundaries[index])
+    return None
+
+def _first(boundaries: np.ndarray, low: int, high: int) -> int | None:
+    """Smallest boundary in [low, high)"""
+    index = np.searchsorted(boundaries, low, side="left")
+    if index < len(boundaries) and boundaries[index] < high:
+        return int(boundaries[index])
+    return None
+
+def pack(count: int, size: int, overlap: int, boundaries: np.ndarray,
+         fallback: np.ndarray | None = None, breaks: np.ndarray | None = None) -> list[tuple[int, int]]:
+    """Token spans of at most ``size`` of ``count`` tokens.
+
+    Spans end at the last of ``boundaries`` that fits, else at the last of
+    ``fallback``, else after ``size`` tokens; they never cross ``breaks``.
+    The next span starts at the first boundary within ``overlap`` tokens
+    before the end of the previous one, so overlaps hold whole units.
+    """
+    breaks = np.zeros(0, dtype=np.int64) if breaks is None else breaks
+    spans = []
+    start = 0
+    while start < count:
+        limit = min(start + size, count)
+        next_break = _first(breaks, start + 1, limit + 1)
+        if next_break is not None:
+            end = next_break
+        elif limit == count:
+            end = count
+        else:
+            end = _last(boundaries, start, limit)
+            if end is None and fallback is not None:
+                end = _last(fallback, start, limit)
+            end = end or limit
+        spans.append((start, end))
+        if end >= count:
+            break
+        low = end - overlap
+        previous_break = _last(breaks, -1, end)
+        if previous_break is not None:
+            low = max(low, previous_break)
+        start = (_first(boundaries, max(low, start + 1), end) if overlap else None) or end
+    return spans
+
+class ChunkingSplitter(NodeParser):
+    """Splits documents into chunks of at most ``chunk_size`` tokens.
+
+    Each document is tokenized once; chunk boundaries are picked from the
+    token offsets with vectorized scans, and the metadata length is counted
+    once per document instead of once per chunk. Strategies:
+
+    - "token" cuts at the last word boundary that fits
+    - "sentence" packs whole sentences, cutting only sentences that do not fit
+    - "semantic" packs sentences too, and also cuts where adjacent sentences
+      embed further apart than ``breakpoint_percentile`` of the document's
+      sentence pairs. It embeds every sentence once more at ingestion.
+    """
+
+    strategy: str = "token"
+    chunk_size: int = 1024
+    chunk_overlap: int = 20
+    breakpoint_percentile: float = 95.0
+    model: str = DEFAULT_MODEL
+    exact: bool | None = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ChunkingSplitter"
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Chunking strategy must be one of {', '.join(STRATEGIES)}, not {self.strategy!r}")
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError(f"chunk_overlap ({self.chunk_overlap}) must be smaller than chunk_size ({self.chunk_size})")
+
+    def metadata_tokens(self, node: BaseNode) -> int:
+        """Tokens the node's metadata adds to each of its chunks"""
+        if not self.include_metadata:
+            return 0
+        return max(
+            count_tokens(node.get_metadata_str(mode=mode), self.model, self.exact)
+            for mode in (MetadataMode.EMBED, MetadataMode.LLM)
+        )
+
+    def spans(self, text: str, size: int, embed=None) -> list[tuple[int, int]]:
+        """Character spans of the chunks of ``text``; ``embed`` embeds a list
+        of sentences for the semantic strategy"""
+        offsets = token_offsets(text, self.model, self.exact)
+        count = len(offsets)
+        if not count:
+            return []
+        words = word_starts(text, offsets)
+        if self.strategy == "token":
+            token_spans = pack(count, size, self.chunk_overlap, words)
+        else:
+            sentences = sentence_starts(text, offsets)
+            breaks = None
+            if self.strategy == "semantic" and len(sentences):
+                starts = np.concatenate(([0], sentences[sentences > 0]))
+                ends = np.append(starts[1:], count)
+                texts = [text[offsets[s]:offsets[e] if e < count else len(text)] for s, e in zip(starts, ends)]
+                breaks = starts[semantic_breaks(texts, embed(texts), self.breakpoint_percentile)]
+            token_spans = pack(count, size, self.chunk_overlap, sentences, fallback=words, breaks=breaks)
+
+        bounds = char_cuts(text, offsets, np.asarray(token_spans, dtype=np.int64).reshape(-1))
+        return [(int(start), int(end)) for start, end in bounds.reshape(-1, 2)]
+
+    def split_node(self, node: BaseNode, embed=None) -> List[BaseNode]:
+        text = node.get_content()
+        size = self.chunk_size - self.metadata_tokens(node)
+        if size <= 0:
+            raise ValueError(
+                f"Metadata of {self.metadata_tokens(node)} tokens leaves no room in chunks of {self.chunk_size}"
+            )
+        splits = []
+        for start, end in self.spans(text, size, embed):
+            chunk = text[start:end]
+            stripped = chunk.strip()
+            if stripped:
+                start += len(chunk) - len(chunk.lstrip())
+                splits.append((stripped, start))
+
+        nodes = build_nodes_from_splits([chunk for chunk, _ in splits], node, id_func=self.id_func)
+        for chunk_node, (chunk, start) in zip(nodes, splits):
+            chunk_node.start_char_idx = start
+            chunk_node.end_char_idx = start + len(chunk)
+        return nodes
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any) -> List[BaseNode]:
+        def embed(texts: list[str]):
+            return Settings.embed_model.get_text_embedding_batch(texts)
+
+        return [chunk for node in nodes for chunk in self.split_node(node, embed)]
+
+    async def _aparse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any) -> List[BaseNode]:
+        loop = asyncio.get_running_loop()
+
+        def embed(texts: list[str]):
+            # Embedding runs on the event loop, tokenizing and scanning in a thread
+            return asyncio.run_coroutine_threadsafe(
+                Settings.embed_model.aget_text_embedding_batch(texts), loop
+            ).result()
+
+        chunks = []
+        for node in nodes:
+            chunks.extend(await asyncio.to_thread(self.split_node, node, embed))
+        return chunks
+
+def create_splitter(config: dict | None = None, exact: bool | None = None) -> ChunkingSplitter:
+    """The splitter configured in the "chunking" section of config.yml, as last reloaded"""
+    config = settings.section("chunking") if config is None else config
+    return ChunkingSplitter(**config, exact=exact)
@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+from collections import Counter, deque
+
+from whisk.kitchenai_sdk.schema import (
+    WhiskQueryBaseResponseSchema,
+    WhiskStorageResponseSchema,
+    WhiskStorageStatus,
+    TokenCountSchema
+)
+
+from .metrics import metrics, stage
+
+logger = logging.getLogger(__name__)
+
+class AdmissionError(Exception):
+    """Raised when a worker refuses or sheds a request.
+
+    ``reason`` is one of "capacity", "tenant_quota", "shed" or "shutdown".
+    """
+
+    def __init__(self, message: str, reason: str = "capacity"):
+        super().__init__(message)
+        self.reason = reason
+
+class _Flow:
+    """Requests of one tenant to one handler label; queued ones in arrival order"""
+
+    def __init__(self, tenant: str, label: str):
+        self.tenant = tenant
+        self.label = label
+        self.finish = 0.0
+        self.running = 0
+        self.queue = deque()
+
+class ConcurrencyLimiter:
+    """Bounds and schedules the handler invocations of this worker.
+
+    Up to ``max_concurrency`` requests run concurrently and up to
+    ``max_pending`` more wait for a slot. Waiting requests are grouped into
+    flows by tenant (the ``tenant_key`` metadata value) and handler label,
+    and slots go to flows by weighted fair queuing: each request advances
+    its flow's virtual clock by ``1 / weights[label]``, and the flow that is
+    furthest behind runs next. A tenant's bulk ingestion therefore queues
+    behind its own backlog instead of in front of everyone's queries.
+
+    ``label_concurrency`` caps the slots one label may hold and
+    ``tenant_concurrency`` those of one tenant; ``tenant_pending`` caps how
+    many requests one tenant may queue. When the queue is full, a queued
+    request of a lower-weight label is shed to make room, otherwise the
+    new request is refused straight away so the queue group can hand it to
+    a less busy worker.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_pending: int = 32,
+        weights: dict | None = None,
+        label_concurrency: dict | None = None,
+        tenant_concurrency: int = 0,
+        tenant_pending: int = 0,
+        tenant_key: str = "tenant",
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.weights = dict(weights or {})
+        self.label_concurrency = dict(label_concurrency or {})
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_pending = tenant_pending
+        self.tenant_key = tenant_key
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.shed = 0
+        self.closed = False
+        self._flows: dict[tuple[str, str], _Flow] = {}
+        self._virtual = 0.0
+        self._label_running = Counter()
+        self._tenant_running = Counter()
+        self._tenant_waiting = Counter()
+
+    def weight(self, label: str) -> float:
+        return float(self.weights.get(label, 1.0))
+
+    def flow_key(self, data) -> tuple[str, str]:
+        """Tenant and label a request is scheduled under"""
+        tenant = (getattr(data, "metadata", None) or {}).get(self.tenant_key)
+        return ("" if tenant is None else str(tenant)), (getattr(data, "label", None) or "")
+
+    async def acquire(self, tenant: str = "", label: str = ""):
+        if self.closed:
+            self.rejected += 1
+            raise AdmissionError("Worker is shutting down", "shutdown")
+        flow = self._flows.get((tenant, label))
+        if flow is None:
+            flow = self._flows[(tenant, label)] = _Flow(tenant, label)
+        start = max(self._virtual, flow.finish)
+        flow.finish = start + 1.0 / self.weight(label)
+        entry = (start, asyncio.get_running_loop().create_future())
+        flow.queue.append(entry)
+        self.waiting += 1
+        self._tenant_waiting[tenant] += 1
+        self._dispatch()
+
+        if not entry[1].done():
+            if self.tenant_pending and self._tenant_waiting[tenant] > self.tenant_pending:
+                self._remove(flow, entry)
+                self.rejected += 1
+                raise AdmissionError(
+                    f"Tenant {tenant!r} has {self.tenant_pending} requests queued", "tenant_quota"
+                )
+            if self.waiting > self.max_pending:
+                self._make_room(flow, entry)
+
+        try:
+            await entry[1]
+        except asyncio.CancelledError:
+            if entry[1].done() and not entry[1].cancelled() and entry[1].exception() is None:
+                # Granted a slot just as the waiter was cancelled
+                self.release(tenant, label)
+            elif entry in flow.queue:
+                self._remove(flow, entry)
+            raise
+
+    def try_acquire(self, tenant: str = "", label: str = "") -> bool:
+        """Take a free slot now, if no request is waiting for one and the
+        flow is within its label and tenant caps; never queues"""
+        if self.closed or self.waiting or self.active >= self.max_concurrency:
+            return False
+        flow = self._flows.get((tenant, label))
+        if flow is None:
+            flow = self._flows[(tenant, label)] = _Flow(tenant, label)
+        if not self._eligible(flow):
+            self._forget(flow)
+            return False
+        # Charged like a queued request, so the flow's later requests wait their turn
+        flow.finish = max(self._virtual, flow.finish) + 1.0 / self.weight(label)
+        self._grant(flow)
+        return True
+
+    def _make_room(self, flow: _Flow, entry: tuple):
+        """Shed the queued request of the lowest weight, newest first, or refuse ``entry``"""
+        victim, victim_flow = entry, flow
+        for other in self._flows.values():
+            if not other.queue:
+                continue
+            candidate = other.queue[-1]
+            if (self.weight(other.label), -candidate[0]) < (self.weight(victim_flow.label), -victim[0]):
+                victim, victim_flow = candidate, other
+        self._remove(victim_flow, victim)
+        if victim is entry:
+            self.rejected += 1
+            raise AdmissionError(
+                f"Worker at capacity ({self.active} running, {self.waiting} queued)", "capacity"
+            )
+        self.shed += 1
+        victim[1].set_exception(AdmissionError("Shed to make room for higher priority requests", "shed"))
+
+    def _unqueue(self, flow: _Flow, entry: tuple):
+        flow.queue.remove(entry)
+        self.waiting -= 1
+        self._tenant_waiting[flow.tenant] -= 1
+        if not self._tenant_waiting[flow.tenant]:
+            del self._tenant_waiting[flow.tenant]
+
+    def _remove(self, flow: _Flow, entry: tuple):
+        self._unqueue(flow, entry)
+        self._forget(flow)
+
+    def _forget(self, flow: _Flow):
+        # A flow keeps its virtual clock for as long as it has requests
+        if not flow.queue and not flow.running:
+            del self._flows[(flow.tenant, flow.label)]
+
+    def _eligible(self, flow: _Flow) -> bool:
+        limit = self.label_concurrency.get(flow.label)
+        if limit and self._label_running[flow.label] >= limit:
+            return False
+        return not (self.tenant_concurrency and self._tenant_running[flow.tenant] >= self.tenant_concurrency)
+
+    def _dispatch(self):
+        """Hand free slots to the eligible flows with the earliest virtual start"""
+        while self.active < self.max_concurrency:
+            flows = [flow for flow in self._flows.values() if flow.queue and self._eligible(flow)]
+            if not flows:
+                return
+            flow = min(flows, key=lambda flow: flow.queue[0][0])
+            entry = flow.queue[0]
+            self._unqueue(flow, entry)
+            self._virtual = max(self._virtual, entry[0])
+            self._grant(flow)
+            entry[1].set_result(None)
+
+    def _grant(self, flow: _Flow):
+        self.active += 1
+        flow.running += 1
+        self._label_running[flow.label] += 1
+        self._tenant_running[flow.tenant] += 1
+
+    def release(self, tenant: str = "", label: str = ""):
+        self.active -= 1
+        flow = self._flows[(tenant, label)]
+        flow.running -= 1
+        self._forget(flow)
+        for running, key in ((self._label_running, label), (self._tenant_running, tenant)):
+            running[key] -= 1
+            if not running[key]:
+                del running[key]
+        self._dispatch()
+
+    def resize(self, max_concurrency: int, max_pending: int):
+        """Change the limits without disturbing requests already admitted.
+
+        More slots are usable straight away; when shrinking, the slots given
+        up are taken back as running requests finish.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._dispatch()
+
+    def configure(
+        self,
+        weights: dict | None = None,
+        label_concurrency: dict | None = None,
+        tenant_concurrency: int | None = None,
+        tenant_pending: int | None = None,
+        tenant_key: str | None = None,
+    ):
+        """Change the scheduling settings given; queued requests keep their place"""
+        if weights is not None:
+            self.weights = dict(weights)
+        if label_concurrency is not None:
+            self.label_concurrency = dict(label_concurrency)
+        if tenant_concurrency is not None:
+            self.tenant_concurrency = tenant_concurrency
+        if tenant_pending is not None:
+            self.tenant_pending = tenant_pending
+        if tenant_key:
+            self.tenant_key = tenant_key
+        self._dispatch()
+
+    def limit(self, handler, on_reject, label: str | None = None):
+        """Wrap ``handler`` so it runs within the limit.
+
+        ``on_reject(data, error)`` builds the response returned when the
+        request is refused or shed. ``label`` schedules the requests under
+        another label than their own, e.g. deletes apart from ingestion.
+        """
+        @functools.wraps(handler)
+        async def wrapper(data, *args, **kwargs):
+            tenant, request_label = self.flow_key(data)
+            flow_label = label or request_label
+            try:
+                with stage("queue"):
+                    await self.acquire(tenant, flow_label)
+            except AdmissionError as e:
+                logger.warning(str(e))
+                metrics.inc(
+                    "whisk_admission_refused_total", help="Requests refused or shed",
+                    label=flow_label, reason=e.reason
+                )
+                return on_reject(data, e)
+            try:
+                return await handler(data, *args, **kwargs)
+            finally:
+                self.release(tenant, flow_label)
+        return wrapper
+
+    def close(self):
+        """Refuse new requests; queued and running ones still complete"""
+        self.closed = True
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no request is running or queued, returns False on timeout"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.active or self.waiting:
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_pending": self.max_pending,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "tenants": len(set(self._tenant_running) | set(self._tenant_waiting)),
+            "closed": self.closed
+        }
+
+def label_values(value, cast=float) -> dict:
+    """Per-label settings from a mapping or a "query=4,storage=1" string"""
+    if isinstance(value, dict):
+        return {str(label): cast(setting) for label, setting in value.items()}
+    pairs = [item.split("=", 1) for item in str(value or "").split(",") if item.strip()]
+    return {label.strip(): cast(setting) for label, setting in pairs}
+
+def reject_query(data, error: Exception) -> WhiskQueryBaseResponseSchema:
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output=f"Error: {str(error)}",
+        metadata={**(data.metadata or {}), "rejected": getattr(error, "reason", "capacity")},
+        token_counts=TokenCountSchema(),
+        messages=data.messages
+    )
+
+def reject_delete(data, error: Exception):
+    # Deletes have no response to carry the error, so the client reports it
+    raise error
+
+def reject_storage(data, error: Exception) -> WhiskStorageResponseSchema:
+    return WhiskStorageResponseSchema(
+        id=data.id,
+        status=WhiskStorageStatus.ERROR,
+        error=str(error),
+        metadata={**(data.metadata or {}), "rejected": getattr(error, "reason", "capacity")}
+    )
+
+limiter = ConcurrencyLimiter(
+    max_concurrency=int(os.getenv("WHISK_MAX_CONCURRENCY", "8")),
+    max_pending=int(os.getenv("WHISK_MAX_PENDING", "32")),
+    weights=label_values(os.getenv("WHISK_LABEL_WEIGHTS", ""), float),
+    label_concurrency=label_values(os.getenv("WHISK_LABEL_MAX_CONCURRENCY", ""), int),
+    tenant_concurrency=int(os.getenv("WHISK_TENANT_MAX_CONCURRENCY", "0")),
+    tenant_pending=int(os.getenv("WHISK_TENANT_MAX_PENDING", "0")),
+    tenant_key=os.getenv("WHISK_TENANT_KEY", "tenant")
+)
+metrics.register_gauges("whisk_admission", limiter.stats)
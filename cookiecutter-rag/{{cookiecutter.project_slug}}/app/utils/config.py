@@ -0,0 +1,121 @@
+import asyncio
+import copy
+import logging
+import os
+
+import yaml
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Settings file read at startup, relative to the working directory
+CONFIG_PATH = os.getenv("WHISK_CONFIG", "config.yml")
+
+def load_config(path: str | None = None) -> dict:
+    """Settings from ``path``, or none when the file does not exist"""
+    path = path or CONFIG_PATH
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must hold a mapping of sections, not {type(config).__name__}")
+    for name, section in config.items():
+        if section is not None and not isinstance(section, dict):
+            raise ValueError(f"Section {name!r} of {path} must be a mapping")
+    return {name: section or {} for name, section in config.items()}
+
+class ReloadableConfig:
+    """The settings file, re-read when it changes.
+
+    ``reload`` parses the whole file before anything is applied, so a file
+    that does not parse leaves every section as it was. Each changed section
+    is then handed to the callbacks registered with ``on_change``; when one
+    raises, that section keeps its old value while the others still apply.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or CONFIG_PATH
+        self._sections = load_config(self.path)
+        self._mtime = self._modified()
+        self._subscribers: dict[str, list] = {}
+        self.reloads = 0
+        self.failures = 0
+        self._task = None
+
+    def _modified(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def section(self, name: str) -> dict:
+        return copy.deepcopy(self._sections.get(name) or {})
+
+    def on_change(self, name: str, callback=None):
+        """Call ``callback(new, old)`` when section ``name`` changes; usable as a decorator"""
+        if callback is None:
+            return lambda func: self.on_change(name, func)
+        self._subscribers.setdefault(name, []).append(callback)
+        return callback
+
+    def reload(self) -> list[str]:
+        """Re-read the file and apply the sections that changed, returns their names"""
+        self._mtime = self._modified()
+        try:
+            sections = load_config(self.path)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Keeping the current settings, {self.path} is invalid: {str(e)}")
+            return []
+        applied = []
+        for name in sorted(set(sections) | set(self._sections)):
+            old, new = self._sections.get(name) or {}, sections.get(name) or {}
+            if new == old:
+                continue
+            self._sections[name] = new
+            try:
+                for callback in self._subscribers.get(name, []):
+                    callback(copy.deepcopy(new), copy.deepcopy(old))
+            except Exception as e:
+                self._sections[name] = old
+                self.failures += 1
+                logger.error(f"Keeping the current {name!r} settings, applying the change failed: {str(e)}")
+                continue
+            applied.append(name)
+        if applied:
+            self.reloads += 1
+            logger.info(f"Reloaded {', '.join(applied)} from {self.path}")
+        return applied
+
+    async def watch(self, interval: float = 5.0):
+        """Reload whenever the file's modification time changes"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._modified() != self._mtime:
+                self.reload()
+
+    def start(self, interval: float = 5.0):
+        """Watch the file in the background of the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.watch(interval))
+
+    def stats(self) -> dict:
+        return {"reloads": self.reloads, "failures": self.failures}
+
+def setting(section: dict, key: str, env: str, default, cast=str):
+    """``env`` when set, else ``key`` of a config section, else ``default``"""
+    value = os.getenv(env)
+    if value is None or value == "":
+        value = section.get(key)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+def switch(value) -> bool:
+    """On/off setting; YAML reads a bare ``on`` as true"""
+    return str(value).lower() not in ("off", "false", "no", "0")
+
+config = ReloadableConfig()
+metrics.register_gauges("whisk_config", config.stats)
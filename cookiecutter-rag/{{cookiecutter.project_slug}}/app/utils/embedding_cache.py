@@ -0,0 +1,307 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+
+def model_key(model: BaseEmbedding) -> str:
+    """Identifies the vectors a model produces; models with different
+    dimensions or classes never share cached vectors"""
+    return f"{model.class_name()}:{model.model_name}:{getattr(model, 'dimensions', None) or ''}"
+
+def text_digest(kind: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{kind}\0{text}".encode(), digest_size=DIGEST_SIZE).digest()
+
+class _ModelCache:
+    """Vectors of one model: an append-only float32 file read through a
+    memory map, an index file of text digests in the same row order, and
+    the vector dimension, written before the first vector"""
+
+    def __init__(self, root: Path, key: str):
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", key)[:48]
+        name = f"{slug}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"
+        self.index_path = root / f"{name}.idx"
+        self.data_path = root / f"{name}.f32"
+        self.dim_path = root / f"{name}.dim"
+        self.rows = {}
+        self.dim = None
+        self._map = None
+        self._index_size = 0
+        root.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, "ab") as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            self._repair()
+            self._sync()
+
+    def _read_dim(self) -> int | None:
+        try:
+            return int(self.dim_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _repair(self):
+        # A writer that died mid-append leaves a partial record or vectors
+        # without an index entry; cut both back to the last whole entry.
+        # Without a recorded dimension no row can be addressed, so start over
+        dim = self._read_dim()
+        count = self.index_path.stat().st_size // DIGEST_SIZE
+        data_size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        count = min(count, data_size // 4 // dim) if dim else 0
+        os.truncate(self.index_path, count * DIGEST_SIZE)
+        if data_size:
+            os.truncate(self.data_path, count * (dim or 0) * 4)
+        self.dim = dim
+
+    def _sync(self):
+        """Pick up entries appended by this or other processes"""
+        size = self.index_path.stat().st_size
+        if size == self._index_size:
+            return
+        with open(self.index_path, "rb") as index:
+            index.seek(self._index_size)
+            tail = index.read(size - self._index_size)
+        first = self._index_size // DIGEST_SIZE
+        for i in range(len(tail) // DIGEST_SIZE):
+            self.rows.setdefault(tail[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE], first + i)
+        self._index_size = size
+        if self.rows and self.dim is None:
+            self.dim = self._read_dim()
+        self._map = None
+
+    def _vectors(self) -> np.ndarray:
+        if self._map is None:
+            count = self._index_size // DIGEST_SIZE
+            self._map = np.memmap(self.data_path, dtype="<f4", mode="r", shape=(count, self.dim))
+        return self._map
+
+    def get(self, digests: List[bytes]) -> List[Optional[List[float]]]:
+        if any(digest not in self.rows for digest in digests):
+            self._sync()
+        if not self.rows:
+            return [None] * len(digests)
+        vectors = self._vectors()
+        return [
+            vectors[self.rows[digest]].tolist() if digest in self.rows else None
+            for digest in digests
+        ]
+
+    def put(self, digests: List[bytes], vectors: List[List[float]]) -> int:
+        array = np.asarray(vectors, dtype="<f4")
+        with open(self.index_path, "ab") as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            self._sync()
+            if self.dim is None:
+                self.dim = array.shape[1]
+            keep = [i for i, digest in enumerate(digests) if digest not in self.rows]
+            if not keep or array.shape[1] != self.dim:
+                return 0
+            if not self.dim_path.exists():
+                temporary = self.dim_path.with_suffix(".dim.tmp")
+                temporary.write_text(str(self.dim))
+                os.replace(temporary, self.dim_path)
+            # Vectors first, then the index entries that make them visible
+            with open(self.data_path, "ab") as data:
+                data.write(array[keep].tobytes())
+            index.write(b"".join(digests[i] for i in keep))
+            index.flush()
+            self._sync()
+        return len(keep)
+
+    def nbytes(self) -> int:
+        return self._index_size // DIGEST_SIZE * (self.dim or 0) * 4 + self._index_size
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by model and text hash.
+
+    Vectors are stored as raw float32 rows per model and read through a
+    memory map, so a large cache costs page cache rather than heap. Several
+    worker processes can share one directory: appends are serialized with a
+    file lock and each process picks up the others' entries on a miss.
+    Nothing is added once the cache holds ``max_bytes``.
+    """
+
+    def __init__(self, root: str | None = None, max_bytes: int = 1 << 30):
+        self.root = Path(root) if root else None
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._full = False
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def configure(self, root: str, max_bytes: int | None = None):
+        with self._lock:
+            self.root = Path(root)
+            self.max_bytes = max_bytes or self.max_bytes
+            self._models = {}
+
+    def _model(self, key: str) -> _ModelCache | None:
+        if self.root is None:
+            return None
+        cache = self._models.get(key)
+        if cache is None:
+            cache = self._models[key] = _ModelCache(self.root, key)
+        return cache
+
+    def get(self, key: str, kind: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors of ``texts``, None for misses"""
+        with self._lock:
+            cache = self._model(key)
+            vectors = cache.get([text_digest(kind, text) for text in texts]) if cache else [None] * len(texts)
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return vectors
+
+    def put(self, key: str, kind: str, texts: List[str], vectors: List[List[float]]):
+        if not texts:
+            return
+        with self._lock:
+            cache = self._model(key)
+            if cache is None:
+                return
+            if self.nbytes() >= self.max_bytes:
+                if not self._full:
+                    self._full = True
+                    logger.warning(f"Embedding cache is full at {self.max_bytes >> 20} MB, new vectors are not cached")
+                return
+            self.stored += cache.put([text_digest(kind, text) for text in texts], vectors)
+
+    def nbytes(self) -> int:
+        return sum(cache.nbytes() for cache in self._models.values())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": sum(len(cache.rows) for cache in self._models.values()),
+            "bytes": self.nbytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored
+        }
+
+embedding_cache = EmbeddingCache(max_bytes=int(os.getenv("WHISK_EMBEDDING_CACHE_MB", "1024")) << 20)
+metrics.register_gauges("whisk_embedding_cache", embedding_cache.stats)
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model that answers from ``embedding_cache`` and only sends
+    misses to the wrapped model.
+
+    Only the wrapped model's calls emit embedding events, so token counts
+    cover the texts actually embedded, not the cache hits.
+    """
+
+    _model: BaseEmbedding = PrivateAttr()
+    _key: str = PrivateAttr()
+    _cache: Any = PrivateAttr()
+
+    def __init__(self, model: BaseEmbedding, cache: EmbeddingCache | None = None, **kwargs: Any):
+        super().__init__(
+            model_name=model.model_name,
+            embed_batch_size=model.embed_batch_size,
+            callback_manager=model.callback_manager,
+            **kwargs
+        )
+        self._model = model
+        self._key = model_key(model)
+        self._cache = cache or embedding_cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def model(self) -> BaseEmbedding:
+        return self._model
+
+    def _wrapped(self) -> BaseEmbedding:
+        # Events of the real calls go to whoever listens to this model
+        self._model.callback_manager = self.callback_manager
+        return self._model
+
+    def _lookup(self, kind: str, texts: List[str]):
+        vectors = self._cache.get(self._key, kind, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        return vectors, missing
+
+    def _merge(self, kind: str, texts: List[str], vectors: list, missing: List[str], embedded: list) -> list:
+        self._cache.put(self._key, kind, missing, embedded)
+        fresh = dict(zip(missing, embedded))
+        return [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        vectors, missing = self._lookup("query", [query])
+        embedded = [self._wrapped().get_query_embedding(query)] if missing else []
+        return self._merge("query", [query], vectors, missing, embedded)[0]
+
+    async def aget_query_embedding(self, query: str) -> List[float]:
+        vectors, missing = self._lookup("query", [query])
+        embedded = [await self._wrapped().aget_query_embedding(query)] if missing else []
+        return self._merge("query", [query], vectors, missing, embedded)[0]
+
+    def get_text_embedding(self, text: str) -> List[float]:
+        return self.get_text_embedding_batch([text])[0]
+
+    async def aget_text_embedding(self, text: str) -> List[float]:
+        return (await self.aget_text_embedding_batch([text]))[0]
+
+    def get_text_embedding_batch(self, texts: List[str], show_progress: bool = False, **kwargs: Any) -> List[List[float]]:
+        vectors, missing = self._lookup("text", texts)
+        embedded = self._wrapped().get_text_embedding_batch(missing, show_progress, **kwargs) if missing else []
+        return self._merge("text", texts, vectors, missing, embedded)
+
+    async def aget_text_embedding_batch(self, texts: List[str], show_progress: bool = False, **kwargs: Any) -> List[List[float]]:
+        vectors, missing = self._lookup("text", texts)
+        embedded = await self._wrapped().aget_text_embedding_batch(missing, show_progress, **kwargs) if missing else []
+        return self._merge("text", texts, vectors, missing, embedded)
+
+    async def aget_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup("query", queries)
+        embedded = await aembed_queries(self._wrapped(), missing) if missing else []
+        return self._merge("query", queries, vectors, missing, embedded)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self.aget_text_embedding(text)
+
+async def aembed_queries(model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    """Query embeddings of ``queries`` in as few calls as the model allows.
+
+    OpenAI models embed queries with the same engine as texts, so queries
+    go through the batched text endpoint; other models get concurrent
+    single-query calls, ``embed_batch_size`` at a time.
+    """
+    if isinstance(model, CachedEmbedding):
+        return await model.aget_query_embedding_batch(queries)
+    query_engine = getattr(model, "_query_engine", None)
+    if query_engine is not None and query_engine == getattr(model, "_text_engine", None):
+        return await model.aget_text_embedding_batch(queries)
+    vectors = []
+    for start in range(0, len(queries), model.embed_batch_size):
+        batch = queries[start:start + model.embed_batch_size]
+        vectors += await asyncio.gather(*(model.aget_query_embedding(query) for query in batch))
+    return vectors
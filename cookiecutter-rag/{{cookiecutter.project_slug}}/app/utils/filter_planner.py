@@ -0,0 +1,162 @@
+import numpy as np
+from llama_index.core import Settings, QueryBundle
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from .tombstones import hidden_clauses
+
+# Filters matching at most this many chunks are answered by an exact scan
+EXACT_SCAN_LIMIT = 2000
+
+class FilterPlan:
+    """Chosen retrieval strategy for a set of metadata filters"""
+
+    def __init__(self, strategy: str, match_count: int, total_count: int, node_ids: list[str] | None = None):
+        self.strategy = strategy
+        self.match_count = match_count
+        self.total_count = total_count
+        self.node_ids = node_ids or []
+
+    @property
+    def selectivity(self) -> float:
+        return self.match_count / self.total_count if self.total_count else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "strategy": self.strategy,
+            "match_count": self.match_count,
+            "total_count": self.total_count,
+            "selectivity": round(self.selectivity, 6)
+        }
+
+def metadata_to_where(metadata: dict, hidden=()) -> dict | None:
+    """Build a Chroma ``where`` clause of equality filters that also
+    excludes the chunks of the ``hidden`` (deleted) file ids"""
+    clauses = [{key: {"$eq": value}} for key, value in metadata.items()] + hidden_clauses(hidden)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def plan_filters(vector_store, metadata: dict, exact_scan_limit: int = EXACT_SCAN_LIMIT, hidden=()) -> FilterPlan:
+    """Estimate filter selectivity and pick exact scan or filtered ANN.
+
+    Selectivity comes from Chroma's local SQLite metadata index, which is
+    probed with a bounded id-only lookup so that the cost of planning never
+    exceeds ``exact_scan_limit`` rows. Chunks of ``hidden`` file ids are
+    never matched.
+    """
+    collection = vector_store.client
+    total_count = collection.count()
+    matches = collection.get(
+        where=metadata_to_where(metadata, hidden),
+        include=[],
+        limit=exact_scan_limit + 1
+    )["ids"]
+    if len(matches) <= exact_scan_limit:
+        return FilterPlan("exact", len(matches), total_count, node_ids=matches)
+    # Too many matches to count cheaply, report the lower bound
+    return FilterPlan("ann", len(matches), total_count)
+
+def _distances(space: str, embeddings: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # Mirror the distance functions of the collection's HNSW index. A matrix
+    # of queries gets one row of distances per query
+    products = query @ embeddings.T
+    if space == "cosine":
+        norms = np.linalg.norm(query, axis=-1)[..., None] * np.linalg.norm(embeddings, axis=1)
+        return 1.0 - products / np.where(norms == 0, 1.0, norms)
+    if space == "ip":
+        return 1.0 - products
+    squared = np.einsum("ij,ij->i", embeddings, embeddings) + np.einsum("...j,...j->...", query, query)[..., None]
+    return np.maximum(squared - 2 * products, 0.0)
+
+def _node(metadata: dict, text: str, distance: float) -> NodeWithScore:
+    return NodeWithScore(node=metadata_dict_to_node(metadata, text=text), score=float(np.exp(-distance)))
+
+class ExactScanRetriever(BaseRetriever):
+    """Brute-force similarity search over a pre-filtered set of node ids.
+
+    Scores use the same ``exp(-distance)`` mapping as ``ChromaVectorStore``
+    so results are interchangeable with the ANN path.
+    """
+
+    def __init__(self, vector_store, node_ids: list[str], similarity_top_k: int = DEFAULT_SIMILARITY_TOP_K, embed_model=None, **kwargs):
+        self._collection = vector_store.client
+        self._node_ids = node_ids
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = embed_model
+        super().__init__(**kwargs)
+
+    def _scan(self, query_embedding: list[float]) -> list[NodeWithScore]:
+        if not self._node_ids:
+            return []
+        result = self._collection.get(
+            ids=self._node_ids,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        embeddings = np.asarray(result["embeddings"], dtype=np.float32)
+        space = (self._collection.metadata or {}).get("hnsw:space", "l2")
+        distances = _distances(space, embeddings, np.asarray(query_embedding, dtype=np.float32))
+
+        k = min(self._similarity_top_k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [_node(result["metadatas"][i], result["documents"][i], distances[i]) for i in top]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if query_bundle.embedding is None:
+            embed_model = self._embed_model or Settings.embed_model
+            query_bundle.embedding = embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return self._scan(query_bundle.embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if query_bundle.embedding is None:
+            embed_model = self._embed_model or Settings.embed_model
+            query_bundle.embedding = await embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return self._scan(query_bundle.embedding)
+
+def batch_search(vector_store, query_embeddings: np.ndarray, similarity_top_k: int,
+                 metadata: dict | None = None, plan: FilterPlan | None = None,
+                 hidden=()) -> list[list[NodeWithScore]]:
+    """Top ``similarity_top_k`` chunks of every query in one vectorized search.
+
+    Exact plans score the matching chunks against all queries with one
+    matrix product; otherwise all queries go to Chroma in one filtered ANN
+    call that skips the chunks of ``hidden`` file ids. Scores match the
+    single-query retrievers.
+    """
+    collection = vector_store.client
+    if plan and plan.strategy == "exact":
+        if not plan.node_ids:
+            return [[] for _ in query_embeddings]
+        result = collection.get(ids=plan.node_ids, include=["embeddings", "documents", "metadatas"])
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        distances = _distances(space, np.asarray(result["embeddings"], dtype=np.float32), query_embeddings)
+        k = min(similarity_top_k, distances.shape[1])
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        rows = np.take_along_axis(distances, top, axis=1).argsort(axis=1)
+        return [
+            [_node(result["metadatas"][i], result["documents"][i], row[i]) for i in top[q][rows[q]]]
+            for q, row in enumerate(distances)
+        ]
+
+    k = min(similarity_top_k, collection.count())
+    if k == 0:
+        return [[] for _ in query_embeddings]
+    where = metadata_to_where(metadata or {}, hidden)
+    kwargs = {"where": where} if where else {}
+    result = collection.query(
+        query_embeddings=query_embeddings.tolist(),
+        n_results=k,
+        include=["documents", "metadatas", "distances"],
+        **kwargs
+    )
+    return [
+        [_node(metadata, text, distance) for text, metadata, distance in zip(texts, metadatas, distances)]
+        for texts, metadatas, distances in zip(result["documents"], result["metadatas"], result["distances"])
+    ]
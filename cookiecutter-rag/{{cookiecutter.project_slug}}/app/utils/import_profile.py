@@ -0,0 +1,74 @@
+"""Import-time profile of the app entry point.
+
+Runs ``python -X importtime`` in a fresh interpreter and reports the
+slowest imports, so startup regressions show up in CI:
+
+    python -m app.utils.import_profile --top 15 --json import_profile.json
+    python -m app.utils.import_profile --max-ms 1500
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile_imports(module: str = "app.main", env: dict | None = None) -> dict:
+    """Import ``module`` in a subprocess and collect per-module import times"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "depth": (len(indent) - 1) // 2,
+            })
+    # Top-level imports add up to the total import time
+    total_ms = sum(entry["cumulative_ms"] for entry in imports if entry["depth"] == 0)
+    return {"module": module, "total_ms": round(total_ms, 1), "imports": imports}
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest imports to print")
+    parser.add_argument("--json", dest="json_path", help="Write the full report to this file")
+    parser.add_argument("--max-ms", type=float, help="Exit non-zero if total import time exceeds this")
+    parser.add_argument("--eager", action="store_true", help="Profile with WHISK_LAZY_START=false")
+    args = parser.parse_args(argv)
+
+    env = {"WHISK_LAZY_START": "false"} if args.eager else None
+    report = profile_imports(args.module, env=env)
+
+    print(f"Import time for {report['module']}: {report['total_ms']:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    slowest = sorted(report["imports"], key=lambda entry: entry["cumulative_ms"], reverse=True)
+    for entry in slowest[:args.top]:
+        print(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>9.1f}  {entry['module']}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_ms is not None and report["total_ms"] > args.max_ms:
+        print(f"Import time {report['total_ms']:.1f} ms exceeds budget of {args.max_ms:.1f} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
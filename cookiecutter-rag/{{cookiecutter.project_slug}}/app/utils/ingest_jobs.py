@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ingestion stages of a batch, in order; a checkpoint records the last one done
+STAGES = ("parse", "split", "extract", "embed", "upsert")
+
+class IngestJob:
+    """Progress of one file's ingestion into one collection"""
+
+    def __init__(self, collection: str, file_id: str, fingerprint: str, row: tuple | None = None):
+        self.collection = collection
+        self.file_id = file_id
+        self.fingerprint = fingerprint
+        # Documents parsed, whether parsing finished, batches stored, nodes stored
+        self.documents, self.parsed_all, self.batches_stored, self.nodes_stored = row or (0, False, 0, 0)
+        self.parsed_all = bool(self.parsed_all)
+        self.resumed = row is not None
+
+    def progress(self) -> dict:
+        return {
+            "documents_parsed": self.documents,
+            "batches_stored": self.batches_stored,
+            "nodes_stored": self.nodes_stored,
+            "resumed": self.resumed
+        }
+
+class IngestJobs:
+    """Durable ingestion jobs with a checkpoint per batch and stage.
+
+    Each batch of documents is saved after every stage, so a retry of a
+    failed ingestion resumes at the stage that failed instead of parsing,
+    extracting and embedding the whole file again. A retry is recognised by
+    the same file id and collection and an identical file fingerprint.
+    Checkpoints of unfinished jobs are removed after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: float = 86400.0):
+        self.ttl = ttl
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._init_db()
+        self._lock = threading.Lock()
+        self._resumed = 0
+        self._stages_skipped = 0
+        self._failed = 0
+        self._completed = 0
+
+    def configure(self, chroma_path: str, ttl: float | None = None):
+        """Persist jobs next to the Chroma data so they survive restarts"""
+        self.ttl = ttl or self.ttl
+        with self._lock:
+            self._db.close()
+            self._db = sqlite3.connect(
+                os.path.join(chroma_path, "ingest_jobs.sqlite3"), check_same_thread=False
+            )
+            self._init_db()
+
+    def _init_db(self):
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "collection TEXT NOT NULL, file_id TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "status TEXT NOT NULL, documents INTEGER NOT NULL DEFAULT 0, "
+            "parsed_all INTEGER NOT NULL DEFAULT 0, batches_stored INTEGER NOT NULL DEFAULT 0, "
+            "nodes_stored INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (collection, file_id))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "collection TEXT NOT NULL, file_id TEXT NOT NULL, batch INTEGER NOT NULL, "
+            "stage TEXT NOT NULL, nodes TEXT, "
+            "PRIMARY KEY (collection, file_id, batch))"
+        )
+        self._db.commit()
+
+    def _delete(self, collection: str, file_id: str):
+        self._db.execute("DELETE FROM checkpoints WHERE collection = ? AND file_id = ?", (collection, file_id))
+        self._db.execute("DELETE FROM jobs WHERE collection = ? AND file_id = ?", (collection, file_id))
+
+    def expire(self):
+        """Drop unfinished jobs that have not been retried for ``ttl`` seconds"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            stale = self._db.execute(
+                "SELECT collection, file_id FROM jobs WHERE status != 'complete' AND updated_at < ?",
+                (cutoff,)
+            ).fetchall()
+            for collection, file_id in stale:
+                self._delete(collection, file_id)
+            self._db.commit()
+
+    def begin(self, collection: str, file_id: str, fingerprint: str, restart: bool = False) -> IngestJob:
+        """Resume the unfinished job for this file, or start a new one"""
+        self.expire()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fingerprint, status, documents, parsed_all, batches_stored, nodes_stored "
+                "FROM jobs WHERE collection = ? AND file_id = ?",
+                (collection, file_id)
+            ).fetchone()
+            if row and row[0] == fingerprint and row[1] != "complete" and not restart:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', error = NULL, updated_at = ? "
+                    "WHERE collection = ? AND file_id = ?",
+                    (time.time(), collection, file_id)
+                )
+                self._db.commit()
+                self._resumed += 1
+                job = IngestJob(collection, file_id, fingerprint, row[2:])
+                logger.info(f"Resuming ingestion of {file_id}: {job.progress()}")
+                return job
+
+            self._delete(collection, file_id)
+            self._db.execute(
+                "INSERT INTO jobs (collection, file_id, fingerprint, status, updated_at) "
+                "VALUES (?, ?, ?, 'running', ?)",
+                (collection, file_id, fingerprint, time.time())
+            )
+            self._db.commit()
+        return IngestJob(collection, file_id, fingerprint)
+
+    def load(self, job: IngestJob, batch: int):
+        """``(stage, nodes)`` of the batch's checkpoint, or None if it has none"""
+        from llama_index.core.storage.docstore.utils import json_to_doc
+        with self._lock:
+            row = self._db.execute(
+                "SELECT stage, nodes FROM checkpoints WHERE collection = ? AND file_id = ? AND batch = ?",
+                (job.collection, job.file_id, batch)
+            ).fetchone()
+        if row is None:
+            return None
+        self._stages_skipped += STAGES.index(row[0]) + 1
+        return row[0], [json_to_doc(node) for node in json.loads(row[1] or "[]")]
+
+    def save(self, job: IngestJob, batch: int, stage: str, nodes: list):
+        """Checkpoint the batch after ``stage``; stored batches keep no nodes"""
+        from llama_index.core.storage.docstore.utils import doc_to_json
+        payload = None if stage == "upsert" else json.dumps([doc_to_json(node) for node in nodes])
+        if stage == "parse":
+            job.documents += len(nodes)
+        elif stage == "upsert":
+            job.batches_stored += 1
+            job.nodes_stored += len(nodes)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                (job.collection, job.file_id, batch, stage, payload)
+            )
+            self._db.execute(
+                "UPDATE jobs SET documents = ?, batches_stored = ?, nodes_stored = ?, updated_at = ? "
+                "WHERE collection = ? AND file_id = ?",
+                (job.documents, job.batches_stored, job.nodes_stored, time.time(), job.collection, job.file_id)
+            )
+            self._db.commit()
+
+    def parsed(self, job: IngestJob):
+        """Record that every document of the file has been checkpointed"""
+        job.parsed_all = True
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET parsed_all = 1 WHERE collection = ? AND file_id = ?",
+                (job.collection, job.file_id)
+            )
+            self._db.commit()
+
+    def complete(self, job: IngestJob):
+        """Mark the job done and drop its checkpoints"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM checkpoints WHERE collection = ? AND file_id = ?",
+                (job.collection, job.file_id)
+            )
+            self._db.execute(
+                "UPDATE jobs SET status = 'complete', updated_at = ? WHERE collection = ? AND file_id = ?",
+                (time.time(), job.collection, job.file_id)
+            )
+            self._db.commit()
+        self._completed += 1
+
+    def fail(self, job: IngestJob, error: str):
+        """Keep the checkpoints so a retry of the same file resumes"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE collection = ? AND file_id = ?",
+                (error, time.time(), job.collection, job.file_id)
+            )
+            self._db.commit()
+        self._failed += 1
+
+    def status(self, collection: str, file_id: str) -> dict | None:
+        """Status and progress of the file's latest job"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, documents, parsed_all, batches_stored, nodes_stored, error "
+                "FROM jobs WHERE collection = ? AND file_id = ?",
+                (collection, file_id)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("status", "documents_parsed", "parsed_all", "batches_stored", "nodes_stored", "error")
+        return dict(zip(keys, row))
+
+    def stats(self) -> dict:
+        with self._lock:
+            unfinished = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status != 'complete'").fetchone()[0]
+            checkpoints = self._db.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        return {
+            "unfinished_jobs": unfinished,
+            "checkpoints": checkpoints,
+            "completed": self._completed,
+            "failed": self._failed,
+            "resumed": self._resumed,
+            "stages_skipped": self._stages_skipped
+        }
+
+ingest_jobs = IngestJobs(ttl=float(os.getenv("WHISK_INGEST_JOB_TTL", "86400")))
+metrics.register_gauges("whisk_ingest_jobs", ingest_jobs.stats)
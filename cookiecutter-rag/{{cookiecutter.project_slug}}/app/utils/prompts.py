@@ -0,0 +1,79 @@
+import threading
+
+from . import token_counter
+
+_prompts = {}
+_lock = threading.Lock()
+
+class StaticPrompt(str):
+    """Prompt text that stays the same for the life of the process.
+
+    The message dict, the llama-index ``ChatMessage`` and the token count
+    are built once and shared by every request that sends the prompt, and
+    every request sends byte-identical text, so the provider's prompt cache
+    can serve it as a prefix.
+    """
+
+    def __new__(cls, text: str, role: str = "system", model: str = token_counter.DEFAULT_MODEL):
+        prompt = super().__new__(cls, text)
+        prompt.role = role
+        prompt.model = model
+        prompt.message = {"role": role, "content": str(text)}
+        prompt._chat_message = None
+        prompt._token_count = None
+        return prompt
+
+    @property
+    def chat_message(self):
+        if self._chat_message is None:
+            from llama_index.core.llms import ChatMessage
+            self._chat_message = ChatMessage(role=self.role, content=self.message["content"])
+        return self._chat_message
+
+    @property
+    def token_count(self) -> int:
+        if self._token_count is None:
+            self._token_count = token_counter.count_tokens(self.message["content"], self.model, exact=True)
+        return self._token_count
+
+    def compile(self) -> "StaticPrompt":
+        """Build the message and count the tokens now rather than on first use"""
+        self.chat_message
+        self.token_count
+        return self
+
+def static_prompt(text: str, role: str = "system") -> StaticPrompt:
+    """The registered ``StaticPrompt`` for ``text``, created on first call"""
+    with _lock:
+        prompt = _prompts.get(text)
+        if prompt is None:
+            prompt = _prompts[text] = StaticPrompt(text, role)
+        return prompt
+
+def compile_prompt(text: str, role: str = "system") -> StaticPrompt:
+    """Register ``text`` and pretokenize it, for use as a dependency factory"""
+    return static_prompt(text, role).compile()
+
+def find_prompt(text) -> StaticPrompt | None:
+    """The registered prompt with this exact text, if any"""
+    return text if isinstance(text, StaticPrompt) else _prompts.get(text)
+
+def static_token_count(text) -> int | None:
+    """Precomputed token count of ``text`` when it is a registered prompt"""
+    prompt = find_prompt(text)
+    return prompt.token_count if prompt is not None else None
+
+def qa_templates(system_prompt) -> dict:
+    """Question-answering templates led by ``system_prompt``, as keyword
+    arguments of a response synthesizer or ``RetrieverQueryEngine.from_args``"""
+    if not system_prompt:
+        return {}
+    from llama_index.core.llms import ChatMessage
+    from llama_index.core.prompts import ChatPromptTemplate
+    from llama_index.core.prompts.chat_prompts import CHAT_REFINE_PROMPT, CHAT_TEXT_QA_PROMPT
+
+    system = ChatMessage(role=getattr(system_prompt, "role", "system"), content=str(system_prompt))
+    return {
+        "text_qa_template": ChatPromptTemplate([system, *CHAT_TEXT_QA_PROMPT.message_templates[1:]]),
+        "refine_template": ChatPromptTemplate([system, *CHAT_REFINE_PROMPT.message_templates]),
+    }
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable
+
+from .metrics import metrics
+
+def flight_key(label: str, query: str, metadata: dict | None) -> str:
+    """Key of a query request: the handler label, the whitespace-normalized
+    query and the filter metadata, which also selects the tenant shard"""
+    payload = json.dumps(
+        {"label": label, "query": " ".join(query.split()), "metadata": metadata or {}},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class Flight:
+    """One execution and the requests sharing it"""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        # Requests still waiting, and all requests that joined
+        self.waiters = 1
+        self.shared_by = 1
+
+class SingleFlight:
+    """Coalesces identical concurrent requests into one execution.
+
+    The first request for a key runs the work; requests with the same key
+    arriving while it runs wait for and share its result, or its error.
+    Nothing is kept once the execution finishes, so this is not a cache:
+    a later identical request runs again. The execution is cancelled only
+    when every request waiting for it has been cancelled.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, work: Callable[[], Awaitable[Any]]) -> tuple[Any, bool, int]:
+        """Result of ``work`` for ``key``, whether this request ran it and
+        how many requests shared it"""
+        flight = self._flights.get(key)
+        # A flight that finished or whose requests all gave up is not joined
+        leader = flight is None or flight.task.done() or flight.waiters == 0
+        if leader:
+            flight = Flight(asyncio.ensure_future(work()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.executions += 1
+        else:
+            flight.waiters += 1
+            flight.shared_by += 1
+            self.coalesced += 1
+
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0:
+                flight.task.cancel()
+            raise
+        flight.waiters -= 1
+        return result, leader, flight.shared_by
+
+    def _forget(self, key: str, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced
+        }
+
+# "off" runs every query request on its own
+SINGLE_FLIGHT = os.getenv("WHISK_SINGLE_FLIGHT", "on").lower() != "off"
+
+query_flights = SingleFlight()
+metrics.register_gauges("whisk_single_flight", query_flights.stats)
@@ -1,8 +1,135 @@
-import tiktoken
-from llama_index.core.callbacks import TokenCountingHandler
-
-def create_token_counter():
-    """Create token counter for tracking usage"""
-    return TokenCountingHandler(
-        tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-    ) 
\ No newline at end of file
+from __future__ import annotations
+
+import collections
+import functools
+import os
+import threading
+
+from .metrics import metrics
+
+# The one place the model is named; the LLM and every token count use it
+DEFAULT_MODEL = os.getenv("WHISK_LLM_MODEL", "gpt-3.5-turbo")
+
+# "exact" runs tiktoken; "approximate" estimates counts from byte classes,
+# which is much cheaper on long documents and histories. Counts reported to
+# callers always stay exact.
+TOKEN_COUNTING = os.getenv("WHISK_TOKEN_COUNTING", "exact").lower()
+if TOKEN_COUNTING not in ("exact", "approximate"):
+    raise ValueError(f"WHISK_TOKEN_COUNTING must be 'exact' or 'approximate', not {TOKEN_COUNTING!r}")
+
+class TokenizerRegistry:
+    """Encodings loaded once per process and shared by every handler.
+
+    Models that use the same encoding (e.g. gpt-3.5-turbo and gpt-4) share
+    one load. ``count`` remembers the counts of the last ``memo_size`` texts
+    of up to ``memo_max_chars`` characters, so strings sent again and again,
+    such as system prompts and earlier chat turns, are tokenized once.
+    """
+
+    def __init__(self, memo_size: int = 4096, memo_max_chars: int = 4096):
+        self.memo_size = memo_size
+        self.memo_max_chars = memo_max_chars
+        self.hits = 0
+        self.misses = 0
+        self._names = {}
+        self._encodings = {}
+        self._memo = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def encoding_name(self, model: str = DEFAULT_MODEL) -> str:
+        name = self._names.get(model)
+        if name is None:
+            import tiktoken
+            try:
+                name = tiktoken.encoding_name_for_model(model)
+            except KeyError:
+                # Not a known model, treat it as an encoding name
+                name = model
+            self._names[model] = name
+        return name
+
+    def register(self, model: str, encoding, name: str | None = None):
+        """Use ``encoding`` for ``model``, e.g. a tokenizer available offline"""
+        name = name or getattr(encoding, "name", None) or f"custom:{model}"
+        with self._lock:
+            self._names[model] = name
+            self._encodings[name] = encoding
+
+    def encoding(self, model: str = DEFAULT_MODEL):
+        name = self.encoding_name(model)
+        encoding = self._encodings.get(name)
+        if encoding is None:
+            with self._lock:
+                encoding = self._encodings.get(name)
+                if encoding is None:
+                    import tiktoken
+                    encoding = self._encodings[name] = tiktoken.get_encoding(name)
+        return encoding
+
+    def count(self, text: str, model: str = DEFAULT_MODEL) -> int:
+        if len(text) > self.memo_max_chars:
+            return len(self.encoding(model).encode(text))
+        key = (self.encoding_name(model), text)
+        with self._lock:
+            count = self._memo.get(key)
+            if count is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = len(self.encoding(model).encode(text))
+        with self._lock:
+            self._memo[key] = count
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return count
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "encodings": len(self._encodings),
+            "memo_entries": len(self._memo),
+            "memo_hits": self.hits,
+            "memo_misses": self.misses,
+            "memo_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+tokenizers = TokenizerRegistry(memo_size=int(os.getenv("WHISK_TOKEN_MEMO_SIZE", "4096")))
+metrics.register_gauges("whisk_tokenizer", tokenizers.stats)
+
+def get_encoding(model: str = DEFAULT_MODEL):
+    """The shared tiktoken encoding for ``model``"""
+    return tokenizers.encoding(model)
+
+def _exact(exact: bool | None) -> bool:
+    return TOKEN_COUNTING == "exact" if exact is None else exact
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL, exact: bool | None = None) -> int:
+    """Token count of ``text`` under the configured strategy, or exact when ``exact``"""
+    if _exact(exact):
+        return tokenizers.count(text, model)
+    from .token_estimate import estimate_tokens
+    return estimate_tokens(text)
+
+def lazy_tokenizer(model: str = DEFAULT_MODEL, exact: bool | None = None):
+    """Tokenizer function that loads the shared encoding on first use.
+
+    In approximate mode it returns ``range(estimate)``: llama-index only
+    takes the length of what the tokenizer returns, so no ids are built.
+    """
+    if not _exact(exact):
+        from .token_estimate import estimate_tokens
+        return lambda text: range(estimate_tokens(text))
+
+    def tokenize(text: str) -> list[int]:
+        return get_encoding(model).encode(text)
+    return tokenize
+
+def create_token_counter(model: str = DEFAULT_MODEL, exact: bool | None = None):
+    """Create token counter for tracking usage; pass ``exact=True`` for
+    counts that are billed or reported to callers"""
+    from .counting import PromptTokenCountingHandler
+    return PromptTokenCountingHandler(
+        tokenizer=lazy_tokenizer(model, exact),
+        count=functools.partial(count_tokens, model=model, exact=exact)
+    )
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Set
+
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Metadata key stamped on every stored chunk with the WhiskStorageSchema id
+FILE_ID_KEY = "file_id"
+
+# Chunks written before file ids were stamped only carry document_id
+ID_KEYS = (FILE_ID_KEY, "document_id")
+
+def hidden_clauses(file_ids) -> list[dict]:
+    """Chroma ``where`` clauses excluding the chunks of ``file_ids``.
+
+    ``$nin`` also matches chunks without the key, so these select exactly
+    the chunks compaction leaves in place.
+    """
+    if not file_ids:
+        return []
+    file_ids = sorted(file_ids)
+    return [{key: {"$nin": file_ids}} for key in ID_KEYS]
+
+def hidden_filters(file_ids) -> list[MetadataFilter]:
+    """``hidden_clauses`` as llama-index metadata filters"""
+    if not file_ids:
+        return []
+    file_ids = sorted(file_ids)
+    return [MetadataFilter(key=key, value=file_ids, operator=FilterOperator.NIN) for key in ID_KEYS]
+
+def is_hidden(metadata: dict, file_ids) -> bool:
+    return any(metadata.get(key) in file_ids for key in ID_KEYS if metadata.get(key) is not None)
+
+class DeletePipeline:
+    """Tombstone-based deletes with background compaction.
+
+    ``delete`` only records a tombstone, which hides the document from
+    queries straight away. A background task then removes the vectors in
+    batches so mass deletions do not hold the collection lock on the
+    request path.
+    """
+
+    def __init__(self, batch_size: int = 100, interval: float = 1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.chroma_path = None
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._init_db()
+        self._lock = threading.Lock()
+        self._collections = {}
+        self._chroma_client = None
+        self._task = None
+        self._stopping = False
+        self._compacted_total = 0
+        self._batches = 0
+        self._last_rate = 0.0
+        self._last_error = None
+
+    def configure(self, chroma_path: str, batch_size: int | None = None, interval: float | None = None):
+        """Persist tombstones next to the Chroma data so they survive restarts"""
+        self.chroma_path = chroma_path
+        self.batch_size = batch_size or self.batch_size
+        self.interval = interval or self.interval
+        with self._lock:
+            self._db.close()
+            self._db = sqlite3.connect(
+                os.path.join(chroma_path, "tombstones.sqlite3"), check_same_thread=False
+            )
+            self._init_db()
+
+    def _init_db(self):
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tombstones ("
+            "collection TEXT NOT NULL, file_id TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (collection, file_id))"
+        )
+        self._db.commit()
+
+    def delete(self, vector_store, file_id: str):
+        """Tombstone ``file_id`` in the collection behind ``vector_store``"""
+        collection = vector_store.client
+        with self._lock:
+            self._collections[collection.name] = collection
+            self._db.execute(
+                "INSERT OR IGNORE INTO tombstones VALUES (?, ?, ?)",
+                (collection.name, file_id, time.time())
+            )
+            self._db.commit()
+
+    def hidden(self, vector_store) -> Set[str]:
+        """File ids that must be hidden from queries on ``vector_store``"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT file_id FROM tombstones WHERE collection = ?",
+                (vector_store.client.name,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def backlog(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+
+    def _collection(self, name: str):
+        if name not in self._collections:
+            if self._chroma_client is None:
+                import chromadb
+                self._chroma_client = chromadb.PersistentClient(path=self.chroma_path)
+            self._collections[name] = self._chroma_client.get_or_create_collection(name)
+        return self._collections[name]
+
+    def _remove(self, collection: str, file_ids: List[str]):
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM tombstones WHERE collection = ? AND file_id = ?",
+                [(collection, file_id) for file_id in file_ids]
+            )
+            self._db.commit()
+
+    async def _purge(self, collection: str, file_ids: List[str]):
+        where = {"$or": [{key: {"$in": file_ids}} for key in ID_KEYS]}
+        await asyncio.to_thread(self._collection(collection).delete, where=where)
+        self._remove(collection, file_ids)
+
+    async def flush(self, vector_store, file_id: str):
+        """Synchronously purge a pending delete, e.g. before re-ingesting a file"""
+        name = vector_store.client.name
+        if file_id in self.hidden(vector_store):
+            with self._lock:
+                self._collections[name] = vector_store.client
+            await self._purge(name, [file_id])
+
+    async def compact_once(self) -> int:
+        """Remove one batch of tombstoned documents, returns the number purged"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT collection, file_id FROM tombstones ORDER BY created_at LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+        if not rows:
+            return 0
+        by_collection = {}
+        for collection, file_id in rows:
+            by_collection.setdefault(collection, []).append(file_id)
+
+        started = time.perf_counter()
+        for collection, file_ids in by_collection.items():
+            await self._purge(collection, file_ids)
+        elapsed = time.perf_counter() - started
+
+        self._compacted_total += len(rows)
+        self._batches += 1
+        self._last_rate = len(rows) / elapsed if elapsed > 0 else float(len(rows))
+        logger.debug(f"Compacted {len(rows)} deleted documents in {elapsed:.3f}s")
+        return len(rows)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if await self.compact_once() < self.batch_size:
+                    await asyncio.sleep(self.interval)
+                self._last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._last_error = str(e)
+                logger.error(f"Error compacting deletes: {str(e)}")
+                await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the compaction task on the running event loop if needed"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Let the current batch finish, then stop compacting.
+
+        Tombstones still pending are persisted and picked up on the next start.
+        """
+        if self._task is not None:
+            self._stopping = True
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "tombstone_backlog": self.backlog(),
+            "compacted_total": self._compacted_total,
+            "compaction_batches": self._batches,
+            "compaction_docs_per_second": round(self._last_rate, 2),
+            "compaction_last_error": self._last_error
+        }
+
+delete_pipeline = DeletePipeline()
+metrics.register_gauges("whisk_deletes", delete_pipeline.metrics)
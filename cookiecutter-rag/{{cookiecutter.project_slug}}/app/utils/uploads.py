@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Storage metadata of a chunked upload; values are strings like all metadata
+UPLOAD_ID_KEY = "upload_id"
+CHUNK_KEYS = ("upload_id", "chunk_index", "chunk_count", "chunk_offset")
+
+# Must start with a letter or digit, so "." and ".." never name a directory
+_VALID_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+def is_chunked(metadata: dict | None) -> bool:
+    return bool(metadata) and UPLOAD_ID_KEY in metadata
+
+def document_metadata(metadata: dict | None) -> dict | None:
+    """``metadata`` without the chunking keys, for the stored documents"""
+    if not metadata:
+        return metadata
+    return {key: value for key, value in metadata.items() if key not in CHUNK_KEYS}
+
+class UploadSpool:
+    """Assembles chunked uploads into spill files on disk.
+
+    A large document is sent as several storage requests with the same
+    ``upload_id`` in their metadata, each carrying ``chunk_count`` and its
+    own ``chunk_index`` and byte ``chunk_offset``. Every chunk is written at
+    its offset as it arrives, so memory use stays at one chunk whatever the
+    file size and chunks may arrive in any order. The request that delivers
+    the last missing chunk claims the upload and ingests the file.
+
+    All chunks of an upload must reach workers on the same host. Uploads not
+    completed within ``ttl`` seconds are removed.
+    """
+
+    def __init__(self, root: str | None = None, ttl: float = 3600.0):
+        self.root = Path(root or os.path.join(tempfile.gettempdir(), "whisk-uploads"))
+        self.ttl = ttl
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.completed = 0
+        self.expired = 0
+
+    def configure(self, root: str, ttl: float | None = None):
+        self.root = Path(root)
+        self.ttl = ttl or self.ttl
+
+    def _dir(self, upload_id: str) -> Path:
+        if not _VALID_ID.match(upload_id):
+            raise ValueError(f"Invalid upload_id: {upload_id!r}")
+        # Every write and rmtree goes through here; refuse anything that
+        # resolves outside the spool, e.g. through a symlink
+        root = self.root.resolve()
+        directory = (self.root / upload_id).resolve()
+        if directory.parent != root:
+            raise ValueError(f"Invalid upload_id: {upload_id!r}")
+        return directory
+
+    def path(self, upload_id: str, name: str) -> Path:
+        """Spill file of the upload, named like the uploaded file so parsers
+        pick the reader by its extension"""
+        return self._dir(upload_id) / "file" / Path(name).name
+
+    def write_chunk(self, upload_id: str, name: str, index: int, count: int, offset: int, data: bytes) -> int:
+        """Write one chunk and return how many distinct chunks have arrived"""
+        if not 0 <= index < count or offset < 0:
+            raise ValueError(f"Invalid chunk {index} of {count} at offset {offset}")
+        path = self.path(upload_id, name)
+        received = path.parent.parent / "received"
+        if not received.exists():
+            self.expire()
+            received.mkdir(parents=True, exist_ok=True)
+            path.parent.mkdir(exist_ok=True)
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            written = 0
+            view = memoryview(data)
+            while written < len(view):
+                written += os.pwrite(fd, view[written:], offset + written)
+        finally:
+            os.close(fd)
+        (received / str(index)).touch()
+        # Keeps the upload from expiring while chunks still arrive
+        os.utime(received.parent)
+
+        self.chunks_received += 1
+        self.bytes_received += len(data)
+        return sum(1 for _ in received.iterdir())
+
+    def claim(self, upload_id: str) -> bool:
+        """True for exactly one caller once the upload is complete"""
+        try:
+            os.close(os.open(self._dir(upload_id) / "claimed", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def release(self, upload_id: str):
+        """Give up a claim after a failed ingestion; sending any chunk again retries it"""
+        (self._dir(upload_id) / "claimed").unlink(missing_ok=True)
+
+    def discard(self, upload_id: str):
+        """Remove an ingested upload"""
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        self.completed += 1
+
+    def expire(self):
+        """Remove uploads that have not been touched for ``ttl`` seconds"""
+        if not self.root.exists():
+            return
+        cutoff = time.time() - self.ttl
+        for upload in self.root.iterdir():
+            try:
+                if upload.stat().st_mtime < cutoff:
+                    shutil.rmtree(upload, ignore_errors=True)
+                    self.expired += 1
+                    logger.info(f"Removed expired upload {upload.name}")
+            except OSError:
+                continue
+
+    def stats(self) -> dict:
+        return {
+            "chunks_received": self.chunks_received,
+            "bytes_received": self.bytes_received,
+            "completed": self.completed,
+            "expired": self.expired
+        }
+
+upload_spool = UploadSpool(ttl=float(os.getenv("WHISK_UPLOAD_TTL", "3600")))
+metrics.register_gauges("whisk_uploads", upload_spool.stats)
@@ -0,0 +1,83 @@
+import contextlib
+import contextvars
+import functools
+import os
+
+from whisk.kitchenai_sdk.schema import WhiskQueryBaseResponseSchema
+
+# Requests with metadata {"response_format": "compact"} get compact responses
+FORMAT_KEY = "response_format"
+FORMATS = ("full", "compact")
+DEFAULT_FORMAT = os.getenv("WHISK_RESPONSE_FORMAT", "full").lower()
+if DEFAULT_FORMAT not in FORMATS:
+    raise ValueError(f"WHISK_RESPONSE_FORMAT must be 'full' or 'compact', not {DEFAULT_FORMAT!r}")
+
+_format = contextvars.ContextVar("whisk_response_format", default=DEFAULT_FORMAT)
+
+def is_compact() -> bool:
+    return _format.get() == "compact"
+
+@contextlib.contextmanager
+def formatted(name: str):
+    """Build the responses of the enclosed code in format ``name``"""
+    token = _format.set(name if name in FORMATS else DEFAULT_FORMAT)
+    try:
+        yield
+    finally:
+        _format.reset(token)
+
+def response_format(handler):
+    """Apply the response format a request asks for to ``handler``.
+
+    The format comes from ``metadata["response_format"]``, or
+    WHISK_RESPONSE_FORMAT when the request does not set one. The key is
+    removed before the handler runs, so it never becomes a metadata filter.
+    """
+    @functools.wraps(handler)
+    async def wrapper(data, *args, **kwargs):
+        metadata = getattr(data, "metadata", None)
+        requested = DEFAULT_FORMAT
+        if metadata and FORMAT_KEY in metadata:
+            requested = str(metadata[FORMAT_KEY]).lower()
+            metadata = {key: value for key, value in metadata.items() if key != FORMAT_KEY}
+            data = data.model_copy(update={"metadata": metadata})
+        with formatted(requested):
+            return await handler(data, *args, **kwargs)
+    return wrapper
+
+def retrieval_refs(source_nodes) -> dict:
+    """Retrieved chunks by reference: their node ids and scores, in rank order"""
+    return {
+        "ids": [node.node.node_id for node in source_nodes],
+        "scores": [round(node.score or 0.0, 6) for node in source_nodes]
+    }
+
+def query_response(data, response, metadata: dict, token_counts) -> WhiskQueryBaseResponseSchema:
+    """Response of a query in the requested format.
+
+    The full format carries the text and metadata of every retrieved chunk,
+    the chunks' metadata again keyed by node id, and the token counts both
+    as ``token_counts`` and in metadata. The compact format sends the
+    chunks as ``metadata["retrieval_refs"]``, to be resolved with the
+    ``nodes`` handler when the text is needed, keeps only the prompt prefix
+    counts in metadata and leaves out the per-node metadata.
+    """
+    if not is_compact():
+        return WhiskQueryBaseResponseSchema.from_llama_response(
+            data, response, metadata=metadata, token_counts=token_counts
+        )
+    counts = {
+        key: value for key, value in (metadata.get("token_counts") or {}).items()
+        if key not in type(token_counts).model_fields
+    }
+    metadata = {
+        **metadata,
+        "token_counts": counts,
+        "retrieval_refs": retrieval_refs(getattr(response, "source_nodes", None) or [])
+    }
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output=response.response,
+        metadata=metadata,
+        token_counts=token_counts
+    )
@@ -0,0 +1,206 @@
+"""Worker and supervisor entry points.
+
+``python -m app.main`` runs a single worker. ``python -m app.worker`` starts
+a supervisor that runs several worker processes; they all subscribe with the
+same client id and therefore share one NATS queue group, so each request is
+delivered to exactly one of them.
+
+With ``WHISK_METRICS_PORT`` set, worker ``n`` serves Prometheus metrics on
+``WHISK_METRICS_PORT + n``.
+
+    python -m app.worker --workers 4 --total-concurrency 16
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+def subscriber_workers(limiter) -> int:
+    """Messages each subscriber hands to its handler at once: every slot and
+    queue place of ``limiter``, plus one so overflow reaches it and is refused"""
+    return limiter.max_concurrency + limiter.max_pending + 1
+
+def concurrent_client_class():
+    from whisk.client import WhiskClient
+
+    class ConcurrentWhiskClient(WhiskClient):
+        """WhiskClient whose query and storage subscribers handle up to
+        ``max_workers`` messages at once.
+
+        nats-py awaits a subscription's callback before it delivers the next
+        message, so with WhiskClient's default single worker a process runs
+        one query, one storage and one delete request at a time and the
+        concurrency limiter never has anything to schedule.
+        """
+
+        def __init__(self, *args, max_workers: int = 1, **kwargs):
+            # WhiskClient subscribes in __init__
+            self.max_workers = max_workers
+            super().__init__(*args, **kwargs)
+
+        def _setup_subscribers(self):
+            prefix = f"kitchenai.service.{self.client_id}"
+            subscriber = functools.partial(self.broker.subscriber, queue="queue", max_workers=self.max_workers)
+            # The subscribers themselves; the handle_* attributes are the wrapped handlers
+            self.subscribers = {
+                "query": subscriber(f"{prefix}.query.*"),
+                "storage": subscriber(f"{prefix}.storage.*"),
+                "storage_delete": subscriber(f"{prefix}.storage.*.delete"),
+            }
+            self.handle_query = self.subscribers["query"](self._handle_query)
+            self.handle_heartbeat = self.broker.subscriber(f"{prefix}.heartbeat", "queue")(self._handle_heartbeat)
+            self.handle_storage = self.subscribers["storage"](self._handle_storage)
+            self.handle_storage_delete = self.subscribers["storage_delete"](self._handle_storage_delete)
+
+    return ConcurrentWhiskClient
+
+def create_client(kitchen, settings: dict | None = None, max_workers: int | None = None):
+    """Client for ``kitchen``; the environment overrides ``settings``
+    (nats_url, client_id, user, password), which override the defaults.
+    ``max_workers`` defaults to what the concurrency limiter can admit"""
+    from .utils.concurrency import limiter
+
+    settings = settings or {}
+    return concurrent_client_class()(
+        nats_url=os.getenv("WHISK_NATS_URL") or settings.get("nats_url") or "nats://nats.playground.kitchenai.dev",
+        client_id=os.getenv("WHISK_CLIENT_ID") or settings.get("client_id") or "whisk_client",
+        user=os.getenv("WHISK_NATS_USER") or settings.get("user") or "playground",
+        password=os.getenv("WHISK_NATS_PASSWORD") or settings.get("password") or "kitchenai_playground",
+        kitchen=kitchen,
+        max_workers=max_workers or subscriber_workers(limiter),
+    )
+
+def run_worker(kitchen, startup=None, client_settings: dict | None = None):
+    """Run one client loop for ``kitchen`` until interrupted.
+
+    ``startup`` is an optional coroutine function started alongside the
+    client, e.g. to warm up lazily loaded dependencies. On SIGINT/SIGTERM the
+    worker drains before the NATS connection is closed.
+    """
+    from .utils.metrics import start_metrics_server
+    from .utils.shutdown import drain
+
+    client = create_client(kitchen, client_settings)
+    start_metrics_server()
+
+    # FastStream runs shutdown hooks before it closes the broker
+    @client.app.on_shutdown
+    async def shutdown():
+        logger.info("Shutting down gracefully...")
+        await drain(client)
+
+    try:
+        asyncio.run(serve(client, startup))
+    except KeyboardInterrupt:
+        logger.info("\nShutting down gracefully...")
+
+async def serve(client, startup=None):
+    """Run ``client`` with ``startup`` alongside it.
+
+    A failing startup stops the client and fails the worker, so a
+    supervisor restarts it instead of it serving half initialized.
+    """
+    run = asyncio.ensure_future(client.run())
+    startup_task = asyncio.create_task(startup()) if startup else None
+
+    def startup_done(task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error("Worker startup failed", exc_info=task.exception())
+        run.cancel()
+
+    if startup_task is not None:
+        startup_task.add_done_callback(startup_done)
+    try:
+        await run
+    except asyncio.CancelledError:
+        if startup_task is not None and startup_task.done() and not startup_task.cancelled() \
+                and startup_task.exception() is not None:
+            raise RuntimeError("Worker startup failed") from startup_task.exception()
+        raise
+    finally:
+        if startup_task is not None and not startup_task.done():
+            startup_task.cancel()
+
+def _worker_process(index: int, env: dict):
+    os.environ.update(env)
+    os.environ["WHISK_WORKER_INDEX"] = str(index)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"[worker {index}] %(levelname)s %(name)s: %(message)s"
+    )
+    app_main = importlib.import_module(f"{__package__}.main")
+    run_worker(app_main.kitchen, app_main.startup, getattr(app_main, "client_settings", None))
+
+def supervise(workers: int, total_concurrency: int | None = None, restart_delay: float = 1.0):
+    """Run ``workers`` worker processes and restart any that exit unexpectedly"""
+    # Each worker paces its LLM calls to its share of the provider's RPM and TPM
+    env = {"WHISK_WORKER_COUNT": str(workers)}
+    if total_concurrency:
+        # Split the global budget (e.g. what the LLM rate limit allows) across workers
+        env["WHISK_MAX_CONCURRENCY"] = str(max(1, total_concurrency // workers))
+
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def spawn(index: int):
+        process = context.Process(
+            target=_worker_process, args=(index, env), name=f"whisk-worker-{index}"
+        )
+        process.start()
+        processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(workers):
+        spawn(index)
+
+    while not stopping:
+        time.sleep(restart_delay)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting")
+                spawn(index)
+
+    # SIGTERM makes each worker drain its in-flight requests before exiting
+    logger.info("Stopping workers...")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run several Whisk worker processes")
+    parser.add_argument(
+        "--workers", type=int,
+        default=int(os.getenv("WHISK_WORKERS", str(os.cpu_count() or 1)))
+    )
+    parser.add_argument(
+        "--total-concurrency", type=int,
+        default=int(os.getenv("WHISK_TOTAL_CONCURRENCY", "0")) or None,
+        help="In-flight handler budget shared by all workers"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    supervise(args.workers, args.total_concurrency)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Query latency while one tenant floods the worker with ingestion.
+
+Sends ``--storage`` storage requests from one tenant at once, then queries
+from several other tenants at ``--query-rps``, through the in-process
+transport and the worker's admission control to handlers that sleep for a
+fixed time. Reports query latency percentiles and refusals with one
+first-come-first-served queue, as before requests were scheduled ("fifo"),
+with fair queuing over tenants and labels of equal weight ("equal") and with
+the weights and quotas of config.yml's ``limits`` ("fair"). The queue is made
+long enough for every request, so the comparison is of waiting, not of
+refusals. ``--subscriber-workers 1`` delivers messages one at a time per
+subject, as the stock ``WhiskClient`` does:
+
+    python -m benchmarks.admission --storage 200 --storage-ms 200 --queries 200
+    python -m benchmarks.admission --subscriber-workers 1
+"""
+import argparse
+import asyncio
+import functools
+import json
+import time
+
+from whisk.kitchenai_sdk.kitchenai import KitchenAIApp
+from whisk.kitchenai_sdk.schema import (
+    WhiskQueryBaseResponseSchema,
+    WhiskStorageResponseSchema,
+    WhiskStorageStatus,
+)
+
+from app.utils.concurrency import ConcurrencyLimiter, label_values, reject_query, reject_storage
+from app.utils.config import load_config
+from app.worker import subscriber_workers
+
+from .harness import percentile
+from .transport import LocalTransport
+
+class FifoLimiter(ConcurrencyLimiter):
+    """Every request in one flow, i.e. served in arrival order"""
+
+    def flow_key(self, data) -> tuple[str, str]:
+        return "", ""
+
+def limiter_settings(limits: dict) -> dict:
+    return {
+        "weights": label_values(limits.get("weights") or {}),
+        "label_concurrency": label_values(limits.get("label_concurrency") or {}, int),
+        "tenant_concurrency": int(limits.get("tenant_concurrency") or 0),
+        "tenant_pending": int(limits.get("tenant_pending") or 0),
+    }
+
+async def measure(limiter: ConcurrencyLimiter, args) -> dict:
+    """Latency through the transport, i.e. with the worker's subscriber delivery"""
+    durations = {"storage": args.storage_ms / 1000, "query": args.query_ms / 1000}
+    kitchen = KitchenAIApp(namespace="admission")
+
+    async def query(data, **kwargs):
+        await asyncio.sleep(durations["query"])
+        return WhiskQueryBaseResponseSchema.from_llm_invoke(data.query, "")
+
+    async def storage(data, **kwargs):
+        await asyncio.sleep(durations["storage"])
+        return WhiskStorageResponseSchema(id=data.id, status=WhiskStorageStatus.COMPLETE)
+
+    kitchen.query.handler("query")(limiter.limit(query, reject_query))
+    kitchen.storage.handler("storage")(limiter.limit(storage, reject_storage))
+    transport = LocalTransport(kitchen, max_workers=args.subscriber_workers or subscriber_workers(limiter))
+
+    async def call(send, tenant: str):
+        started = time.perf_counter()
+        response = await send(metadata={"tenant": tenant})
+        return time.perf_counter() - started, "rejected" in (response.metadata or {})
+
+    storage_calls = [
+        asyncio.create_task(call(functools.partial(transport.store, "storage", i, f"doc-{i}.txt", b""), "bulk"))
+        for i in range(args.storage)
+    ]
+    queries = []
+    for i in range(args.queries):
+        queries.append(asyncio.create_task(call(functools.partial(transport.query, "query", "query"), f"tenant-{i % 5}")))
+        await asyncio.sleep(1 / args.query_rps)
+    answered = await asyncio.gather(*queries)
+    ingested = await asyncio.gather(*storage_calls)
+
+    latencies = [seconds * 1000 for seconds, refused in answered if not refused]
+    return {
+        "query_p50_ms": round(percentile(latencies, 50), 1),
+        "query_p99_ms": round(percentile(latencies, 99), 1),
+        "queries_refused": sum(refused for _, refused in answered),
+        "storage_refused": sum(refused for _, refused in ingested),
+    }
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", type=int, default=100)
+    parser.add_argument("--storage-ms", type=float, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--query-ms", type=float, default=20)
+    parser.add_argument("--query-rps", type=float, default=50)
+    parser.add_argument("--subscriber-workers", type=int,
+                        help="Messages handled at once per subject, 1 for the stock WhiskClient; defaults to the worker's")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    limits = load_config().get("limits", {})
+    size = {
+        "max_concurrency": int(limits.get("max_concurrency") or 8),
+        "max_pending": max(int(limits.get("max_pending") or 32), args.storage + args.queries),
+    }
+    results = {
+        "fifo": asyncio.run(measure(FifoLimiter(**size), args)),
+        "equal": asyncio.run(measure(ConcurrencyLimiter(**size), args)),
+        "fair": asyncio.run(measure(ConcurrencyLimiter(**size, **limiter_settings(limits)), args)),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(
+            f"{name:<5} query p50 {result['query_p50_ms']:>8.1f} ms  p99 {result['query_p99_ms']:>8.1f} ms  "
+            f"refused {result['queries_refused']} queries, {result['storage_refused']} storage"
+        )
+
+if __name__ == "__main__":
+    main()
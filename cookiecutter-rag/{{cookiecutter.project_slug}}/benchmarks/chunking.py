@@ -0,0 +1,110 @@
+"""Chunking time and tokenizer work of each chunking strategy.
+
+Splits documents of ``--words`` words with ingestion-like metadata with
+llama-index's ``TokenTextSplitter``, which the storage handler used before,
+and with each ``ChunkingSplitter`` strategy, and reports the time taken,
+the chunks made and the characters the tokenizer was given:
+
+    python -m benchmarks.chunking --documents 20 --words 50000
+"""
+import argparse
+import json
+import logging
+import time
+
+from llama_index.core import Settings
+from llama_index.core.node_parser import TokenTextSplitter
+from llama_index.core.schema import Document
+
+from app.utils import token_counter
+from app.utils.chunking import STRATEGIES, ChunkingSplitter
+
+from .fakes import FakeEmbedding, FakeEncoding, fake_text
+
+logger = logging.getLogger(__name__)
+
+class CountingEncoding:
+    """Wraps an encoding and counts the characters it tokenizes"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = getattr(encoding, "name", "counted")
+        self.characters = 0
+        if hasattr(encoding, "decode_single_token_bytes"):
+            self.n_vocab = encoding.n_vocab
+            self.decode_single_token_bytes = encoding.decode_single_token_bytes
+
+    def encode(self, text: str, **kwargs):
+        self.characters += len(text)
+        return self.encoding.encode(text, **kwargs)
+
+def documents(count: int, words: int) -> list[Document]:
+    return [
+        Document(
+            text="\n\n".join(
+                " ".join(f"{fake_text(f'doc-{i}-{p}-{s}', 18)}." for s in range(8))
+                for p in range(words // 144 + 1)
+            ),
+            metadata={"file_name": f"report-{i}.pdf", "source": "docs", "author": "benchmark"}
+        )
+        for i in range(count)
+    ]
+
+def measure(splitter, docs: list[Document], encoding: CountingEncoding) -> dict:
+    encoding.characters = 0
+    started = time.perf_counter()
+    nodes = splitter(docs)
+    elapsed = time.perf_counter() - started
+    return {
+        "chunks": len(nodes),
+        "ms": round(elapsed * 1000, 1),
+        "tokenized_chars": encoding.characters,
+    }
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        encoding, reference = token_counter.get_encoding(), "tiktoken"
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable ({str(e)}), tokenizing on whitespace")
+        encoding, reference = FakeEncoding(), "whitespace"
+    counting = CountingEncoding(encoding)
+    token_counter.tokenizers.register(token_counter.DEFAULT_MODEL, counting)
+    Settings.embed_model = FakeEmbedding(latency=0.0)
+
+    docs = documents(args.documents, args.words)
+    splitters = {
+        "TokenTextSplitter": TokenTextSplitter(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+            tokenizer=token_counter.lazy_tokenizer(exact=True)
+        ),
+        **{
+            strategy: ChunkingSplitter(
+                strategy=strategy, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, exact=True
+            )
+            for strategy in STRATEGIES
+        }
+    }
+    results = {name: measure(splitter, docs, counting) for name, splitter in splitters.items()}
+    characters = sum(len(doc.text) for doc in docs)
+
+    if args.json:
+        print(json.dumps({"reference": reference, "characters": characters, **results}, indent=2))
+        return
+    print(f"reference: {reference}  {args.documents} documents, {characters} characters")
+    for name, result in results.items():
+        print(
+            f"{name:<18} {result['chunks']:>6} chunks  {result['ms']:>9.1f} ms  "
+            f"tokenized {result['tokenized_chars'] / characters:>5.2f}x the text"
+        )
+
+if __name__ == "__main__":
+    main()
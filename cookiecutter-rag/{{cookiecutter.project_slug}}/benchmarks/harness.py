@@ -0,0 +1,108 @@
+import asyncio
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, List
+
+# Metrics compared against a baseline and whether higher is better
+COMPARED = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def failed(response) -> bool:
+    if getattr(response, "error", None):
+        return True
+    if str(getattr(response, "status", "")) == "error":
+        return True
+    return str(getattr(response, "output", "") or "").startswith("Error")
+
+async def run_load(name: str, call: Callable[..., Awaitable], payloads: Iterable, concurrency: int,
+                   warmup: int = 1) -> dict:
+    """Send every payload through ``call`` with ``concurrency`` requests in flight.
+
+    The first ``warmup`` payloads are sent once beforehand, unmeasured, so
+    lazy imports and model loads do not land in the percentiles.
+    """
+    payloads = list(payloads)
+    for payload in payloads[:warmup]:
+        await call(payload)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(payload):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await call(payload)
+                errors += failed(response)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(payload) for payload in payloads))
+    elapsed = time.perf_counter() - started
+
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(milliseconds, 50), 2),
+        "p95_ms": round(percentile(milliseconds, 95), 2),
+        "p99_ms": round(percentile(milliseconds, 99), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def load_baseline(path: str) -> dict:
+    file = Path(path)
+    return json.loads(file.read_text()) if file.exists() else {}
+
+def save_baseline(path: str, results: List[dict]):
+    """Merge ``results`` into the baseline file, keyed by scenario"""
+    baseline = load_baseline(path)
+    baseline.update({result["scenario"]: result for result in results})
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+def compare(result: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """Regressions of ``result`` beyond ``tolerance`` relative to its baseline entry"""
+    reference = baseline.get(result["scenario"])
+    if not reference:
+        return []
+    regressions = []
+    for metric, higher_is_better in COMPARED.items():
+        old, new = reference.get(metric), result.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{result['scenario']}: {metric} {old} -> {new} ({change:+.0%})")
+    if result["errors"] > reference.get("errors", 0):
+        regressions.append(f"{result['scenario']}: errors {reference.get('errors', 0)} -> {result['errors']}")
+    return regressions
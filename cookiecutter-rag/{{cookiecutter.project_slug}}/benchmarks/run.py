@@ -0,0 +1,177 @@
+"""Offline load scenarios for the query and storage handlers.
+
+Runs the registered handlers end to end, through the in-process transport,
+against fake LLM, embedding and parser backends with simulated latency:
+
+    python -m benchmarks.run --requests 200 --concurrency 16
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+    python -m benchmarks.run --scenario query --retrieval adaptive
+    python -m benchmarks.run --scenario query --distinct-queries 5
+    python -m benchmarks.run --scenario batch_query --batch-size 50
+    python -m benchmarks.run --scenario query --subscriber-workers 1
+
+With ``--baseline`` the exit code is 1 when a scenario regresses by more
+than ``--tolerance``. Peak RSS is per process, so run one scenario per
+invocation when comparing memory.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from whisk.kitchenai_sdk.schema import DependencyType
+
+from .fakes import FakeParser, install_fakes, topic_text
+from .harness import compare, load_baseline, run_load, save_baseline
+from .transport import LocalTransport
+
+SCENARIOS = ("storage", "query", "batch_query")
+# Corpus documents are spread over this many topics
+TOPICS = 10
+
+def create_kitchen(args):
+    llm = install_fakes(llm_latency=args.llm_latency, embed_latency=args.embed_latency)
+
+    from llama_index.core import Settings
+
+    from app import main as app_main
+    from app.dependencies.vector_store import setup_vector_store
+    from app.handlers import storage
+    from app.utils import adaptive_retrieval
+
+    storage.Parser = FakeParser
+    adaptive_retrieval.RETRIEVAL_MODE = args.retrieval
+    chroma_path = tempfile.mkdtemp(prefix="whisk-bench-")
+    if args.embedding_cache:
+        from app.dependencies.embeddings import setup_embed_model
+        setup_embed_model(os.path.join(chroma_path, "embeddings"), Settings.embed_model)
+    app_main.kitchen.register_dependency(DependencyType.LLM, llm)
+    app_main.kitchen.register_dependency(DependencyType.VECTOR_STORE, setup_vector_store(chroma_path))
+    return app_main.kitchen
+
+def document(index: int, words: int) -> bytes:
+    """Text on topic ``index % TOPICS`` with a few terms of its own"""
+    text = topic_text(index % TOPICS, f"document-{index}", words).split()
+    return " ".join(
+        f"doc{index}-{i % 6}" if i % 5 == 0 and i % 3 else word
+        for i, word in enumerate(text)
+    ).encode()
+
+def question(index: int, args) -> str:
+    """A dozen words from one corpus document, so every query has a best match"""
+    words = document(1_000_000 + index % args.corpus, args.doc_words).decode().split()
+    start = index * 7 % max(1, len(words) - 12)
+    return " ".join(words[start:start + 12])
+
+async def storage_scenario(transport, args) -> dict:
+    async def call(index):
+        return await transport.store("storage", index, f"doc-{index}.txt", document(index, args.doc_words))
+    return await run_load("storage", call, range(args.requests), args.concurrency)
+
+async def seed_corpus(transport, args):
+    """Store the corpus the query scenarios search, once per run"""
+    if getattr(transport, "seeded", False):
+        return
+    offset = 1_000_000
+    for index in range(args.corpus):
+        await transport.store("storage", offset + index, f"corpus-{index}.txt", document(offset + index, args.doc_words))
+    transport.seeded = True
+
+async def query_scenario(transport, args) -> dict:
+    # Seed a corpus first; only the queries are measured
+    await seed_corpus(transport, args)
+
+    # Context sent to the LLM, the part adaptive retrieval trims
+    chunks, words, answered = 0, 0, 0
+
+    async def call(index):
+        nonlocal chunks, words, answered
+        response = await transport.query("query", question(index % (args.distinct_queries or args.requests), args))
+        if not response.error:
+            context = response.retrieval_context or []
+            chunks += len(context)
+            words += sum(len(node.text.split()) for node in context)
+            answered += 1
+        return response
+
+    result = await run_load("query", call, range(args.requests), args.concurrency)
+    result["avg_context_chunks"] = round(chunks / answered, 2) if answered else 0.0
+    result["avg_context_words"] = round(words / answered, 1) if answered else 0.0
+    return result
+
+async def batch_query_scenario(transport, args) -> dict:
+    # The same questions as the query scenario, sent a batch per request
+    await seed_corpus(transport, args)
+    batches = [range(start, min(start + args.batch_size, args.requests))
+               for start in range(0, args.requests, args.batch_size)]
+
+    async def call(batch):
+        return await transport.query("batch_query", f"batch-{batch.start}",
+                                     messages=[question(index, args) for index in batch])
+
+    result = await run_load("batch_query", call, batches, 1, warmup=0)
+    result["queries_per_s"] = round(args.requests / result["duration_s"], 2) if result["duration_s"] else 0.0
+    return result
+
+async def run(args) -> list:
+    transport = LocalTransport(create_kitchen(args), max_workers=args.subscriber_workers)
+    scenarios = {"storage": storage_scenario, "query": query_scenario, "batch_query": batch_query_scenario}
+    return [await scenarios[name](transport, args) for name in args.scenario]
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Repeatable; defaults to all")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per fake embedding call")
+    parser.add_argument("--corpus", type=int, default=50, help="Documents stored before the query scenario")
+    parser.add_argument("--doc-words", type=int, default=400)
+    parser.add_argument("--retrieval", choices=("fixed", "adaptive"), default="fixed", help="Query retrieval mode")
+    parser.add_argument("--distinct-queries", type=int, default=0,
+                        help="Repeat this many questions, 0 for a distinct question per request")
+    parser.add_argument("--batch-size", type=int, default=50, help="Questions per batch_query request")
+    parser.add_argument("--subscriber-workers", type=int,
+                        help="Messages handled at once per subject, 1 for the stock WhiskClient; defaults to the worker's")
+    parser.add_argument("--embedding-cache", action="store_true", help="Serve embeddings through the persistent cache")
+    parser.add_argument("--baseline", help="Compare against this JSON baseline")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+    args.scenario = args.scenario or list(SCENARIOS)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(
+                f"{result['scenario']:<10} {result['requests']:>6} req  {result['errors']:>4} err  "
+                f"{result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.1f} ms  "
+                f"p95 {result['p95_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  "
+                f"rss {result['peak_rss_mb']:>7.1f} MB"
+                + (f"  ctx {result['avg_context_chunks']:.2f} chunks / {result['avg_context_words']:.0f} words"
+                   if "avg_context_chunks" in result else "")
+                + (f"  {result['queries_per_s']:.1f} queries/s" if "queries_per_s" in result else "")
+            )
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        regressions = [line for result in results for line in compare(result, baseline, args.tolerance)]
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
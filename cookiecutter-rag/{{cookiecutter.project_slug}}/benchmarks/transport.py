@@ -0,0 +1,96 @@
+"""In-process stand-in for the NATS request/reply path of ``WhiskClient``.
+
+Messages are encoded and decoded exactly as on the wire and dispatched to
+the handlers registered on the kitchen, so the benchmark includes
+serialization and the full handler wrapper chain without a broker. Like the
+subscribers of ``app.worker.create_client``, each subject hands at most
+``max_workers`` messages to its handlers at once and the rest wait their
+turn; ``max_workers=1`` is the stock ``WhiskClient``, which answers one
+message at a time.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+
+from whisk.kitchenai_sdk.nats_schema import (
+    QueryRequestMessage,
+    QueryResponseMessage,
+    StorageRequestMessage,
+    StorageResponseMessage,
+)
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema, WhiskStorageSchema, WhiskStorageStatus
+
+class LocalTransport:
+    def __init__(self, kitchen, client_id: str = "benchmark", max_workers: int | None = None):
+        if max_workers is None:
+            from app.utils.concurrency import limiter
+            from app.worker import subscriber_workers
+            max_workers = subscriber_workers(limiter)
+        self.kitchen = kitchen
+        self.client_id = client_id
+        self.max_workers = max_workers
+        # One per subscriber: query and storage are subscribed separately
+        self.workers = {"query": asyncio.Semaphore(max_workers), "storage": asyncio.Semaphore(max_workers)}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _envelope(self, label: str) -> dict:
+        return {
+            "request_id": uuid.uuid4().hex,
+            "timestamp": time.time(),
+            "client_id": self.client_id,
+            "label": label,
+        }
+
+    async def query(self, label: str, query: str, **fields) -> QueryResponseMessage:
+        wire = QueryRequestMessage(**self._envelope(label), query=query, **fields).model_dump_json()
+        self.bytes_sent += len(wire)
+        msg = QueryRequestMessage.model_validate_json(wire)
+
+        task = self.kitchen.query.get_task(msg.label)
+        async with self.workers["query"]:
+            response = await task(WhiskQuerySchema(**msg.model_dump()))
+        response_dict = response.model_dump()
+        metadata = response_dict.get("metadata", {}) or {}
+        metadata.update(msg.metadata or {})
+        response_dict["metadata"] = metadata
+        response_dict["messages"] = msg.messages
+
+        reply = QueryResponseMessage(
+            **response_dict,
+            label=msg.label,
+            client_id=msg.client_id,
+            request_id=msg.request_id,
+            timestamp=time.time(),
+        ).model_dump_json()
+        self.bytes_received += len(reply)
+        return QueryResponseMessage.model_validate_json(reply)
+
+    async def store(self, label: str, id: int, name: str, data: bytes, metadata: dict | None = None) -> StorageResponseMessage:
+        # The file itself is fetched over HTTP in production, not sent over NATS
+        wire = StorageRequestMessage(
+            **self._envelope(label), id=id, name=name, metadata=metadata or {}
+        ).model_dump_json()
+        self.bytes_sent += len(wire)
+        msg = StorageRequestMessage.model_validate_json(wire)
+
+        task = self.kitchen.storage.get_task(msg.label)
+        async with self.workers["storage"]:
+            response = await task(
+                WhiskStorageSchema(id=msg.id, name=msg.name, label=msg.label, data=data, metadata=msg.metadata)
+            )
+        reply = StorageResponseMessage(
+            id=msg.id,
+            request_id=msg.request_id,
+            timestamp=time.time(),
+            label=msg.label,
+            client_id=msg.client_id,
+            metadata=response.metadata,
+            status=response.status or WhiskStorageStatus.COMPLETE,
+            token_counts=response.token_counts,
+            error=response.error,
+        ).model_dump_json()
+        self.bytes_received += len(reply)
+        return StorageResponseMessage.model_validate_json(reply)
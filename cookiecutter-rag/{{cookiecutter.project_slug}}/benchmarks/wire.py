@@ -0,0 +1,133 @@
+"""Payload size and serialization time of query responses on the wire.
+
+Builds query responses with ``top_k`` retrieved chunks and a message history
+of ``history`` turns, wraps them in the NATS reply message as the whisk
+client does, and reports for each response format and encoding the payload
+size and the time to build and serialize one reply:
+
+    python -m benchmarks.wire --top-k 10 --chunk-words 300 --history 20
+
+"json" is the encoding the client publishes. "msgpack" is measured only when
+the package is installed, to size a binary encoding; the client cannot send
+it. The message history is echoed by the client in every format.
+"""
+import argparse
+import json
+import time
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+from whisk.kitchenai_sdk.nats_schema import QueryResponseMessage
+from whisk.kitchenai_sdk.schema import TokenCountSchema, WhiskQuerySchema
+
+from app.utils.wire import FORMATS, formatted, query_response
+
+from .fakes import fake_text
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def llama_response(top_k: int, chunk_words: int) -> Response:
+    """Response as a query engine returns it: chunks with ingestion metadata,
+    and that metadata again keyed by node id"""
+    nodes = [
+        NodeWithScore(
+            node=TextNode(
+                id_=f"node-{i:04d}",
+                text=fake_text(f"chunk-{i}", chunk_words),
+                metadata={
+                    "file_name": f"report-{i % 7}.pdf",
+                    "file_id": str(1000 + i % 7),
+                    "source": "docs",
+                    "document_title": fake_text(f"title-{i % 7}", 8),
+                    "questions_this_excerpt_can_answer": fake_text(f"questions-{i}", 40),
+                }
+            ),
+            score=0.9 - i * 0.01
+        )
+        for i in range(top_k)
+    ]
+    return Response(
+        response=fake_text("answer", 120),
+        source_nodes=nodes,
+        metadata={node.node.node_id: dict(node.node.metadata) for node in nodes}
+    )
+
+def history(turns: int) -> list[dict]:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": fake_text(f"turn-{i}", 40)}
+        for i in range(turns)
+    ]
+
+def reply(name: str, request: WhiskQuerySchema, llama: Response) -> QueryResponseMessage:
+    """The NATS reply to ``request`` in response format ``name``"""
+    counts = TokenCountSchema(
+        embedding_tokens=9, llm_prompt_tokens=2400, llm_completion_tokens=180, total_llm_tokens=2580
+    )
+    metadata = {
+        "token_counts": {**counts.model_dump(), "prefix_tokens": 410, "prefix_cached_tokens": 384},
+        "timings": {"embed": 12.4, "retrieve": 8.1, "synthesize": 640.2, "llm": 610.7},
+    }
+    with formatted(name):
+        response = query_response(request, llama, metadata, counts)
+    # What the client adds before publishing
+    return QueryResponseMessage(
+        **response.model_dump(exclude={"stream_gen", "messages"}),
+        messages=request.messages,
+        request_id="0" * 32,
+        timestamp=time.time(),
+        label=request.label,
+        client_id="benchmark"
+    )
+
+def encoders() -> dict:
+    encoders = {"json": lambda message: message.model_dump_json().encode()}
+    if msgpack is not None:
+        encoders["msgpack"] = lambda message: msgpack.packb(message.model_dump(mode="json"))
+    return encoders
+
+def measure(name: str, encode, request: WhiskQuerySchema, llama: Response, iterations: int) -> dict:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        payload = encode(reply(name, request, llama))
+    elapsed_s = time.perf_counter() - started
+    return {
+        "bytes": len(payload),
+        "serialize_us": round(elapsed_s / iterations * 1e6, 1),
+    }
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--history", type=int, default=10, help="Turns of message history in the request")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    request = WhiskQuerySchema(query="What changed in the report?", label="query", messages=history(args.history))
+    llama = llama_response(args.top_k, args.chunk_words)
+    results = {
+        f"{name}/{encoding}": measure(name, encode, request, llama, args.iterations)
+        for name in FORMATS
+        for encoding, encode in encoders().items()
+    }
+    history_bytes = len(json.dumps(request.messages).encode())
+    full = results["full/json"]["bytes"]
+
+    if args.json:
+        print(json.dumps({"history_bytes": history_bytes, **results}, indent=2))
+        return
+    print(f"top_k {args.top_k}  chunk words {args.chunk_words}  history {args.history} turns ({history_bytes} bytes)")
+    for key, result in results.items():
+        print(
+            f"{key:<16} {result['bytes']:>8} bytes ({result['bytes'] / full:>5.1%})  "
+            f"build+serialize {result['serialize_us']:>8.1f} us"
+        )
+    if msgpack is None:
+        print("msgpack: skipped, package not installed")
+
+if __name__ == "__main__":
+    main()
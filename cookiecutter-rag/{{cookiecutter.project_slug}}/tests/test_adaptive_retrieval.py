@@ -0,0 +1,31 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+from app.utils.adaptive_retrieval import AdaptiveCutoff
+
+def scored(*scores):
+    """Retrieved nodes with the given scores"""
+    return [NodeWithScore(node=TextNode(text=f"chunk {i}"), score=score) for i, score in enumerate(scores)]
+
+def test_clear_top_hit_is_sent_alone():
+    """Test that chunks far below the top hit are dropped"""
+    cutoff = AdaptiveCutoff(base_k=2, max_k=8)
+
+    kept = cutoff.postprocess_nodes(scored(0.70, 0.50, 0.48, 0.47))
+
+    assert [node.score for node in kept] == [0.70]
+    assert cutoff.to_dict() == {"mode": "adaptive", "candidates": 4, "selected": 1}
+
+def test_ambiguous_results_grow_k():
+    """Test that near-ties with the top hit are kept beyond base_k"""
+    cutoff = AdaptiveCutoff(base_k=2, max_k=4)
+
+    kept = cutoff.postprocess_nodes(scored(0.60, 0.60, 0.59, 0.59, 0.59, 0.40))
+
+    assert len(kept) == 4
+
+def test_growth_stops_at_a_cliff():
+    """Test that a sharp drop between neighbours ends the selection"""
+    cutoff = AdaptiveCutoff(base_k=3, max_k=8, drop=0.5)
+
+    kept = cutoff.postprocess_nodes(scored(0.60, 0.58, 0.45, 0.44))
+
+    assert [node.score for node in kept] == [0.60, 0.58]
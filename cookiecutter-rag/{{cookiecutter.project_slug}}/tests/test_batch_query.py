@@ -0,0 +1,130 @@
+import asyncio
+
+import numpy as np
+import pytest
+from llama_index.core import Settings
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema
+
+from app.handlers import batch_query
+from app.utils.concurrency import ConcurrencyLimiter
+from app.utils.filter_planner import ExactScanRetriever, batch_search, plan_filters
+from app.utils.token_counter import create_token_counter
+from benchmarks.fakes import FakeEmbedding, FakeLLM
+
+TOPICS = {
+    "docs": "chroma stores vectors for retrieval",
+    "blog": "whisk runs handlers over nats",
+}
+
+@pytest.fixture
+def embed_model(monkeypatch):
+    model = FakeEmbedding(latency=0.0)
+    monkeypatch.setattr(Settings, "embed_model", model)
+    return model
+
+@pytest.fixture
+def populated_store(vector_store, embed_model):
+    """Vector store with chunks on two topics from two sources"""
+    vector_store.add([
+        TextNode(text=f"{text} part {i}", metadata={"source": source},
+                 embedding=embed_model._vector(f"{text} part {i}"))
+        for source, text in TOPICS.items()
+        for i in range(4)
+    ])
+    return vector_store
+
+def test_batch_search_matches_single_query_search(populated_store, embed_model):
+    """Test that one vectorized search returns what per-query searches return"""
+    queries = ["where are vectors stored", "what runs the handlers", "chroma retrieval"]
+    embeddings = np.asarray([embed_model._vector(query) for query in queries], dtype=np.float32)
+
+    ann = batch_search(populated_store, embeddings, 2)
+    for embedding, nodes in zip(embeddings, ann):
+        single = populated_store.query(VectorStoreQuery(query_embedding=embedding.tolist(), similarity_top_k=2))
+        assert [node.node.text for node in nodes] == [node.text for node in single.nodes]
+        assert [node.score for node in nodes] == pytest.approx(single.similarities, abs=1e-4)
+
+    plan = plan_filters(populated_store, {"source": "docs"})
+    exact = batch_search(populated_store, embeddings, 2, {"source": "docs"}, plan)
+    retriever = ExactScanRetriever(populated_store, plan.node_ids, similarity_top_k=2)
+    for embedding, nodes in zip(embeddings, exact):
+        single = retriever._scan(embedding.tolist())
+        assert [node.node.text for node in nodes] == [node.node.text for node in single]
+        assert all(node.node.metadata["source"] == "docs" for node in nodes)
+
+@pytest.mark.asyncio
+async def test_batch_handler_answers_every_query(populated_store, monkeypatch):
+    """Test that a batch returns one response per query, in order, and isolates failures"""
+    monkeypatch.setattr(batch_query, "count_tokens", lambda text, exact=None: len(text.split()))
+    monkeypatch.setattr(batch_query, "create_token_counter", lambda exact=None: create_token_counter(exact=False))
+
+    def reply(prompt: str) -> str:
+        if "explode" in prompt:
+            raise RuntimeError("generation failed")
+        return "an answer"
+
+    request = WhiskQuerySchema(
+        query="nightly-eval",
+        label="batch_query",
+        messages=[
+            "where are vectors stored",
+            {"query": "what runs the handlers", "metadata": {"source": "blog"}},
+            "explode please",
+        ]
+    )
+
+    response = await batch_query.batch_query_handler(
+        request, llm=FakeLLM(latency=0.0, reply=reply), vector_store=populated_store
+    )
+
+    assert response.metadata["batch"] == {"queries": 3, "errors": 1}
+    answers = response.metadata["responses"]
+    assert [answer["input"] for answer in answers] == [
+        "where are vectors stored", "what runs the handlers", "explode please"
+    ]
+    assert answers[0]["output"] == "an answer"
+    assert answers[1]["metadata"]["filter_plan"]["strategy"] == "exact"
+    assert all(node["metadata"]["source"] == "blog" for node in answers[1]["retrieval_context"])
+    assert answers[2]["output"].startswith("Error: ")
+    assert response.token_counts.embedding_tokens == 8
+
+@pytest.mark.asyncio
+async def test_batch_without_queries_is_an_error(vector_store):
+    """Test that an empty batch is rejected"""
+    request = WhiskQuerySchema(query="empty", label="batch_query", messages=[])
+
+    response = await batch_query.batch_query_handler(request, vector_store=vector_store)
+
+    assert response.output.startswith("Error: ")
+
+@pytest.mark.asyncio
+async def test_batch_fans_out_only_on_free_limiter_slots(monkeypatch):
+    """Test that answers beyond the batch's own slot take free slots within the label cap"""
+    limiter = ConcurrencyLimiter(max_concurrency=4, label_concurrency={"batch_query": 2})
+    monkeypatch.setattr(batch_query, "limiter", limiter)
+    await limiter.acquire("", "batch_query")
+    running, peak = 0, 0
+
+    async def answer(index):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return index
+
+    assert await batch_query.generate(answer, 6, ("", "batch_query")) == list(range(6))
+    assert peak == 2
+    assert limiter.active == 1
+
+    # With a request queued, the batch keeps to its own slot
+    limiter.resize(max_concurrency=1, max_pending=4)
+    queued = asyncio.create_task(limiter.acquire("", "query"))
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+    peak = 0
+    await batch_query.generate(answer, 3, ("", "batch_query"))
+    assert peak == 1
+    queued.cancel()
@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+from benchmarks.harness import compare, percentile, run_load
+
+@pytest.mark.asyncio
+async def test_run_load_reports_latency_percentiles():
+    """Test throughput, percentiles and error counting of a load run"""
+    async def call(index):
+        await asyncio.sleep(0.01)
+        if index == 3:
+            raise RuntimeError("boom")
+        return index
+
+    result = await run_load("fake", call, range(20), concurrency=5, warmup=0)
+
+    assert result["requests"] == 20
+    assert result["errors"] == 1
+    assert result["p50_ms"] >= 10
+    assert result["p99_ms"] >= result["p95_ms"] >= result["p50_ms"]
+    assert result["throughput_rps"] > 0
+    assert result["peak_rss_mb"] > 0
+
+def test_compare_flags_regressions_beyond_tolerance():
+    """Test that slower or hungrier runs are reported against the baseline"""
+    baseline = {"query": {"throughput_rps": 100, "p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "peak_rss_mb": 200, "errors": 0}}
+    same = {"scenario": "query", "throughput_rps": 95, "p50_ms": 11, "p95_ms": 21, "p99_ms": 33, "peak_rss_mb": 210, "errors": 0}
+    slower = dict(same, p95_ms=40, throughput_rps=50)
+
+    assert compare(same, baseline) == []
+    assert len(compare(slower, baseline)) == 2
+    assert compare(dict(same, scenario="new"), baseline) == []
+    assert percentile([1, 2, 3, 4], 50) == 2
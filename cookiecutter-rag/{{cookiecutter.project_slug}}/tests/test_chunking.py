@@ -0,0 +1,77 @@
+import pytest
+from llama_index.core import Settings
+from llama_index.core.schema import Document
+
+from app.utils import token_counter
+from app.utils.chunking import ChunkingSplitter, create_splitter, token_offsets
+from app.utils.token_estimate import estimate_tokens
+from benchmarks.fakes import FakeEmbedding, fake_text
+
+class ByteEncoding:
+    """One token per UTF-8 byte, so offsets are easy to check"""
+    name = "bytes"
+    n_vocab = 256
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text: str, **kwargs) -> list:
+        self.calls += 1
+        return list(text.encode())
+
+    def decode_single_token_bytes(self, token: int) -> bytes:
+        return bytes([token])
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    registry = token_counter.TokenizerRegistry()
+    encoding = ByteEncoding()
+    registry.register(token_counter.DEFAULT_MODEL, encoding)
+    monkeypatch.setattr(token_counter, "tokenizers", registry)
+    return encoding
+
+def test_token_offsets_map_bytes_to_characters(byte_encoding):
+    """Test that tokens starting inside a multi-byte character start at it"""
+    offsets = token_offsets("añb", exact=True)
+
+    assert offsets.tolist() == [0, 1, 1, 2]
+    assert token_offsets("some text here", exact=False)[0] == 0
+
+def test_token_chunks_fit_and_tokenize_once(byte_encoding):
+    """Test that every chunk fits with its metadata and the text is tokenized once"""
+    text = " ".join(f"word{i}" for i in range(400))
+    document = Document(text=text, metadata={"source": "docs"})
+    splitter = ChunkingSplitter(chunk_size=200, chunk_overlap=20, exact=True)
+
+    nodes = splitter([document])
+
+    metadata = len("source: docs".encode())
+    assert len(nodes) > 1
+    assert all(len(node.text.encode()) <= 200 - metadata for node in nodes)
+    assert all(not node.text.startswith(" ") and node.text.split()[0].startswith("word") for node in nodes)
+    assert all(text[node.start_char_idx:node.end_char_idx] == node.text for node in nodes)
+    # Metadata counts are memoized and chunks are never re-tokenized
+    assert byte_encoding.calls == 2
+
+def test_sentence_and_semantic_chunks_keep_sentences_whole(monkeypatch):
+    """Test that sentences are only cut when they do not fit, and topics are kept apart"""
+    monkeypatch.setattr(Settings, "embed_model", FakeEmbedding(latency=0.0))
+    sentences = [f"{fake_text(f'sentence-{i}', 10)}." for i in range(60)]
+    document = Document(text=" ".join(sentences))
+
+    nodes = ChunkingSplitter(strategy="sentence", chunk_size=100, chunk_overlap=0, exact=False)([document])
+    assert len(nodes) > 1
+    assert all(estimate_tokens(node.text) <= 100 for node in nodes)
+    assert all(node.text.endswith(".") for node in nodes)
+
+    semantic = ChunkingSplitter(strategy="semantic", chunk_size=100, chunk_overlap=0, exact=False)([document])
+    assert len(semantic) >= len(nodes)
+    assert all(node.text.endswith(".") for node in semantic)
+
+def test_splitter_from_config():
+    """Test that the strategy and sizes come from the chunking section"""
+    splitter = create_splitter({"strategy": "sentence", "chunk_size": 512, "chunk_overlap": 0})
+    assert (splitter.strategy, splitter.chunk_size) == ("sentence", 512)
+
+    with pytest.raises(ValueError):
+        create_splitter({"strategy": "paragraph"})
@@ -0,0 +1,173 @@
+import asyncio
+import pytest
+from app.utils.concurrency import AdmissionError, ConcurrencyLimiter, reject_delete, reject_query
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema, WhiskStorageSchema
+
+@pytest.mark.asyncio
+async def test_limiter_bounds_concurrency_and_rejects_overflow():
+    """Test that excess requests queue and overflow is rejected"""
+    limiter = ConcurrencyLimiter(max_concurrency=2, max_pending=1)
+    release = asyncio.Event()
+    running = []
+
+    async def handler(data, **kwargs):
+        running.append(data.query)
+        await release.wait()
+        return data.query
+
+    limited = limiter.limit(handler, reject_query)
+    requests = [WhiskQuerySchema(query=f"q{i}", label="query") for i in range(4)]
+    tasks = [asyncio.create_task(limited(request)) for request in requests]
+    await asyncio.sleep(0)
+
+    assert limiter.stats()["active"] == 2
+    assert limiter.stats()["waiting"] == 1
+
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert results[:3] == ["q0", "q1", "q2"]
+    assert results[3].output.startswith("Error: Worker at capacity")
+    assert limiter.stats()["rejected"] == 1
+    assert limiter.stats()["active"] == 0
+
+@pytest.mark.asyncio
+async def test_closed_limiter_drains_in_flight_requests():
+    """Test that closing refuses new work and waits for running requests"""
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_pending=1)
+
+    async def handler(data, **kwargs):
+        await asyncio.sleep(0.2)
+        return data.query
+
+    limited = limiter.limit(handler, reject_query)
+    running = asyncio.create_task(limited(WhiskQuerySchema(query="in flight", label="query")))
+    await asyncio.sleep(0)
+
+    limiter.close()
+    refused = await limited(WhiskQuerySchema(query="late", label="query"))
+
+    assert refused.output == "Error: Worker is shutting down"
+    assert not await limiter.wait_idle(timeout=0.05)
+    assert await limiter.wait_idle(timeout=1.0)
+    assert await running == "in flight"
+
+@pytest.mark.asyncio
+async def test_resize_keeps_admitted_requests():
+    """Test that shrinking lets running requests finish and growing frees slots at once"""
+    limiter = ConcurrencyLimiter(max_concurrency=2, max_pending=4)
+    release = asyncio.Event()
+
+    async def handler(data, **kwargs):
+        await release.wait()
+        return data.query
+
+    limited = limiter.limit(handler, reject_query)
+    running = [asyncio.create_task(limited(WhiskQuerySchema(query=str(i), label="query"))) for i in range(2)]
+    await asyncio.sleep(0)
+
+    limiter.resize(1, 4)
+    queued = asyncio.create_task(limited(WhiskQuerySchema(query="2", label="query")))
+    await asyncio.sleep(0)
+    assert limiter.stats()["waiting"] == 1
+    release.set()
+    assert await asyncio.gather(*running, queued) == ["0", "1", "2"]
+
+    release.clear()
+    limiter.resize(3, 4)
+    more = [asyncio.create_task(limited(WhiskQuerySchema(query=str(i), label="query"))) for i in range(3)]
+    await asyncio.sleep(0)
+    assert limiter.stats()["active"] == 3
+    release.set()
+    await asyncio.gather(*more)
+
+def request(label: str, tenant: str | None = None) -> WhiskQuerySchema:
+    return WhiskQuerySchema(query=label, label=label, metadata={"tenant": tenant} if tenant else {})
+
+@pytest.mark.asyncio
+async def test_queries_overtake_queued_ingestion():
+    """Test that higher-weight labels are served ahead of a bulk backlog and capped labels leave slots free"""
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_pending=20, weights={"query": 8, "storage": 1})
+    release = asyncio.Event()
+    order = []
+
+    async def handler(data, **kwargs):
+        order.append(data.label)
+        await release.wait()
+        return data.label
+
+    limited = limiter.limit(handler, reject_query)
+    bulk = [asyncio.create_task(limited(request("storage", "bulk"))) for _ in range(4)]
+    await asyncio.sleep(0)
+    queries = [asyncio.create_task(limited(request("query", "other"))) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(*bulk, *queries)
+    assert order == ["storage", "query", "query", "storage", "storage", "storage"]
+
+    release.clear()
+    limiter.resize(2, 20)
+    limiter.configure(label_concurrency={"storage": 1})
+    bulk = [asyncio.create_task(limited(request("storage", "bulk"))) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert limiter.stats()["active"] == 1
+    query = asyncio.create_task(limited(request("query", "other")))
+    await asyncio.sleep(0)
+    assert limiter.stats()["active"] == 2
+    release.set()
+    await asyncio.gather(*bulk, query)
+
+@pytest.mark.asyncio
+async def test_tenant_quotas_and_shedding():
+    """Test that tenants are capped and a full queue sheds lower-weight work first"""
+    limiter = ConcurrencyLimiter(
+        max_concurrency=2, max_pending=2, weights={"query": 4, "storage": 1}, tenant_concurrency=1, tenant_pending=1
+    )
+    release = asyncio.Event()
+
+    async def handler(data, **kwargs):
+        await release.wait()
+        return data.label
+
+    limited = limiter.limit(handler, reject_query)
+    first = asyncio.create_task(limited(request("storage", "a")))
+    queued = asyncio.create_task(limited(request("storage", "a")))
+    await asyncio.sleep(0)
+    assert limiter.stats()["active"] == 1
+
+    over_quota = await limited(request("storage", "a"))
+    assert over_quota.metadata["rejected"] == "tenant_quota"
+
+    others = [asyncio.create_task(limited(request("storage", "b")))]
+    others += [asyncio.create_task(limited(request("query", tenant))) for tenant in ("c", "d")]
+    await asyncio.sleep(0)
+    shed = await queued
+    assert shed.metadata["rejected"] == "shed"
+    assert limiter.stats()["shed"] == 1
+
+    release.set()
+    assert await first == "storage"
+    assert [await task for task in others] == ["storage", "query", "query"]
+
+@pytest.mark.asyncio
+async def test_deletes_are_drained_and_refused_loudly():
+    """Test that drain waits for in-flight deletes and refused deletes raise"""
+    limiter = ConcurrencyLimiter(max_concurrency=2, max_pending=2)
+    deleted = []
+
+    async def delete(data, **kwargs):
+        await asyncio.sleep(0.1)
+        deleted.append(data.id)
+
+    limited = limiter.limit(delete, reject_delete, label="storage_delete")
+    running = asyncio.create_task(limited(WhiskStorageSchema(id=1, name="doc.txt", label="storage")))
+    await asyncio.sleep(0)
+    assert limiter.stats()["active"] == 1
+
+    limiter.close()
+    with pytest.raises(AdmissionError):
+        await limited(WhiskStorageSchema(id=2, name="doc.txt", label="storage"))
+    assert await limiter.wait_idle(timeout=1.0)
+    await running
+    assert deleted == [1]
@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+from app.utils.config import ReloadableConfig, setting
+
+def write(path, text: str):
+    path.write_text(text)
+    return str(path)
+
+def test_reload_applies_changed_sections(tmp_path):
+    """Test that only the sections that changed reach their subscribers"""
+    path = write(tmp_path / "config.yml", "limits:\n  max_concurrency: 8\nchroma:\n  idle_ttl: 600\n")
+    config = ReloadableConfig(path)
+    changes = []
+    config.on_change("limits", lambda new, old: changes.append(("limits", new, old)))
+    config.on_change("chroma", lambda new, old: changes.append(("chroma", new, old)))
+
+    write(tmp_path / "config.yml", "limits:\n  max_concurrency: 4\nchroma:\n  idle_ttl: 600\n")
+    assert config.reload() == ["limits"]
+    assert changes == [("limits", {"max_concurrency": 4}, {"max_concurrency": 8})]
+    assert config.section("limits") == {"max_concurrency": 4}
+    assert config.reload() == []
+
+def test_invalid_file_and_failing_subscriber_keep_old_settings(tmp_path):
+    """Test that a bad file or a change that fails to apply leaves settings as they were"""
+    path = write(tmp_path / "config.yml", "llm:\n  rpm: 500\ntokenizer:\n  memo_size: 10\n")
+    config = ReloadableConfig(path)
+
+    @config.on_change("llm")
+    def fail(new, old):
+        raise RuntimeError("provider unreachable")
+
+    write(tmp_path / "config.yml", "llm: [not, a, mapping\n")
+    assert config.reload() == []
+    assert config.section("llm") == {"rpm": 500}
+
+    write(tmp_path / "config.yml", "llm:\n  rpm: 100\ntokenizer:\n  memo_size: 20\n")
+    assert config.reload() == ["tokenizer"]
+    assert config.section("llm") == {"rpm": 500}
+    assert config.section("tokenizer") == {"memo_size": 20}
+    assert config.stats()["failures"] == 2
+
+def test_environment_overrides_file(monkeypatch):
+    """Test that a set environment variable wins over the file, an empty one does not"""
+    section = {"rpm": 100}
+    monkeypatch.setenv("WHISK_LLM_RPM", "50")
+    assert setting(section, "rpm", "WHISK_LLM_RPM", 500.0, float) == 50.0
+    monkeypatch.setenv("WHISK_LLM_RPM", "")
+    assert setting(section, "rpm", "WHISK_LLM_RPM", 500.0, float) == 100.0
+    assert setting({}, "rpm", "WHISK_LLM_RPM", 500.0, float) == 500.0
+
+@pytest.mark.asyncio
+async def test_watch_reloads_modified_file(tmp_path):
+    """Test that polling picks up an edited file"""
+    path = write(tmp_path / "config.yml", "limits:\n  max_pending: 32\n")
+    config = ReloadableConfig(path)
+    write(tmp_path / "config.yml", "limits:\n  max_pending: 16\n")
+    os.utime(path, (0, 0))
+
+    config.start(interval=0.01)
+    await asyncio.sleep(0.1)
+    config._task.cancel()
+    assert config.section("limits") == {"max_pending": 16}
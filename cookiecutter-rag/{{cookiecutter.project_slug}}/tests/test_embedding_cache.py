@@ -0,0 +1,93 @@
+import pytest
+from typing import List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from app.utils.embedding_cache import CachedEmbedding, EmbeddingCache
+
+class LengthEmbedding(BaseEmbedding):
+    """Embeds a text as its length and first character, counting the texts sent"""
+
+    embedded: int = 0
+
+    def _vector(self, text: str) -> List[float]:
+        self.embedded += 1
+        return [float(len(text)), float(ord(text[0]))]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+@pytest.fixture
+def cache(tmp_path):
+    """Embedding cache in a temporary directory"""
+    return EmbeddingCache(str(tmp_path))
+
+@pytest.mark.asyncio
+async def test_repeated_texts_are_embedded_once(cache):
+    """Test that only cache misses reach the wrapped model"""
+    model = LengthEmbedding(model_name="length")
+    cached = CachedEmbedding(model, cache=cache)
+
+    first = await cached.aget_text_embedding_batch(["header", "body one", "header"])
+    second = await cached.aget_text_embedding_batch(["header", "body two"])
+
+    assert first == [[6.0, 104.0], [8.0, 98.0], [6.0, 104.0]]
+    assert second == [[6.0, 104.0], [8.0, 98.0]]
+    assert model.embedded == 3
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["entries"] == 3
+
+@pytest.mark.asyncio
+async def test_cache_persists_and_separates_queries(cache, tmp_path):
+    """Test that vectors survive a restart and queries are keyed apart from texts"""
+    await CachedEmbedding(LengthEmbedding(model_name="length"), cache=cache).aget_text_embedding_batch(["policy"])
+
+    model = LengthEmbedding(model_name="length")
+    reopened = CachedEmbedding(model, cache=EmbeddingCache(str(tmp_path)))
+
+    assert await reopened.aget_text_embedding("policy") == [6.0, 112.0]
+    assert model.embedded == 0
+    assert await reopened.aget_query_embedding("policy") == [6.0, 112.0]
+    assert model.embedded == 1
+
+def test_models_do_not_share_vectors(cache):
+    """Test that another model name misses the cache"""
+    CachedEmbedding(LengthEmbedding(model_name="small"), cache=cache).get_text_embedding("text")
+    model = LengthEmbedding(model_name="large")
+
+    CachedEmbedding(model, cache=cache).get_text_embedding("text")
+
+    assert model.embedded == 1
+
+def test_torn_append_is_repaired(cache, tmp_path):
+    """Test that a partial index record left by a crash is dropped on open"""
+    CachedEmbedding(LengthEmbedding(model_name="length"), cache=cache).get_text_embedding_batch(["a", "bb"])
+    index = next(tmp_path.glob("*.idx"))
+    with open(index, "ab") as f:
+        f.write(b"torn")
+
+    reopened = EmbeddingCache(str(tmp_path))
+    model = LengthEmbedding(model_name="length")
+
+    assert CachedEmbedding(model, cache=reopened).get_text_embedding_batch(["bb", "c"]) == [[2.0, 98.0], [1.0, 99.0]]
+    assert model.embedded == 1
+    assert reopened.stats()["entries"] == 3
+
+def test_orphan_vectors_are_cut_at_the_recorded_dimension(cache, tmp_path):
+    """Test that vectors appended without index entries do not skew the rows"""
+    texts = [f"text {i}" for i in range(10)]
+    expected = CachedEmbedding(LengthEmbedding(model_name="length"), cache=cache).get_text_embedding_batch(texts)
+    data = next(tmp_path.glob("*.f32"))
+    with open(data, "ab") as f:
+        f.write(b"\0" * 5 * 2 * 4)
+
+    reopened = EmbeddingCache(str(tmp_path))
+    model = LengthEmbedding(model_name="length")
+
+    assert CachedEmbedding(model, cache=reopened).get_text_embedding_batch(texts) == expected
+    assert model.embedded == 0
+    assert data.stat().st_size == 10 * 2 * 4
@@ -0,0 +1,84 @@
+import pytest
+from llama_index.core import Settings
+from llama_index.core.schema import TextNode
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema
+from app.handlers import query
+from app.utils.filter_planner import plan_filters, metadata_to_where, ExactScanRetriever
+from app.utils.prompts import static_prompt
+from app.utils.token_counter import create_token_counter
+from benchmarks.fakes import FakeEmbedding, FakeLLM
+
+@pytest.fixture
+def populated_store(vector_store):
+    """Vector store with one rare and many common chunks"""
+    nodes = [
+        TextNode(text="rare chunk", metadata={"source": "rare"}, embedding=[1.0, 0.0, 0.0])
+    ] + [
+        TextNode(text=f"common chunk {i}", metadata={"source": "common"}, embedding=[0.0, 1.0, float(i)])
+        for i in range(20)
+    ]
+    vector_store.add(nodes)
+    return vector_store
+
+def test_metadata_to_where():
+    """Test conversion of metadata to Chroma where clauses"""
+    assert metadata_to_where({"source": "docs"}) == {"source": {"$eq": "docs"}}
+    assert metadata_to_where({"source": "docs", "type": "pdf"}) == {
+        "$and": [{"source": {"$eq": "docs"}}, {"type": {"$eq": "pdf"}}]
+    }
+
+def test_selective_filter_uses_exact_scan(populated_store):
+    """Test that selective filters switch to an exact scan"""
+    plan = plan_filters(populated_store, {"source": "rare"}, exact_scan_limit=5)
+
+    assert plan.strategy == "exact"
+    assert plan.match_count == 1
+    assert plan.total_count == 21
+    assert len(plan.node_ids) == 1
+
+def test_broad_filter_uses_ann(populated_store):
+    """Test that broad filters keep the ANN path"""
+    plan = plan_filters(populated_store, {"source": "common"}, exact_scan_limit=5)
+
+    assert plan.strategy == "ann"
+    assert plan.node_ids == []
+
+def test_exact_scan_ranks_matching_nodes(populated_store):
+    """Test that the exact scan returns the closest matching chunks"""
+    plan = plan_filters(populated_store, {"source": "common"}, exact_scan_limit=50)
+    retriever = ExactScanRetriever(populated_store, plan.node_ids, similarity_top_k=2)
+
+    results = retriever._scan([0.0, 1.0, 3.1])
+
+    assert [result.node.text for result in results] == ["common chunk 3", "common chunk 4"]
+    assert results[0].score == pytest.approx(0.99, abs=1e-3)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source", ["rare", "common"])
+async def test_filtered_queries_send_the_system_prompt(vector_store, monkeypatch, source):
+    """Test that the exact scan and filtered ANN paths both lead with the system prompt"""
+    embed_model = FakeEmbedding(latency=0.0)
+    monkeypatch.setattr(Settings, "embed_model", embed_model)
+    monkeypatch.setattr(query, "count_tokens", lambda text, exact=None: len(text.split()))
+    monkeypatch.setattr(query, "create_token_counter", lambda exact=None: create_token_counter(exact=False))
+    monkeypatch.setattr(query, "plan_filters", lambda store, metadata, **kwargs: plan_filters(store, metadata, exact_scan_limit=5, **kwargs))
+    vector_store.add([
+        TextNode(text=f"{name} chunk {i}", metadata={"source": name}, embedding=embed_model._vector(f"{name} {i}"))
+        for name, count in (("rare", 1), ("common", 20))
+        for i in range(count)
+    ])
+    prompts = []
+
+    def reply(prompt: str) -> str:
+        prompts.append(prompt)
+        return "an answer"
+
+    request = WhiskQuerySchema(query=f"{source} chunk", label="query", metadata={"source": source})
+    response = await query.query_handler(
+        request, llm=FakeLLM(latency=0.0, reply=reply), vector_store=vector_store,
+        system_prompt=static_prompt("Answer like a pirate.")
+    )
+
+    assert response.output == "an answer"
+    assert response.metadata["filter_plan"]["strategy"] == ("exact" if source == "rare" else "ann")
+    assert prompts and prompts[0].startswith("system: Answer like a pirate.")
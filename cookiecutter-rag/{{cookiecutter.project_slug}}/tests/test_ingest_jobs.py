@@ -0,0 +1,114 @@
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import Document, TextNode
+from app.handlers import storage
+from app.utils.chunking import create_splitter
+from app.utils.ingest_jobs import IngestJobs
+
+class PassThrough:
+    """Extractor stand-in that needs no LLM"""
+
+    async def acall(self, nodes):
+        return nodes
+
+class FlakyStore:
+    """Vector store whose ``add`` fails once on the given call"""
+
+    def __init__(self, vector_store, fail_on: int):
+        self.client = vector_store.client
+        self.vector_store = vector_store
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def add(self, nodes):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise TimeoutError("upsert timed out")
+        return self.vector_store.add(nodes)
+
+@pytest.fixture
+def jobs(tmp_path):
+    """Job store persisted in a temporary directory"""
+    jobs = IngestJobs()
+    jobs.configure(str(tmp_path))
+    return jobs
+
+def test_failed_job_resumes_from_checkpoint(jobs):
+    """Test that a retry of the same file picks up its checkpoints"""
+    job = jobs.begin("docs", "1", "abc")
+    jobs.save(job, 0, "embed", [TextNode(text="chunk", embedding=[1.0, 0.0])])
+    jobs.fail(job, "timeout")
+
+    resumed = jobs.begin("docs", "1", "abc")
+    stage, nodes = jobs.load(resumed, 0)
+
+    assert resumed.resumed
+    assert stage == "embed"
+    assert nodes[0].embedding == [1.0, 0.0]
+    assert jobs.status("docs", "1")["status"] == "running"
+
+def test_changed_or_finished_file_starts_over(jobs):
+    """Test that a new fingerprint or a completed job gets a fresh job"""
+    job = jobs.begin("docs", "1", "abc")
+    jobs.save(job, 0, "parse", [Document(text="v1")])
+
+    assert not jobs.begin("docs", "1", "def").resumed
+    assert jobs.load(jobs.begin("docs", "1", "def"), 0) is None
+
+    jobs.complete(jobs.begin("docs", "1", "def"))
+    assert not jobs.begin("docs", "1", "def").resumed
+
+@pytest.mark.asyncio
+async def test_ingest_resumes_after_failed_batch(jobs, vector_store, monkeypatch):
+    """Test that a retry only redoes the batch that failed"""
+    monkeypatch.setattr(storage, "ingest_jobs", jobs)
+    monkeypatch.setattr(storage, "BATCH_DOCUMENTS", 2)
+    monkeypatch.setattr(storage, "create_splitter", lambda: create_splitter(exact=False))
+    monkeypatch.setattr(storage, "TitleExtractor", PassThrough)
+    monkeypatch.setattr(storage, "QuestionsAnsweredExtractor", PassThrough)
+    monkeypatch.setattr(Settings, "embed_model", MockEmbedding(embed_dim=2))
+    documents = [Document(text=f"document {i}") for i in range(5)]
+    store = FlakyStore(vector_store, fail_on=2)
+
+    job = jobs.begin(vector_store.client.name, "7", "abc")
+    with pytest.raises(TimeoutError):
+        await storage.ingest(iter(documents), store, job)
+    jobs.fail(job, "timeout")
+
+    retry = jobs.begin(vector_store.client.name, "7", "abc")
+    await storage.ingest(iter(documents[retry.documents:]), store, retry)
+
+    assert retry.documents == 5
+    assert retry.batches_stored == 3
+    assert store.calls == 4
+    assert vector_store.client.count() == 5
+    assert jobs.stats()["stages_skipped"] == 4
+
+@pytest.mark.asyncio
+async def test_ingest_never_reparses_whole_files(jobs, vector_store, monkeypatch):
+    """Test that a retry of a file parsed whole reads its parse checkpoints"""
+    monkeypatch.setattr(storage, "ingest_jobs", jobs)
+    monkeypatch.setattr(storage, "BATCH_DOCUMENTS", 2)
+    monkeypatch.setattr(storage, "create_splitter", lambda: create_splitter(exact=False))
+    monkeypatch.setattr(storage, "TitleExtractor", PassThrough)
+    monkeypatch.setattr(storage, "QuestionsAnsweredExtractor", PassThrough)
+    monkeypatch.setattr(Settings, "embed_model", MockEmbedding(embed_dim=2))
+    documents = [Document(text=f"document {i}") for i in range(5)]
+    store = FlakyStore(vector_store, fail_on=2)
+
+    job = jobs.begin(vector_store.client.name, "8", "abc")
+    with pytest.raises(TimeoutError):
+        await storage.ingest(iter(documents), store, job, parsed_whole=True)
+    jobs.fail(job, "timeout")
+
+    def reparse():
+        raise AssertionError("file parsed again")
+        yield
+
+    retry = jobs.begin(vector_store.client.name, "8", "abc")
+    assert retry.parsed_all
+    await storage.ingest(reparse(), store, retry, parsed_whole=True)
+
+    assert retry.batches_stored == 3
+    assert vector_store.client.count() == 5
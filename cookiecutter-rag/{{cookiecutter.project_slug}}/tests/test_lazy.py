@@ -0,0 +1,46 @@
+import pytest
+from app.utils.lazy import LazyDependency, lazy_handler, resolve
+from app.utils.token_counter import get_encoding, create_token_counter, tokenizers
+
+def test_lazy_dependency_builds_once():
+    """Test that the factory runs on first use only"""
+    calls = []
+    dependency = LazyDependency(lambda: calls.append(1) or "llm")
+
+    assert not dependency.loaded
+    assert resolve(dependency) == "llm"
+    assert resolve(dependency) == "llm"
+    assert calls == [1]
+    assert resolve("plain") == "plain"
+
+async def echo_handler(data, llm=None):
+    return data, llm
+
+@pytest.mark.asyncio
+async def test_lazy_handler_resolves_dependencies():
+    """Test that lazy handlers import on call and receive built dependencies"""
+    handler = lazy_handler(__name__, "echo_handler")
+
+    assert handler.__name__ == "echo_handler"
+    assert await handler("query", llm=LazyDependency(lambda: "llm")) == ("query", "llm")
+
+def test_token_counters_share_one_encoding():
+    """Test that the tiktoken encoding is loaded once per process"""
+    create_token_counter()
+    create_token_counter()
+
+    assert get_encoding() is get_encoding()
+    assert tokenizers.stats()["encodings"] == 1
+
+def test_reload_swaps_only_built_dependencies():
+    """Test that reloading keeps the old object when the new one fails to build"""
+    dependency = LazyDependency(lambda: "old")
+    dependency.reload(lambda: "unused")
+    assert not dependency.loaded
+
+    assert dependency.get() == "old"
+    with pytest.raises(RuntimeError):
+        dependency.reload(lambda: (_ for _ in ()).throw(RuntimeError("bad key")))
+    assert dependency.get() == "old"
+    dependency.reload(lambda: "new")
+    assert dependency.get() == "new"
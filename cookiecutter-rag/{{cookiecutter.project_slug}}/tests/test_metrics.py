@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from app.utils.metrics import MetricsRegistry, instrument, metrics, record_stage, stage
+from whisk.kitchenai_sdk.schema import (
+    WhiskQuerySchema,
+    WhiskQueryBaseResponseSchema,
+    TokenCountSchema
+)
+
+async def fake_query_handler(data, **kwargs):
+    with stage("retrieve"):
+        # Recorded by the enclosing stage only, not twice
+        record_stage("retrieve", 1.0)
+        await asyncio.sleep(0.01)
+    with stage("synthesize"):
+        await asyncio.sleep(0.02)
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output="answer",
+        metadata={"source": "docs"},
+        token_counts=TokenCountSchema()
+    )
+
+@pytest.mark.asyncio
+async def test_instrument_adds_stage_timings_to_metadata():
+    """Test that per-stage timings are returned in the response metadata"""
+    handler = instrument("test_query", fake_query_handler)
+    response = await handler(WhiskQuerySchema(query="q", label="query"))
+
+    timings = response.metadata["timings"]
+    assert response.metadata["source"] == "docs"
+    assert 10 <= timings["retrieve_ms"] < 1000
+    assert timings["synthesize_ms"] >= 20
+    assert timings["total_ms"] >= timings["retrieve_ms"] + timings["synthesize_ms"]
+
+    text = metrics.render()
+    assert 'whisk_requests_total{handler="test_query",status="ok"} 1' in text
+    assert 'whisk_stage_seconds_count{handler="test_query",stage="retrieve"} 1' in text
+
+def test_registry_renders_prometheus_text():
+    """Test histogram buckets, counters and gauges in the text format"""
+    registry = MetricsRegistry()
+    registry.observe("latency_seconds", 0.02, help="Latency", handler="query")
+    registry.observe("latency_seconds", 3.0, help="Latency", handler="query")
+    registry.inc("requests_total", help="Requests", handler="query")
+    registry.register_gauges("queue", lambda: {"active": 2, "closed": False, "note": "x"})
+
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{handler="query",le="0.025"} 1' in text
+    assert 'latency_seconds_bucket{handler="query",le="+Inf"} 2' in text
+    assert 'latency_seconds_count{handler="query"} 2' in text
+    assert 'requests_total{handler="query"} 1' in text
+    assert "queue_active 2.0" in text
+    assert "queue_note" not in text
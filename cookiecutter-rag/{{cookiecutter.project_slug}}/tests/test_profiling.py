@@ -0,0 +1,68 @@
+import json
+import os
+import pytest
+from app.utils.profiling import profiled
+from whisk.kitchenai_sdk.schema import (
+    WhiskQuerySchema,
+    WhiskQueryBaseResponseSchema,
+    TokenCountSchema
+)
+
+async def echo_handler(data, **kwargs):
+    # Allocate and burn some CPU so the profile has content
+    blocks = [bytearray(1024) for _ in range(1000)]
+    sum(i * i for i in range(20000))
+    return WhiskQueryBaseResponseSchema(
+        input=data.query,
+        output=str(len(blocks)),
+        metadata=dict(data.metadata or {}),
+        token_counts=TokenCountSchema()
+    )
+
+@pytest.mark.asyncio
+async def test_profile_requested_through_metadata(tmp_path):
+    """Test that a flagged request writes CPU and allocation profiles"""
+    handler = profiled(echo_handler, output_dir=str(tmp_path), interval=0.001)
+    request = WhiskQuerySchema(
+        query="q", label="query", metadata={"profile": "true", "request_id": "abc", "source": "docs"}
+    )
+
+    response = await handler(request)
+
+    path = response.metadata["profile_path"]
+    assert path == os.path.join(str(tmp_path), "query-abc")
+    assert "profile" not in response.metadata
+    assert response.metadata["source"] == "docs"
+    assert sorted(os.listdir(path)) == [
+        "allocations.snapshot", "allocations.txt", "cpu.folded", "summary.json"
+    ]
+    with open(os.path.join(path, "summary.json")) as f:
+        summary = json.load(f)
+    assert summary["samples"] > 0
+    assert summary["peak_traced_mb"] > 0.5
+
+@pytest.mark.asyncio
+async def test_unflagged_requests_are_not_profiled(tmp_path):
+    """Test that profiling stays off without the flag or a sampling rate"""
+    handler = profiled(echo_handler, output_dir=str(tmp_path))
+    response = await handler(WhiskQuerySchema(query="q", label="query", metadata={"source": "docs"}))
+
+    assert "profile_path" not in response.metadata
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.asyncio
+async def test_profile_path_stays_in_output_dir(tmp_path):
+    """Test that request ids and labels cannot steer the profile out of its directory"""
+    output_dir = tmp_path / "profiles"
+    handler = profiled(echo_handler, output_dir=str(output_dir), interval=0.001)
+    request = WhiskQuerySchema(
+        query="q", label="../query", metadata={"profile": "true", "request_id": "../../escaped"}
+    )
+
+    response = await handler(request)
+
+    path = response.metadata["profile_path"]
+    assert os.path.dirname(path) == str(output_dir)
+    assert os.listdir(tmp_path) == ["profiles"]
+    assert os.listdir(output_dir) == [os.path.basename(path)]
+    assert ".." not in os.path.basename(path)
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from llama_index.core import Settings
+from llama_index.core.callbacks import TokenCountingHandler
+from llama_index.core.schema import TextNode
+from whisk.kitchenai_sdk.schema import TokenCountSchema, WhiskQueryBaseResponseSchema, WhiskQuerySchema
+
+from app.handlers import query
+from app.utils.single_flight import SingleFlight, flight_key
+from app.utils.token_counter import create_token_counter
+from benchmarks.fakes import FakeEmbedding, FakeLLM
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_execution():
+    """Test that concurrent requests with one key run the work once"""
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+
+    assert calls == 1
+    assert [result for result, _, _ in results] == ["answer"] * 5
+    assert sum(leader for _, leader, _ in results) == 1
+    assert {shared_by for _, _, shared_by in results} == {5}
+    assert flights.stats() == {"in_flight": 0, "executions": 1, "coalesced": 4}
+
+    # Finished executions are not reused
+    await flights.do("key", work)
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_cancellation_needs_every_waiter():
+    """Test that all waiters see the error, and one cancelled waiter does not stop the work"""
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("model unavailable")
+
+    results = await asyncio.gather(*(flights.do("bad", failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.create_task(flights.do("slow", slow))
+    second = asyncio.create_task(flights.do("slow", slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert (await second)[0] == "done"
+
+def test_key_normalizes_whitespace_and_keeps_filters_apart():
+    """Test that the key ignores whitespace but not label or metadata"""
+    key = flight_key("query", "What is  RAG?", {"source": "docs"})
+
+    assert key == flight_key("query", " What is RAG? ", {"source": "docs"})
+    assert key != flight_key("query", "What is RAG?", {"source": "blog"})
+    assert key != flight_key("other", "What is RAG?", {"source": "docs"})
+
+@pytest.mark.asyncio
+async def test_query_handler_bills_tokens_once(monkeypatch):
+    """Test that coalesced queries report the tokens only on the request that ran it"""
+    calls = 0
+
+    async def answer_query(data, llm, vector_store, system_prompt):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        counts = TokenCountSchema(llm_prompt_tokens=90, llm_completion_tokens=10, total_llm_tokens=100)
+        response = WhiskQueryBaseResponseSchema(
+            input=data.query, output="42", metadata={"token_counts": counts.dict()}, token_counts=counts
+        )
+        return response, counts.dict()
+
+    monkeypatch.setattr(query, "answer_query", answer_query)
+    request = WhiskQuerySchema(query="What is the meaning of life?", label="query")
+
+    responses = await asyncio.gather(*(query.query_handler(request) for _ in range(3)))
+
+    assert calls == 1
+    assert [response.output for response in responses] == ["42"] * 3
+    assert sum(response.token_counts.total_llm_tokens for response in responses) == 100
+    followers = [response for response in responses if not response.metadata["single_flight"]["leader"]]
+    assert len(followers) == 2
+    assert followers[0].metadata["single_flight"]["shared_by"] == 3
+    assert followers[0].metadata["single_flight"]["token_counts"]["total_llm_tokens"] == 100
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_count_their_own_tokens(vector_store, monkeypatch):
+    """Test that overlapping queries do not add to or reset each other's counts"""
+    embed_model = FakeEmbedding(latency=0.0)
+    monkeypatch.setattr(Settings, "embed_model", embed_model)
+    monkeypatch.setattr(query, "count_tokens", lambda text, exact=None: len(text.split()))
+    monkeypatch.setattr(query, "create_token_counter", lambda exact=None: create_token_counter(exact=False))
+    vector_store.add([
+        TextNode(text=f"chunk {i}", embedding=embed_model._vector(f"chunk {i}")) for i in range(4)
+    ])
+    llm = FakeLLM(latency=0.02, completion_tokens=16)
+
+    async def ask(question: str):
+        request = WhiskQuerySchema(query=question, label="query")
+        return (await query.query_handler(request, llm=llm, vector_store=vector_store)).token_counts
+
+    questions = [f"which chunk comes {place}" for place in ("first", "second", "last")]
+    alone = [await ask(question) for question in questions]
+    together = await asyncio.gather(*(ask(question) for question in questions))
+
+    assert all(counts.total_llm_tokens > 0 for counts in alone)
+    assert together == alone
+    # The shared LLM is never pointed at a query's counter
+    assert not any(isinstance(handler, TokenCountingHandler) for handler in llm.callback_manager.handlers)
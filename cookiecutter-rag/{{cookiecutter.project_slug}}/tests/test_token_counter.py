@@ -0,0 +1,53 @@
+from llama_index.core.node_parser import TokenTextSplitter
+from app.utils.token_counter import TokenizerRegistry, count_tokens, lazy_tokenizer
+from app.utils.token_estimate import estimate_tokens, token_features
+
+def test_estimate_tokens_counts_byte_classes():
+    """Test that the estimate is built from word starts and byte classes"""
+    assert token_features("Hi there, 42 é").tolist() == [4, 7, 2, 1, 2]
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("The quick brown fox jumps over the lazy dog.") == 10
+    assert count_tokens("Hello", exact=False) == 1
+
+def test_approximate_tokenizer_splits_text():
+    """Test that the splitter can size chunks from estimates alone"""
+    tokenizer = lazy_tokenizer(exact=False)
+    text = " ".join(f"word{i}" for i in range(2000))
+
+    chunks = TokenTextSplitter(chunk_size=256, chunk_overlap=0, tokenizer=tokenizer).split_text(text)
+
+    assert isinstance(tokenizer(text), range)
+    assert len(chunks) > 1
+    assert all(len(tokenizer(chunk)) <= 256 for chunk in chunks)
+
+class WordEncoding:
+    calls = 0
+
+    def encode(self, text: str) -> list:
+        self.calls += 1
+        return text.split()
+
+def test_tokenizer_registry_shares_encodings():
+    """Test that models with the same encoding share one load"""
+    registry = TokenizerRegistry()
+    encoding = WordEncoding()
+    registry.register("gpt-3.5-turbo", encoding, name=registry.encoding_name("gpt-3.5-turbo"))
+
+    assert registry.encoding("gpt-4") is encoding
+
+def test_tokenizer_registry_memoizes_counts():
+    """Test that repeated texts are tokenized once and the memo stays bounded"""
+    registry = TokenizerRegistry(memo_size=2, memo_max_chars=100)
+    encoding = WordEncoding()
+    registry.register("words", encoding)
+
+    assert registry.count("to be or not to be", "words") == 6
+    assert registry.count("to be or not to be", "words") == 6
+    assert encoding.calls == 1
+
+    registry.count("a", "words")
+    registry.count("b", "words")
+    registry.count("word " * 50, "words")
+    stats = registry.stats()
+    assert stats["memo_entries"] == 2
+    assert stats["memo_hits"] == 1
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from whisk.kitchenai_sdk.schema import WhiskQuerySchema
+from app.handlers import nodes as nodes_module
+from app.utils.filter_planner import batch_search, plan_filters
+from app.utils.tombstones import DeletePipeline, FILE_ID_KEY
+
+@pytest.fixture
+def pipeline():
+    """Fresh in-memory delete pipeline"""
+    return DeletePipeline(batch_size=10, interval=0.01)
+
+@pytest.fixture
+def stored_files(vector_store):
+    """Vector store with chunks from two files"""
+    vector_store.add([
+        TextNode(text=f"file {file_id} chunk {i}", metadata={FILE_ID_KEY: file_id}, embedding=[1.0, float(i)])
+        for file_id in ("1", "2")
+        for i in range(3)
+    ])
+    return vector_store
+
+@pytest.mark.asyncio
+async def test_delete_hides_then_compacts(pipeline, stored_files):
+    """Test that deletes are hidden at once and purged by compaction"""
+    pipeline.delete(stored_files, "1")
+
+    assert pipeline.hidden(stored_files) == {"1"}
+    assert pipeline.metrics()["tombstone_backlog"] == 1
+    assert stored_files.client.count() == 6
+
+    assert await pipeline.compact_once() == 1
+
+    assert pipeline.hidden(stored_files) == set()
+    assert stored_files.client.count() == 3
+    metrics = pipeline.metrics()
+    assert metrics["tombstone_backlog"] == 0
+    assert metrics["compacted_total"] == 1
+
+@pytest.mark.asyncio
+async def test_repeated_delete_is_idempotent(pipeline, stored_files):
+    """Test that tombstoning a file twice records one delete"""
+    pipeline.delete(stored_files, "2")
+    pipeline.delete(stored_files, "2")
+
+    assert pipeline.backlog() == 1
+
+@pytest.mark.asyncio
+async def test_flush_purges_pending_delete(pipeline, stored_files):
+    """Test that a re-ingested file is purged before it is written again"""
+    pipeline.delete(stored_files, "2")
+    await pipeline.flush(stored_files, "2")
+
+    assert pipeline.backlog() == 0
+    assert stored_files.client.count() == 3
+
+@pytest.mark.asyncio
+async def test_deleted_chunks_never_take_retrieval_slots(pipeline, stored_files, monkeypatch):
+    """Test that search, planning and node lookups skip tombstoned files before compaction"""
+    pipeline.delete(stored_files, "1")
+    hidden = pipeline.hidden(stored_files)
+
+    # File 1's chunks are the closest to the query, yet k results come from file 2
+    results = batch_search(stored_files, np.asarray([[1.0, 0.0]], dtype=np.float32), 3, hidden=hidden)
+    assert len(results[0]) == 3
+    assert all(node.node.metadata[FILE_ID_KEY] == "2" for node in results[0])
+
+    plan = plan_filters(stored_files, {FILE_ID_KEY: "1"}, hidden=hidden)
+    assert plan.strategy == "exact" and plan.node_ids == []
+
+    monkeypatch.setattr(nodes_module, "delete_pipeline", pipeline)
+    node_ids = stored_files.client.get(include=[])["ids"]
+    response = await nodes_module.nodes_handler(
+        WhiskQuerySchema(query="resolve", label="nodes", messages=node_ids), vector_store=stored_files
+    )
+    assert response.output == "Found 3 of 6 nodes"
+    assert all(node.metadata[FILE_ID_KEY] == "2" for node in response.retrieval_context)
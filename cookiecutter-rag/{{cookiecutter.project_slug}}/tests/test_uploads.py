@@ -0,0 +1,104 @@
+import pytest
+from whisk.kitchenai_sdk.schema import WhiskStorageResponseSchema, WhiskStorageSchema, WhiskStorageStatus
+from app.handlers import storage
+from app.utils.uploads import UploadSpool, document_metadata
+
+@pytest.fixture
+def spool(tmp_path):
+    """Upload spool in a temporary directory"""
+    return UploadSpool(str(tmp_path / "uploads"))
+
+def test_chunks_assemble_in_any_order(spool):
+    """Test that chunks are written at their offsets whatever the arrival order"""
+    chunks = [b"alpha ", b"beta ", b"gamma"]
+    offsets = [0, 6, 11]
+
+    received = [
+        spool.write_chunk("u1", "doc.txt", index, 3, offsets[index], chunks[index])
+        for index in (2, 0, 0, 1)
+    ]
+
+    assert received == [1, 2, 2, 3]
+    assert spool.path("u1", "doc.txt").read_bytes() == b"alpha beta gamma"
+    assert spool.stats()["bytes_received"] == 22
+
+def test_upload_is_claimed_once(spool):
+    """Test that only one caller ingests a completed upload"""
+    spool.write_chunk("u2", "doc.txt", 0, 1, 0, b"data")
+
+    assert spool.claim("u2")
+    assert not spool.claim("u2")
+    spool.release("u2")
+    assert spool.claim("u2")
+    spool.discard("u2")
+    assert not spool.path("u2", "doc.txt").exists()
+
+def test_invalid_upload_id_is_rejected(spool):
+    """Test that upload ids cannot escape the spool directory"""
+    with pytest.raises(ValueError):
+        spool.write_chunk("../escape", "doc.txt", 0, 1, 0, b"data")
+    with pytest.raises(ValueError):
+        spool.write_chunk("u3", "doc.txt", 1, 1, 0, b"data")
+
+@pytest.mark.parametrize("upload_id", [".", "..", ".hidden"])
+def test_dot_upload_ids_are_rejected(spool, tmp_path, upload_id):
+    """Test that dot ids cannot write to or remove the spool's parent"""
+    (tmp_path / "keep").touch()
+    with pytest.raises(ValueError):
+        spool.write_chunk(upload_id, "doc.txt", 0, 1, 0, b"data")
+    with pytest.raises(ValueError):
+        spool.discard(upload_id)
+    assert (tmp_path / "keep").exists()
+
+def test_symlinked_upload_dir_is_rejected(spool, tmp_path):
+    """Test that an upload directory resolving outside the spool is refused"""
+    spool.root.mkdir(parents=True)
+    (tmp_path / "outside").mkdir()
+    (spool.root / "u5").symlink_to(tmp_path / "outside")
+    with pytest.raises(ValueError):
+        spool.discard("u5")
+    assert (tmp_path / "outside").exists()
+
+@pytest.mark.asyncio
+async def test_upload_progress_is_reported_in_metadata(spool, monkeypatch):
+    """Test that chunk progress survives a client that publishes every response as COMPLETE"""
+    async def store_file(data, path, metadata, vector_store, token_counter):
+        return WhiskStorageResponseSchema(id=data.id, status=WhiskStorageStatus.COMPLETE, metadata={"file_name": data.name})
+
+    monkeypatch.setattr(storage, "upload_spool", spool)
+    monkeypatch.setattr(storage, "store_file", store_file)
+    chunks = [b"alpha ", b"beta"]
+
+    responses = [
+        await storage.store_chunk(WhiskStorageSchema(
+            id=1, name="doc.txt", label="storage", data=chunk,
+            metadata={"upload_id": "u6", "chunk_index": str(index), "chunk_count": "2", "chunk_offset": str(index * 6)}
+        ), {}, None, None)
+        for index, chunk in enumerate(chunks)
+    ]
+
+    assert [response.status for response in responses] == [WhiskStorageStatus.ACK, WhiskStorageStatus.COMPLETE]
+    assert responses[0].metadata == {"upload_id": "u6", "chunks_received": 1, "chunk_count": 2, "upload_status": "ack"}
+    assert responses[1].metadata == {
+        "file_name": "doc.txt", "upload_id": "u6", "chunks_received": 2, "chunk_count": 2, "upload_status": "complete"
+    }
+
+def test_chunk_keys_are_not_stored():
+    """Test that the chunking keys are dropped from document metadata"""
+    metadata = {"upload_id": "u4", "chunk_index": "0", "chunk_count": "2", "chunk_offset": "0", "source": "test"}
+
+    assert document_metadata(metadata) == {"source": "test"}
+
+def test_large_text_is_read_in_segments(tmp_path, monkeypatch):
+    """Test that large text files stream as line-aligned segments"""
+    monkeypatch.setattr(storage, "SEGMENT_BYTES", 64)
+    path = tmp_path / "notes.txt"
+    lines = [f"line {i} café\n" for i in range(40)]
+    path.write_text("".join(lines), encoding="utf-8")
+
+    documents = list(storage.iter_documents(path, {"source": "test"}))
+
+    assert len(documents) > 1
+    assert "".join(document.text for document in documents) == "".join(lines)
+    assert all(document.text.endswith("\n") for document in documents)
+    assert all(document.metadata == {"source": "test"} for document in documents)
@@ -0,0 +1,57 @@
+from app.dependencies.vector_store import (
+    setup_vector_store,
+    route_vector_store,
+    shard_collection_name,
+    ShardedVectorStore,
+    DEFAULT_COLLECTION
+)
+
+def test_unsharded_store_passes_through(vector_store):
+    """Test that an unsharded store is used as-is"""
+    store, metadata = route_vector_store(vector_store, {"source": "test"})
+
+    assert store is vector_store
+    assert metadata == {"source": "test"}
+
+def test_sharded_store_routes_by_tenant(temp_chroma_dir):
+    """Test routing to per-tenant collections"""
+    sharded = setup_vector_store(temp_chroma_dir, shard_key="tenant")
+    assert isinstance(sharded, ShardedVectorStore)
+
+    store_a, metadata = route_vector_store(sharded, {"tenant": "acme", "source": "test"})
+    store_b, _ = route_vector_store(sharded, {"tenant": "globex"})
+    default, _ = route_vector_store(sharded, None)
+
+    assert metadata == {"source": "test"}
+    assert store_a.client.name == shard_collection_name("acme")
+    assert store_b.client.name == shard_collection_name("globex")
+    assert default.client.name == DEFAULT_COLLECTION
+
+    # Handles are cached between requests
+    assert route_vector_store(sharded, {"tenant": "acme"})[0] is store_a
+
+def test_sharded_store_evicts_idle_handles(temp_chroma_dir):
+    """Test that idle and excess handles are closed"""
+    sharded = setup_vector_store(temp_chroma_dir, shard_key="tenant", max_open=2)
+
+    for tenant in ("one", "two", "three"):
+        sharded.route({"tenant": tenant})
+    assert sharded.open_shards() == [shard_collection_name("two"), shard_collection_name("three")]
+
+    sharded.idle_ttl = 0
+    sharded.route({"tenant": "one"})
+    assert sharded.open_shards() == [shard_collection_name("one")]
+
+def test_shard_collection_name_is_valid():
+    """Test that arbitrary tenant values map to valid collection names"""
+    assert shard_collection_name("acme corp").startswith("shard_acme_corp_")
+    long_name = shard_collection_name("x" * 200)
+    assert len(long_name) <= 63
+    assert long_name == shard_collection_name("x" * 200)
+
+def test_shard_collection_names_do_not_collide():
+    """Test that values which sanitize alike still get their own collection"""
+    values = ["acme.co", "acme_co", "acme-co_", "a/b", "a b", "a_b", "--", "__", "."]
+    names = [shard_collection_name(value) for value in values]
+    assert len(set(names)) == len(values)
+    assert all(3 <= len(name) <= 63 and name[-1].isalnum() for name in names)
@@ -0,0 +1,65 @@
+import pytest
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+from whisk.kitchenai_sdk.schema import TokenCountSchema, WhiskQuerySchema
+
+from app.handlers.nodes import nodes_handler
+from app.utils.wire import formatted, query_response, response_format
+
+def llama_response() -> Response:
+    nodes = [
+        NodeWithScore(node=TextNode(id_=f"node-{i}", text=f"chunk {i}", metadata={"source": "docs"}), score=0.9 - i / 10)
+        for i in range(3)
+    ]
+    return Response(
+        response="an answer",
+        source_nodes=nodes,
+        metadata={node.node.node_id: dict(node.node.metadata) for node in nodes}
+    )
+
+@pytest.mark.asyncio
+async def test_format_requested_through_metadata():
+    """Test that the format key selects the format and is kept out of the handler"""
+    counts = TokenCountSchema(embedding_tokens=3, llm_prompt_tokens=90, llm_completion_tokens=10, total_llm_tokens=100)
+
+    async def handler(data, **kwargs):
+        metadata = {"token_counts": {**counts.dict(), "prefix_tokens": 40}, **data.metadata}
+        return query_response(data, llama_response(), metadata, counts)
+
+    request = WhiskQuerySchema(query="q", label="query", metadata={"response_format": "compact", "source": "docs"})
+    compact = await response_format(handler)(request)
+
+    assert compact.retrieval_context is None
+    assert compact.metadata["retrieval_refs"] == {"ids": ["node-0", "node-1", "node-2"], "scores": [0.9, 0.8, 0.7]}
+    assert compact.metadata["token_counts"] == {"prefix_tokens": 40}
+    assert "response_format" not in compact.metadata and "node-0" not in compact.metadata
+    assert compact.token_counts == counts
+
+    full = await response_format(handler)(request.model_copy(update={"metadata": {"source": "docs"}}))
+    assert [node.text for node in full.retrieval_context] == ["chunk 0", "chunk 1", "chunk 2"]
+    assert full.metadata["token_counts"]["total_llm_tokens"] == 100
+
+@pytest.mark.asyncio
+async def test_nodes_handler_resolves_references(vector_store):
+    """Test that node ids from a compact response resolve to their chunks, in order"""
+    vector_store.add([
+        TextNode(id_=f"node-{i}", text=f"chunk {i}", metadata={"source": "docs"}, embedding=[float(i), 1.0])
+        for i in range(3)
+    ])
+    with formatted("compact"):
+        refs = query_response(
+            WhiskQuerySchema(query="q", label="query"), llama_response(), {}, TokenCountSchema()
+        ).metadata["retrieval_refs"]
+
+    request = WhiskQuerySchema(
+        query="resolve",
+        label="nodes",
+        messages=list(reversed(refs["ids"])) + ["node-missing"],
+        metadata={"scores": ",".join(map(str, reversed(refs["scores"]))) + ",0.1"}
+    )
+    response = await nodes_handler(request, vector_store=vector_store)
+
+    assert response.output == "Found 3 of 4 nodes"
+    assert [node.text for node in response.retrieval_context] == ["chunk 2", "chunk 1", "chunk 0"]
+    assert [node.score for node in response.retrieval_context] == [0.7, 0.8, 0.9]
+    assert response.retrieval_context[0].metadata["source"] == "docs"
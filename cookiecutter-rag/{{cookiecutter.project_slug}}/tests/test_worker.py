@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+
+import pytest
+from faststream.nats import TestNatsBroker
+from nats.aio.msg import Msg
+from whisk.client import WhiskClientError
+from whisk.kitchenai_sdk.kitchenai import KitchenAIApp
+from whisk.kitchenai_sdk.schema import WhiskQueryBaseResponseSchema
+
+from app.utils.concurrency import ConcurrencyLimiter, reject_query
+from app.worker import create_client, serve, subscriber_workers
+
+class FakeSubscription:
+    async def unsubscribe(self):
+        pass
+
+class FakeClient:
+    def __init__(self):
+        self.stopped = asyncio.Event()
+
+    async def run(self):
+        await self.stopped.wait()
+
+@pytest.mark.asyncio
+async def test_failed_startup_fails_the_worker():
+    """Test that an exception in startup stops the client instead of going unnoticed"""
+    async def startup():
+        raise ValueError("bad model name")
+
+    with pytest.raises(RuntimeError) as error:
+        await asyncio.wait_for(serve(FakeClient(), startup), timeout=1.0)
+    assert isinstance(error.value.__cause__, ValueError)
+
+@pytest.mark.asyncio
+async def test_startup_runs_alongside_the_client():
+    """Test that the client keeps serving after a successful startup"""
+    client = FakeClient()
+    started = asyncio.Event()
+
+    async def startup():
+        started.set()
+
+    serving = asyncio.create_task(serve(client, startup))
+    await asyncio.wait_for(started.wait(), timeout=1.0)
+    assert not serving.done()
+    client.stopped.set()
+    await asyncio.wait_for(serving, timeout=1.0)
+
+@pytest.mark.asyncio
+async def test_subscriber_delivers_to_the_limiter_concurrently():
+    """Test that messages delivered one by one, as nats-py does, run and queue in the limiter"""
+    limiter = ConcurrencyLimiter(max_concurrency=2, max_pending=1)
+    kitchen = KitchenAIApp(namespace="test")
+    running, peak, finished = 0, 0, []
+
+    async def handler(data, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        finished.append(data.query)
+        return WhiskQueryBaseResponseSchema(input=data.query, output="ok")
+
+    kitchen.query.handler("query")(limiter.limit(handler, reject_query))
+    try:
+        client = create_client(kitchen, {"client_id": "test"}, max_workers=subscriber_workers(limiter))
+    except WhiskClientError as error:
+        pytest.skip(f"WhiskClient does not support the installed FastStream: {error}")
+
+    async with TestNatsBroker(client.broker):
+        # Subscribe the real concurrent subscriber and keep the callback nats-py would call
+        callbacks = []
+
+        async def subscribe(subject, queue, cb, **kwargs):
+            callbacks.append(cb)
+            return FakeSubscription()
+
+        subscriber = client.subscribers["query"]
+        subscriber.connection.subscribe = subscribe
+        subscriber.subscription = None
+        await subscriber.start()
+
+        for index in range(5):
+            body = {
+                "request_id": str(index), "timestamp": time.time(), "label": "query",
+                "client_id": "test", "query": f"question {index}", "metadata": {}
+            }
+            await callbacks[0](Msg(_client=None, subject="kitchenai.service.test.query.query", data=json.dumps(body).encode()))
+        await asyncio.sleep(0.3)
+        await subscriber.stop()
+
+    assert peak == 2
+    assert len(finished) == 3
+    assert limiter.rejected == 2
@@ -3,15 +3,16 @@ from whisk.kitchenai_sdk.schema import (
     WhiskQueryBaseResponseSchema,
     TokenCountSchema
 )
-from llama_index.core.callbacks import TokenCountingHandler
 from typing import List, Dict, Any, Optional
-import tiktoken
+import functools
 import json
 import re
 
-token_counter = TokenCountingHandler(
-    tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-)
+from ..dependencies.llm import complete_chat
+from ..utils.conversation import Conversation
+from ..utils.metrics import stage
+from ..utils.prompts import StaticPrompt, compile_prompt
+from ..utils.token_counter import create_token_counter
 
 class Tool:
     def __init__(self, name: str, description: str, func: callable):
@@ -54,6 +55,24 @@ TOOLS = {
     )
 }
 
+@functools.lru_cache(maxsize=8)
+def react_system_prompt(system_prompt: str) -> StaticPrompt:
+    """System prompt followed by the tool descriptions, built and tokenized
+    once per system prompt rather than for every new conversation"""
+    tool_descriptions = "\n".join([
+        f"- {name}: {tool.description}"
+        for name, tool in TOOLS.items()
+    ])
+    return compile_prompt(
+        f"{system_prompt}\n\n"
+        f"Available tools:\n{tool_descriptions}\n\n"
+        "To use a tool, respond with:\n"
+        "Thought: what you're thinking\n"
+        "Action: tool_name\n"
+        "Input: tool input\n\n"
+        "After using a tool, I'll show you the result and you can continue thinking."
+    )
+
 def parse_tool_call(text: str) -> Optional[Dict[str, Any]]:
     """Parse tool calls from text using regex"""
     pattern = r"Action: (\w+)\nInput: (.+)"
@@ -83,33 +102,24 @@ async def react_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
         WhiskQueryBaseResponseSchema: Response containing:
             - input (str): Original message
             - output (str): Generated response
-            - metadata (dict): Response metadata including tool usage
+            - metadata (dict): Response metadata including tool usage, the
+              per-stage timings (llm, tools) in milliseconds and the static
+              prompt prefix tokens in the token counts
             - token_counts (TokenCountSchema): Token usage stats
             - messages (list): Updated chat history
     """
     try:
-        # Prepare chat history
-        messages = data.messages or []
-        
-        # Add system prompt with tool descriptions
-        if not messages:
-            tool_descriptions = "\n".join([
-                f"- {name}: {tool.description}"
-                for name, tool in TOOLS.items()
-            ])
-            system_message = (
-                f"{system_prompt}\n\n"
-                f"Available tools:\n{tool_descriptions}\n\n"
-                "To use a tool, respond with:\n"
-                "Thought: what you're thinking\n"
-                "Action: tool_name\n"
-                "Input: tool input\n\n"
-                "After using a tool, I'll show you the result and you can continue thinking."
-            )
-            messages.append({"role": "system", "content": system_message})
+        # Each request counts its own tokens; counts are reported to
+        # callers, so they are always exact
+        token_counter = create_token_counter(exact=True)
+
+        # Build on the chat history without copying or modifying it; the
+        # system prompt with tool descriptions leads unless the history
+        # already has one
+        messages = Conversation(data.messages, system_prompt=react_system_prompt(system_prompt))
         
         # Add user message
-        messages.append({"role": "user", "content": data.query})
+        messages.append("user", data.query)
         
         # Track tool usage
         tool_usage = []
@@ -118,18 +128,16 @@ async def react_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
         # ReAct loop
         for _ in range(max_steps):
             # Get next action from LLM
-            response = await llm.acomplete(
-                messages=messages,
-                callbacks=[token_counter]
-            )
+            reply = await complete_chat(llm, messages, token_counter)
             
             # Parse tool call
-            tool_call = parse_tool_call(response.response)
+            tool_call = parse_tool_call(reply)
             
             if tool_call and tool_call["tool"] in TOOLS:
                 # Execute tool
                 tool = TOOLS[tool_call["tool"]]
-                result = await tool(**{"query": tool_call["input"]})
+                with stage("tools"):
+                    result = await tool(**{"query": tool_call["input"]})
                 
                 # Track usage
                 tool_usage.append({
@@ -139,11 +147,11 @@ async def react_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
                 })
                 
                 # Add to conversation
-                messages.append({"role": "assistant", "content": response.response})
-                messages.append({"role": "system", "content": f"Tool result: {result}"})
+                messages.append("assistant", reply)
+                messages.append("system", f"Tool result: {result}")
             else:
                 # Final response
-                messages.append({"role": "assistant", "content": response.response})
+                messages.append("assistant", reply)
                 break
         
         # Get token counts
@@ -152,11 +160,12 @@ async def react_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
             llm_completion_tokens=token_counter.completion_llm_token_count,
             total_llm_tokens=token_counter.total_llm_token_count
         )
-        token_counter.reset_counts()
+        prefix_counts = token_counter.prefix_counts()
         
-        # Prepare metadata
+        # Prepare metadata, including how much of the prompt was the
+        # cacheable static prefix
         metadata = {
-            "token_counts": token_counts.dict(),
+            "token_counts": {**token_counts.dict(), **prefix_counts},
             "tool_usage": tool_usage
         }
         if data.metadata:
@@ -164,10 +173,10 @@ async def react_handler(data: WhiskQuerySchema, llm=None, system_prompt=None) ->
             
         return WhiskQueryBaseResponseSchema(
             input=data.query,
-            output=response.response,
+            output=reply,
             metadata=metadata,
             token_counts=token_counts,
-            messages=messages
+            messages=messages.to_list()
         )
             
     except Exception as e:
@@ -1,54 +1,63 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from whisk.kitchenai_sdk.kitchenai import KitchenAIApp
 from whisk.kitchenai_sdk.schema import DependencyType
 
-from .dependencies.llm import setup_llm
-from .utils.token_counter import create_token_counter
-from .handlers import react
+from .utils.lazy import LazyDependency, lazy_handler, warm_up, LAZY_START
+from .utils.concurrency import limiter, reject_query
+from .utils.metrics import instrument
+from .utils.profiling import profiled
+from .utils.prompts import compile_prompt
+from .utils.token_counter import get_encoding
 
 # Load environment variables
 load_dotenv()
 
-# Initialize token counter
-token_counter = create_token_counter()
+# Heavy imports (llama_index, tiktoken) happen inside the dependency
+# factories and handler modules, which load on first use.
+def build_llm():
+    from .dependencies.llm import setup_llm
+    from .utils.token_counter import create_token_counter
+    return setup_llm(create_token_counter())
 
 # Initialize dependencies
-llm = setup_llm(token_counter)
+llm = LazyDependency(build_llm)
+
+# The system prompt is pretokenized once, at warm-up, and shared by every request
+system_prompt = LazyDependency(compile_prompt, "{{ cookiecutter.system_prompt }}")
+
+# Shared tiktoken encoding, loaded once for every handler
+encoding = LazyDependency(get_encoding)
 
 # Initialize KitchenAI App
 kitchen = KitchenAIApp(namespace="{{ cookiecutter.project_slug }}")
 
 # Register dependencies
 kitchen.register_dependency(DependencyType.LLM, llm)
-kitchen.register_dependency(DependencyType.SYSTEM_PROMPT, "{{ cookiecutter.system_prompt }}")
+kitchen.register_dependency(DependencyType.SYSTEM_PROMPT, system_prompt)
 
-# Register handlers
+# Register instrumented handlers, bounded by the per-worker concurrency limit
+# and profiled when sampled or requested through metadata
 kitchen.query.handler("react", DependencyType.LLM, DependencyType.SYSTEM_PROMPT)(
-    react.react_handler
+    instrument("react", limiter.limit(
+        profiled(lazy_handler(f"{__package__}.handlers.react", "react_handler")), reject_query
+    ))
 )
 
+if not LAZY_START:
+    warm_up()
+
+async def startup():
+    """Background startup work run alongside the client"""
+    # Load models in the background so the first request finds them warm
+    await asyncio.to_thread(warm_up)
+
 if __name__ == "__main__":
-    from whisk.client import WhiskClient
-    import asyncio
     import logging
+    from .worker import run_worker
 
     # Setup logging
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    client = WhiskClient(
-        nats_url=os.getenv("WHISK_NATS_URL", "nats://nats.playground.kitchenai.dev"),
-        client_id=os.getenv("WHISK_CLIENT_ID", "whisk_client"),
-        user=os.getenv("WHISK_NATS_USER", "playground"),
-        password=os.getenv("WHISK_NATS_PASSWORD", "kitchenai_playground"),
-        kitchen=kitchen,
-    )
-    
-    async def start():
-        await client.run()
-
-    try:
-        asyncio.run(start())
-    except KeyboardInterrupt:
-        logger.info("\nShutting down gracefully...") 
\ No newline at end of file
+
+    run_worker(kitchen, startup)
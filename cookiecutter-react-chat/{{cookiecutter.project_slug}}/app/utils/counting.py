@@ -0,0 +1,73 @@
+from typing import Any, Dict, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload, TokenCountingHandler
+from llama_index.core.utilities.token_counting import TokenCounter
+
+from .prompts import static_token_count
+
+def _field(value, name: str):
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+def cached_tokens(response) -> int:
+    """Prompt tokens the provider reports as served from its prompt cache"""
+    usage = _field(getattr(response, "raw", None), "usage")
+    return _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+
+class PromptTokenCounter(TokenCounter):
+    """Counts registered static prompts from their precomputed counts and
+    everything else with ``count``, the shared memoized counter"""
+
+    def __init__(self, tokenizer=None, count=None):
+        super().__init__(tokenizer=tokenizer)
+        self.count = count or (lambda text: len(self.tokenizer(text)))
+
+    def get_string_tokens(self, string: str) -> int:
+        count = static_token_count(string)
+        return count if count is not None else self.count(string)
+
+    def estimate_tokens_in_messages(self, messages) -> int:
+        # Count plain text messages with our tokenizer; ChatMessage.estimate_tokens
+        # would retokenize them with the global one, a message at a time
+        tokens = 0
+        for message in messages:
+            if message.additional_kwargs:
+                tokens += super().estimate_tokens_in_messages([message])
+                continue
+            if message.role:
+                tokens += self.get_string_tokens(message.role.value)
+            tokens += self.get_string_tokens(message.content or "")
+        return tokens
+
+class PromptTokenCountingHandler(TokenCountingHandler):
+    """``TokenCountingHandler`` that also tracks the static prompt prefix.
+
+    ``prefix_token_count`` adds up the tokens of the static prompt leading
+    each LLM call, the part of the prompt a provider-side prompt cache can
+    serve; ``cached_prompt_token_count`` adds up what the provider reports
+    it actually served from the cache.
+    """
+
+    def __init__(self, tokenizer=None, count=None, **kwargs):
+        super().__init__(tokenizer=tokenizer, **kwargs)
+        self._token_counter = PromptTokenCounter(tokenizer=self.tokenizer, count=count)
+        self.prefix_token_count = 0
+        self.cached_prompt_token_count = 0
+
+    def on_event_end(self, event_type: CBEventType, payload: Optional[Dict[str, Any]] = None,
+                     event_id: str = "", **kwargs: Any) -> None:
+        if event_type == CBEventType.LLM and payload and payload.get(EventPayload.MESSAGES):
+            first = payload[EventPayload.MESSAGES][0]
+            self.prefix_token_count += static_token_count(first.content) or 0
+            self.cached_prompt_token_count += cached_tokens(payload.get(EventPayload.RESPONSE))
+        super().on_event_end(event_type, payload=payload, event_id=event_id, **kwargs)
+
+    def prefix_counts(self) -> dict:
+        return {
+            "static_prefix_tokens": self.prefix_token_count,
+            "cached_prompt_tokens": self.cached_prompt_token_count
+        }
+
+    def reset_counts(self) -> None:
+        super().reset_counts()
+        self.prefix_token_count = 0
+        self.cached_prompt_token_count = 0
@@ -0,0 +1,99 @@
+import functools
+import importlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Defer heavy imports and model loads until first use (set to "false" to load eagerly)
+LAZY_START = os.getenv("WHISK_LAZY_START", "true").lower() in ("1", "true", "yes")
+
+_registry = []
+
+class LazyDependency:
+    """Dependency placeholder that builds the real object on first use.
+
+    Register it with the kitchen like any other dependency; handlers wrapped
+    with ``lazy_handler`` receive the built object instead of the placeholder.
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        self._factory = functools.partial(factory, *args, **kwargs)
+        self._name = getattr(factory, "__name__", repr(factory))
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    self._loaded = True
+                    logger.info(f"Loaded {self._name} in {time.perf_counter() - started:.2f}s")
+        return self._value
+
+    def reload(self, factory=None):
+        """Build the object again, with ``factory`` if given, and hand it out
+        from now on.
+
+        Requests that already resolved the old object keep using it. The new
+        object is built before the swap, so a failing build leaves the old
+        one in place. Nothing is built if the dependency was never loaded.
+        """
+        if not self._loaded:
+            return
+        started = time.perf_counter()
+        value = (factory or self._factory)()
+        with self._lock:
+            self._value = value
+        logger.info(f"Reloaded {self._name} in {time.perf_counter() - started:.2f}s")
+
+def resolve(value):
+    """Return the built object for a ``LazyDependency``, anything else as-is"""
+    return value.get() if isinstance(value, LazyDependency) else value
+
+class _LazyFunction:
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+        self._func = None
+        _registry.append(self)
+
+    def get(self):
+        if self._func is None:
+            started = time.perf_counter()
+            self._func = getattr(importlib.import_module(self.module), self.name)
+            logger.info(f"Imported {self.module} in {time.perf_counter() - started:.2f}s")
+        return self._func
+
+def lazy_handler(module: str, name: str):
+    """Handler that imports ``module`` and builds its dependencies on first call"""
+    target = _LazyFunction(module, name)
+
+    async def handler(*args, **kwargs):
+        kwargs = {key: resolve(value) for key, value in kwargs.items()}
+        return await target.get()(*args, **kwargs)
+
+    handler.__name__ = handler.__qualname__ = name
+    handler.__module__ = module
+    return handler
+
+def warm_up():
+    """Import every lazy handler and build every lazy dependency now"""
+    started = time.perf_counter()
+    for item in list(_registry):
+        try:
+            item.get()
+        except Exception as e:
+            # Leave it for the first request to surface the error
+            logger.error(f"Warm-up failed: {str(e)}")
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
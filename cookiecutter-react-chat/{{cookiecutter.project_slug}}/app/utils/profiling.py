@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Requests with metadata {"profile": "true"} are always profiled, others at this rate
+PROFILE_KEY = "profile"
+SAMPLE_RATE = float(os.getenv("WHISK_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("WHISK_PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+# Traceback depth recorded per allocation; tracing cost grows with it
+TRACE_FRAMES = int(os.getenv("WHISK_PROFILE_TRACE_FRAMES", "1"))
+# Labels and request ids come from the request; anything else is hashed
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        _tracing_users += 1
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+class StackSampler:
+    """Samples the stacks of all other threads every ``interval`` seconds.
+
+    Stacks are aggregated in the folded format understood by flamegraph.pl
+    and speedscope. Concurrent requests share the event loop thread, so their
+    frames show up in each other's profiles.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="whisk-profiler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or names.get(thread_id, "").startswith("whisk-profiler"):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class RequestProfile:
+    """CPU samples and allocation snapshots for one handler invocation"""
+
+    def __init__(self, path: str, interval: float = 0.005):
+        self.path = path
+        self.sampler = StackSampler(interval)
+        self._start_snapshot = None
+        self._end_snapshot = None
+
+    def start(self):
+        _start_tracing()
+        tracemalloc.reset_peak()
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+        self.wall_ms = (time.perf_counter() - self._wall) * 1000
+        self.cpu_ms = (time.process_time() - self._cpu) * 1000
+        self._end_snapshot = tracemalloc.take_snapshot()
+        self.peak_traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        _stop_tracing()
+
+    def write(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "cpu.folded"), "w") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        self._end_snapshot.dump(os.path.join(self.path, "allocations.snapshot"))
+        diff = self._end_snapshot.compare_to(self._start_snapshot, "lineno")
+        with open(os.path.join(self.path, "allocations.txt"), "w") as f:
+            for stat in diff[:50]:
+                f.write(f"{stat}\n")
+
+        with open(os.path.join(self.path, "summary.json"), "w") as f:
+            json.dump({
+                "wall_ms": round(self.wall_ms, 2),
+                "cpu_ms": round(self.cpu_ms, 2),
+                "samples": self.sampler.samples,
+                "interval_s": self.sampler.interval,
+                "allocated_mb": round(sum(stat.size_diff for stat in diff) / (1024 * 1024), 3),
+                "peak_traced_mb": round(self.peak_traced_mb, 3)
+            }, f, indent=2)
+
+def should_profile(metadata: dict | None) -> bool:
+    if metadata and str(metadata.get(PROFILE_KEY, "")).lower() in ("1", "true", "yes"):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+def _safe_name(value) -> str:
+    value = str(value)
+    return value if _SAFE_NAME.match(value) else hashlib.sha256(value.encode()).hexdigest()[:16]
+
+def profile_path(output_dir: str, label, request_id) -> str:
+    """Directory of one request's profile, always directly under ``output_dir``"""
+    root = os.path.realpath(output_dir)
+    path = os.path.join(root, f"{_safe_name(label)}-{_safe_name(request_id)}")
+    # Also refuses a symlink planted under the profile directory
+    if os.path.dirname(os.path.realpath(path)) != root:
+        raise ValueError(f"Profile path {path!r} is outside {root!r}")
+    return path
+
+def profiled(handler, output_dir: str | None = None, interval: float = 0.005):
+    """Profile sampled invocations of ``handler``.
+
+    Each profiled request writes ``cpu.folded``, ``allocations.txt``,
+    ``allocations.snapshot`` and ``summary.json`` to
+    ``<output_dir>/<label>-<request id>`` and returns that path under
+    ``metadata["profile_path"]``; a label or request id with characters other
+    than letters, digits, ``_`` and ``-`` is replaced by its hash. Other
+    requests only pay for the sampling check.
+    """
+    @functools.wraps(handler)
+    async def wrapper(data, *args, **kwargs):
+        metadata = getattr(data, "metadata", None)
+        enabled = should_profile(metadata)
+
+        # Keep the flag out of the handler, e.g. out of metadata filters
+        if metadata and PROFILE_KEY in metadata:
+            metadata = {key: value for key, value in metadata.items() if key != PROFILE_KEY}
+            data = data.model_copy(update={"metadata": metadata})
+        if not enabled:
+            return await handler(data, *args, **kwargs)
+
+        request_id = (metadata or {}).get("request_id") or uuid.uuid4().hex[:12]
+        try:
+            path = profile_path(output_dir or PROFILE_DIR, getattr(data, "label", "request"), request_id)
+        except ValueError as e:
+            logger.error(f"Not profiling request: {str(e)}")
+            return await handler(data, *args, **kwargs)
+
+        profile = RequestProfile(path, interval)
+        profile.start()
+        try:
+            response = await handler(data, *args, **kwargs)
+        finally:
+            profile.stop()
+            try:
+                await asyncio.to_thread(profile.write)
+                logger.info(f"Wrote profile to {path}")
+            except Exception as e:
+                logger.error(f"Error writing profile: {str(e)}")
+
+        if hasattr(response, "metadata"):
+            response.metadata = {**(response.metadata or {}), "profile_path": path}
+        return response
+    return wrapper
@@ -0,0 +1,120 @@
+"""Speed and error of approximate token counting against the exact encoding.
+
+Counts a corpus of prose, code and non-English text both ways and reports,
+for short (under 1 KB) and long texts, the time each strategy takes, the
+speedup and the relative error of the estimate. ``--calibrate`` fits the
+estimator's coefficients on half the corpus by least squares, reports the
+error on the other half and prints the setting to use:
+
+    python -m benchmarks.tokens --files docs/*.md --calibrate
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.utils import token_counter
+from app.utils.token_estimate import COEFFICIENTS, estimate_tokens, token_features
+
+from .fakes import FakeEncoding, fake_text
+from .harness import percentile
+
+logger = logging.getLogger(__name__)
+
+def corpus(files: list[str], samples: int) -> list[str]:
+    texts = [Path(file).read_text(errors="ignore") for file in files]
+    for i in range(samples):
+        texts.append(fake_text(f"prose-{i}", 10 + (i * 97) % 3000))
+        texts.append(
+            f"def handler_{i}(data, limit={i * 13}):\n"
+            f"    return [item.value for item in data if item.score > 0.{i % 10}]\n" * (1 + i % 40)
+        )
+        texts.append("Le café naïve à Zürich, 東京の天気は晴れ, ¿qué tal? " * (1 + i % 30))
+    return texts
+
+def reference_encoding():
+    """The exact encoding, or a whitespace tokenizer when it cannot be loaded"""
+    try:
+        return token_counter.get_encoding(), "tiktoken"
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable ({str(e)}), comparing against whitespace tokens")
+        return FakeEncoding(), "whitespace"
+
+def measure(texts: list[str], encoding, coefficients: np.ndarray) -> dict:
+    started = time.perf_counter()
+    exact = [len(encoding.encode(text)) for text in texts]
+    exact_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    approximate = [estimate_tokens(text, coefficients) for text in texts]
+    approximate_s = time.perf_counter() - started
+
+    errors = [abs(a - e) / e for a, e in zip(approximate, exact) if e]
+    return {
+        "texts": len(texts),
+        "exact_tokens": sum(exact),
+        "exact_ms": round(exact_s * 1000, 2),
+        "approximate_ms": round(approximate_s * 1000, 2),
+        "speedup": round(exact_s / approximate_s, 2) if approximate_s else 0.0,
+        "total_error": round((sum(approximate) - sum(exact)) / max(sum(exact), 1), 4),
+        "mean_abs_error": round(float(np.mean(errors)), 4) if errors else 0.0,
+        "p95_abs_error": round(percentile(errors, 95), 4),
+        "max_abs_error": round(max(errors), 4) if errors else 0.0,
+    }
+
+def calibrate(texts: list[str], encoding) -> np.ndarray:
+    """Least-squares coefficients mapping ``token_features`` to exact counts"""
+    features = np.array([token_features(text) for text in texts])
+    counts = np.array([len(encoding.encode(text)) for text in texts])
+    coefficients, *_ = np.linalg.lstsq(features, counts, rcond=None)
+    return np.round(np.clip(coefficients, 0, None), 4)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", nargs="*", default=[], help="Extra text files to include")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--calibrate", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    texts = corpus(args.files, args.samples)
+    encoding, reference = reference_encoding()
+
+    coefficients = COEFFICIENTS
+    if args.calibrate:
+        # Fit on one half and report the error on the other
+        coefficients = calibrate(texts[::2], encoding)
+        texts = texts[1::2]
+
+    results = {
+        bucket: measure(subset, encoding, coefficients)
+        for bucket, subset in (
+            ("short", [text for text in texts if len(text.encode()) < 1024]),
+            ("long", [text for text in texts if len(text.encode()) >= 1024]),
+            ("all", texts),
+        )
+        if subset
+    }
+
+    if args.json:
+        print(json.dumps({"reference": reference, "coefficients": coefficients.tolist(), **results}, indent=2))
+    else:
+        print(f"reference: {reference}")
+        for bucket, result in results.items():
+            print(
+                f"{bucket:<6} {result['texts']:>5} texts  exact {result['exact_ms']:>9.1f} ms  "
+                f"approx {result['approximate_ms']:>8.1f} ms  speedup {result['speedup']:>6.1f}x  "
+                f"error mean {result['mean_abs_error']:.1%} p95 {result['p95_abs_error']:.1%} "
+                f"max {result['max_abs_error']:.1%} total {result['total_error']:+.1%}"
+            )
+    if args.calibrate:
+        print("WHISK_TOKEN_ESTIMATE_COEFFS=" + ",".join(str(value) for value in coefficients.tolist()))
+
+if __name__ == "__main__":
+    main()